@@ -40,6 +40,10 @@ def _apport_append_logfiles(report, logdir="/var/log/dist-upgrade/"):
 
 def apport_crash(type, value, tb):
     logging.debug("running apport_crash()")
+    # the traceback may still be queued for the log writer thread,
+    # main.log is attached to the report
+    for handler in logging.getLogger().handlers:
+        handler.flush()
     if "RELEASE_UPRADER_NO_APPORT" in os.environ:
         logging.debug("RELEASE_UPRADER_NO_APPORT env set")
         return False
@@ -30,10 +30,15 @@ import time
 import datetime
 import threading
 import configparser
-from subprocess import Popen, PIPE
 
 from .DistUpgradeGettext import gettext as _
 from .DistUpgradeGettext import ngettext
+from .DistUpgradeHookQueue import RestartQueue, RESTART_JOBS
+from .DistUpgradeMemory import read_rss, release_heap
+from .DistUpgradePackageIndex import PackageNameIndex
+from .DistUpgradeResolverWorker import (
+    ResolverWorkerError, resolve_in_worker)
+from .DistUpgradeSystemFacts import get_system_facts
 
 from .utils import inside_chroot
 
@@ -82,7 +87,56 @@ def estimate_kernel_initrd_size_in_boot():
         initrd_buffer = initrd * 0.05
     initrd += initrd_buffer
     return kernel,initrd
-KERNEL_SIZE, INITRD_SIZE = estimate_kernel_initrd_size_in_boot()
+
+
+_kernel_initrd_size = None
+
+
+def kernel_initrd_size_in_boot():
+    """ the estimate of the kernel and initrd size, /boot is only
+        looked at the first time this is called
+    """
+    global _kernel_initrd_size
+    if _kernel_initrd_size is None:
+        _kernel_initrd_size = estimate_kernel_initrd_size_in_boot()
+    return _kernel_initrd_size
+
+
+def __getattr__(name):
+    # KERNEL_SIZE and INITRD_SIZE are not calculated on import
+    if name == "KERNEL_SIZE":
+        return kernel_initrd_size_in_boot()[0]
+    elif name == "INITRD_SIZE":
+        return kernel_initrd_size_in_boot()[1]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+DPKG_LOG = "/var/log/dpkg.log"
+
+
+class TriggerLog(object):
+    """ count the trigger runs dpkg logs from now on """
+
+    def __init__(self, path=None):
+        self.path = path or DPKG_LOG
+        try:
+            self.offset = os.path.getsize(self.path)
+        except OSError:
+            self.offset = 0
+
+    def count(self):
+        """ the number of trigproc lines logged since __init__ """
+        runs = 0
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                for line in f:
+                    fields = line.split(None, 3)
+                    if len(fields) > 2 and fields[2] == b"trigproc":
+                        runs += 1
+        except (IOError, OSError) as e:
+            logging.debug("can not read '%s': %s", self.path, e)
+        return runs
 
 
 class FreeSpaceRequired(object):
@@ -115,14 +169,18 @@ class MyCache(apt.Cache):
     HoldReInstReq = 3
 
     # init
-    def __init__(self, config, view, quirks, progress=None, lock=True):
+    def __init__(self, config, view, quirks, progress=None, lock=True,
+                 facts=None):
         self.to_install = []
         self.to_remove = []
+        # packages marked for removal that should be purged as well
+        self.purge_marked = set()
         self.view = view
         self.quirks = quirks
         self.lock = False
         self.partialUpgrade = False
         self.config = config
+        self.facts = facts or get_system_facts()
         self.metapkgs = self.config.getlist("Distro", "MetaPkgs")
         # acquire lock
         self._listsLock = -1
@@ -142,8 +200,7 @@ class MyCache(apt.Cache):
         self.removal_blacklist = config.getListFromFile("Distro", "RemovalBlacklistFile")
         # the linux metapackage should not be removed
         self.linux_metapackage = self.quirks._get_linux_metapackage(self, False)
-        self.uname = Popen(["uname", "-r"], stdout=PIPE,
-                           universal_newlines=True).communicate()[0].strip()
+        self.uname = self.facts.kernel_release
         self._initAptLog()
         # from hardy on we use recommends by default, so for the
         # transition to the new dist we need to enable them now
@@ -154,25 +211,58 @@ class MyCache(apt.Cache):
 
         apt_pkg.config.set("APT::AutoRemove::SuggestsImportant", "false")
 
+    def open(self, progress=None):
+        # the names only change when the cache is (re)opened
+        self._name_index = None
+        apt.Cache.open(self, progress)
+
+    @property
+    def name_index(self):
+        " the sorted package names for prefix queries "
+        if self._name_index is None:
+            self._name_index = PackageNameIndex(self)
+        return self._name_index
+
+    def _raw_packages(self):
+        """ the apt_pkg.Package of every package that is in the cache,
+            without creating the apt.Package wrappers
+        """
+        for rawpkg in self._cache.packages:
+            if rawpkg.has_versions:
+                yield rawpkg
+
+    def release_memory(self):
+        """ drop what is only needed to calculate the upgrade """
+        (before, peak) = read_rss()
+        self._name_index = None
+        self._latest_kernel = None
+        self._sorted_set = None
+        self.to_install = []
+        self.to_remove = []
+        release_heap()
+        logging.info("released memory, rss %.1f MB -> %.1f MB",
+                     before / 1024.0 / 1024, read_rss()[0] / 1024.0 / 1024)
+
     def _apply_dselect_upgrade(self):
         """ honor the dselect install state """
-        for pkg in self:
-            if pkg.is_installed:
+        for rawpkg in self._raw_packages():
+            if rawpkg.current_ver:
                 continue
-            if pkg._pkg.selected_state == apt_pkg.SELSTATE_INSTALL:
+            if rawpkg.selected_state == apt_pkg.SELSTATE_INSTALL:
                 # upgrade() will take care of this
+                pkg = self[rawpkg.get_fullname(True)]
                 pkg.mark_install(auto_inst=False, auto_fix=False)
 
     @property
     def req_reinstall_pkgs(self):
         " return the packages not downloadable packages in reqreinst state "
         reqreinst = set()
-        for pkg in self:
-            if ((not pkg.candidate or not pkg.candidate.downloadable)
-                and
-                (pkg._pkg.inst_state == self.ReInstReq or
-                 pkg._pkg.inst_state == self.HoldReInstReq)):
-                reqreinst.add(pkg.name)
+        for rawpkg in self._raw_packages():
+            if rawpkg.inst_state not in (self.ReInstReq, self.HoldReInstReq):
+                continue
+            ver = self._depcache.get_candidate_ver(rawpkg)
+            if not ver or not ver.downloadable:
+                reqreinst.add(rawpkg.get_fullname(True))
         return reqreinst
 
     def fix_req_reinst(self, view):
@@ -306,7 +396,49 @@ class MyCache(apt.Cache):
         logging.info("cache.commit()")
         if self.lock:
             self.release_lock()
-        apt.Cache.commit(self, fprogress, iprogress)
+        defer_triggers = self.config.getWithDefault(
+            "Distro", "DeferTriggers", False)
+        trigger_log = TriggerLog()
+        start = time.time()
+        if defer_triggers:
+            # dpkg is called with --no-triggers, the triggers are run
+            # by the final "dpkg --configure --pending"
+            backup = dict((key, apt_pkg.config.get(key))
+                          for key in ("DPkg::NoTriggers",
+                                      "DPkg::ConfigurePending")
+                          if apt_pkg.config.exists(key))
+            apt_pkg.config.set("DPkg::NoTriggers", "true")
+            apt_pkg.config.set("DPkg::ConfigurePending", "true")
+        try:
+            apt.Cache.commit(self, fprogress, iprogress)
+            if defer_triggers:
+                self._run_pending_triggers()
+        finally:
+            if defer_triggers:
+                for key in ("DPkg::NoTriggers", "DPkg::ConfigurePending"):
+                    if key in backup:
+                        apt_pkg.config.set(key, backup[key])
+                    else:
+                        apt_pkg.config.clear(key)
+            logging.info("cache.commit() ran %s triggers (deferred=%s) "
+                         "and took %.1fs", trigger_log.count(),
+                         defer_triggers, time.time() - start)
+            # the restarts invoke-rc.d queued during the commit
+            restart_queue = RestartQueue.from_environ(
+                self.config.getWithDefault("Distro", "RestartJobs",
+                                           RESTART_JOBS))
+            if restart_queue is not None:
+                restart_queue.flush()
+
+    def _run_pending_triggers(self):
+        """ process whatever triggers are still pending after the
+            commit in one go
+        """
+        start = time.time()
+        res = self.view.getTerminal().call(
+            ["/usr/bin/dpkg", "--triggers-only", "--pending"])
+        logging.info("dpkg --triggers-only --pending returned %s "
+                     "and took %.1fs", res, time.time() - start)
 
     def release_lock(self, pkgSystemOnly=True):
         if self.lock:
@@ -314,7 +446,7 @@ class MyCache(apt.Cache):
                 apt_pkg.pkgsystem_unlock()
                 self.lock = False
             except SystemError as e:
-                logging.debug("failed to SystemUnLock() (%s) " % e)
+                logging.debug("failed to SystemUnLock() (%s) ", e)
 
     def get_lock(self, pkgSystemOnly=True):
         if not self.lock:
@@ -322,7 +454,7 @@ class MyCache(apt.Cache):
                 apt_pkg.pkgsystem_lock()
                 self.lock = True
             except SystemError as e:
-                logging.debug("failed to SystemLock() (%s) " % e)
+                logging.debug("failed to SystemLock() (%s) ", e)
 
     def downloadable(self, pkg, useCandidate=True):
         " check if the given pkg can be downloaded "
@@ -331,7 +463,7 @@ class MyCache(apt.Cache):
         else:
             ver = pkg._pkg.current_ver
         if ver == None:
-            logging.warning("no version information for '%s' (useCandidate=%s)" % (pkg.name, useCandidate))
+            logging.warning("no version information for '%s' (useCandidate=%s)", pkg.name, useCandidate)
             return False
         return ver.downloadable
 
@@ -357,6 +489,7 @@ class MyCache(apt.Cache):
 
     def clear(self):
         self._depcache.init()
+        self.purge_marked = set()
 
     def restore_snapshot(self):
         """ restore a snapshot """
@@ -389,7 +522,7 @@ class MyCache(apt.Cache):
         for key in metapkgs:
             # if it is installed we are done
             if key in self and self[key].is_installed:
-                logging.debug("need_server_mode(): run in 'desktop' mode, (because of pkg '%s')" % key)
+                logging.debug("need_server_mode(): run in 'desktop' mode, (because of pkg '%s')", key)
                 return False
             # if it is not installed, but its key depends are installed
             # we are done too (we auto-select the package later)
@@ -397,7 +530,7 @@ class MyCache(apt.Cache):
             for pkg in self.config.getlist(key, "KeyDependencies"):
                 deps_found &= pkg in self and self[pkg].is_installed
             if deps_found:
-                logging.debug("need_server_mode(): run in 'desktop' mode, (because of key deps for '%s')" % key)
+                logging.debug("need_server_mode(): run in 'desktop' mode, (because of key deps for '%s')", key)
                 return False
         logging.debug("need_server_mode(): can not find a desktop meta package or key deps, running in server mode")
         return True
@@ -421,33 +554,34 @@ class MyCache(apt.Cache):
         return True
 
     def mark_install(self, pkg, reason="", **flags):
-        logging.debug("Installing '%s' (%s)" % (pkg, reason))
+        logging.debug("Installing '%s' (%s)", pkg, reason)
         if pkg in self:
             self[pkg].mark_install(**flags)
             if not (self[pkg].marked_install or self[pkg].marked_upgrade):
-                logging.error("Installing/upgrading '%s' failed" % pkg)
+                logging.error("Installing/upgrading '%s' failed", pkg)
                 #raise SystemError("Installing '%s' failed" % pkg)
                 return False
         return True
 
     def mark_upgrade(self, pkg, reason=""):
-        logging.debug("Upgrading '%s' (%s)" % (pkg, reason))
+        logging.debug("Upgrading '%s' (%s)", pkg, reason)
         if pkg in self and self[pkg].is_installed:
             self[pkg].mark_upgrade()
             if not self[pkg].marked_upgrade:
-                logging.error("Upgrading '%s' failed" % pkg)
+                logging.error("Upgrading '%s' failed", pkg)
                 return False
         return True
 
     def mark_remove(self, pkg, reason="", **flags):
-        logging.debug("Removing '%s' (%s)" % (pkg, reason))
+        logging.debug("Removing '%s' (%s)", pkg, reason)
         if pkg in self:
             self[pkg].mark_delete(**flags)
 
     def mark_purge(self, pkg, reason=""):
-        logging.debug("Purging '%s' (%s)" % (pkg, reason))
+        logging.debug("Purging '%s' (%s)", pkg, reason)
         if pkg in self:
             self._depcache.mark_delete(self[pkg]._pkg, True)
+            self.purge_marked.add(pkg)
 
     def _keep_installed(self, pkgname, reason):
         if (pkgname in self
@@ -526,7 +660,7 @@ class MyCache(apt.Cache):
         except (ImportError, SyntaxError) as e:
             # SyntaxError is temporary until the port of NvidiaDetector to
             # Python 3 is in the archive.
-            logging.error("NvidiaDetector can not be imported %s" % e)
+            logging.error("NvidiaDetector can not be imported %s", e)
             return False
         try:
             # get new detection module and use the modalises files
@@ -543,23 +677,22 @@ class MyCache(apt.Cache):
                 return False
             # check which one to use
             driver = nv.selectDriver()
-            logging.debug("nv.selectDriver() returned '%s'" % driver)
+            logging.debug("nv.selectDriver() returned '%s'", driver)
             if not driver in self:
-                logging.warning("no '%s' found" % driver)
+                logging.warning("no '%s' found", driver)
                 return False
             if not (self[driver].marked_install or self[driver].marked_upgrade):
                 self[driver].mark_install()
-                logging.info("installing %s as suggested by NvidiaDetector" % driver)
+                logging.info("installing %s as suggested by NvidiaDetector", driver)
                 return True
         except Exception as e:
-            logging.error("NvidiaDetection returned a error: %s" % e)
+            logging.error("NvidiaDetection returned a error: %s", e)
         return False
 
 
     def _has_kernel_headers_installed(self):
-        for pkg in self:
-            if (pkg.name.startswith("linux-headers-") and
-                pkg.is_installed):
+        for pkg in self.name_index.with_prefix("linux-headers-"):
+            if pkg.is_installed:
                 return True
         return False
 
@@ -567,15 +700,14 @@ class MyCache(apt.Cache):
         """ check for the running kernel and try to ensure that we have
             an updated version
         """
-        logging.debug("Kernel uname: '%s' " % self.uname)
+        logging.debug("Kernel uname: '%s' ", self.uname)
         try:
             (version, build, flavour) = self.uname.split("-")
         except Exception as e:
-            logging.warning("Can't parse kernel uname: '%s' (self compiled?)" % e)
+            logging.warning("Can't parse kernel uname: '%s' (self compiled?)", e)
             return False
         # now check if we have a SMP system
-        dmesg = Popen(["dmesg"], stdout=PIPE).communicate()[0]
-        if b"WARNING: NR_CPUS limit" in dmesg:
+        if self.facts.cpu_limit_reached:
             logging.debug("UP kernel on SMP system!?!")
         return True
 
@@ -589,7 +721,7 @@ class MyCache(apt.Cache):
             # WORKAROUND bug on the CD/python-apt #253255
             ver = pkg._pcache._depcache.get_candidate_ver(pkg._pkg)
             if ver and ver.priority == 0:
-                logging.error("Package %s has no priority set" % pkg.name)
+                logging.error("Package %s has no priority set", pkg.name)
                 continue
             if (pkg.candidate and pkg.candidate.downloadable and
                 not (pkg.is_installed or pkg.marked_install) and
@@ -611,53 +743,76 @@ class MyCache(apt.Cache):
         view.pulseProgress(finished=True)
         view.processEvents()
 
-    @withResolverLog
-    def distUpgrade(self, view, serverMode, partialUpgrade):
-        # keep the GUI alive
-        lock = threading.Lock()
-        lock.acquire()
-        t = threading.Thread(target=self.updateGUI, args=(self.view, lock,))
-        t.start()
-        try:
-            # mvo: disabled as it casues to many errornous installs
-            #self._apply_dselect_upgrade()
+    def _resolve(self, view, serverMode):
+        """ calculate the dist-upgrade, raises SystemError """
+        # run PreDistUpgradeCache quirks
+        self.pre_upgrade_rule()
 
-            # run PreDistUpgradeCache quirks
-            self.pre_upgrade_rule()
+        # upgrade (and make sure this way that the cache is ok)
+        self.upgrade(True)
 
-            # upgrade (and make sure this way that the cache is ok)
-            self.upgrade(True)
+        # check that everything in priority required is installed
+        self.checkPriority()
 
-            # check that everything in priority required is installed
-            self.checkPriority()
+        # see if our KeepInstalled rules are honored
+        self.keep_installed_rule()
 
-            # see if our KeepInstalled rules are honored
-            self.keep_installed_rule()
+        # check if we got a new kernel (if we are not inside a
+        # chroot)
+        if inside_chroot():
+            logging.warning("skipping kernel checks because we run inside a chroot")
+        else:
+            self.checkForKernel()
 
-            # check if we got a new kernel (if we are not inside a
-            # chroot)
-            if inside_chroot():
-                logging.warning("skipping kernel checks because we run inside a chroot")
-            else:
-                self.checkForKernel()
+        # check for nvidia stuff
+        self.checkForNvidia()
 
-            # check for nvidia stuff
-            self.checkForNvidia()
+        # and if we have some special rules
+        self.post_upgrade_rule()
 
-            # and if we have some special rules
-            self.post_upgrade_rule()
+        # install missing meta-packages (if not in server upgrade mode)
+        self._keepBaseMetaPkgsInstalled(view)
+        if not serverMode:
+            # if this fails, a system error is raised
+            self._installMetaPkgs(view)
 
-            # install missing meta-packages (if not in server upgrade mode)
-            self._keepBaseMetaPkgsInstalled(view)
-            if not serverMode:
-                # if this fails, a system error is raised
-                self._installMetaPkgs(view)
+        # see if it all makes sense, if not this function raises
+        self._verifyChanges()
 
-            # see if it all makes sense, if not this function raises
-            self._verifyChanges()
+        if self.is_broken:
+            raise SystemError(_("Broken packages after upgrade: %s") % ", ".join(p.name for p in self if p.is_inst_broken or p.is_now_broken))
 
-            if self.is_broken:
-                raise SystemError(_("Broken packages after upgrade: %s") % ", ".join(p.name for p in self if p.is_inst_broken or p.is_now_broken))
+    def _resolveInWorker(self, view, serverMode):
+        """ calculate the dist-upgrade in a forked worker, the GUI
+            thread has the interpreter for itself meanwhile
+        """
+        try:
+            resolve_in_worker(
+                self, view, lambda view: self._resolve(view, serverMode))
+        except ResolverWorkerError as e:
+            logging.warning("resolving in a worker failed (%s), "
+                            "resolving here", e)
+            self.clear()
+            self._resolve(view, serverMode)
+
+    @withResolverLog
+    def distUpgrade(self, view, serverMode, partialUpgrade, plan=None):
+        # keep the GUI alive
+        lock = threading.Lock()
+        lock.acquire()
+        t = threading.Thread(target=self.updateGUI, args=(self.view, lock,))
+        t.start()
+        try:
+            # a matching plan from an identical system replaces the
+            # resolver run, if it does not apply we calculate as usual
+            if plan is None or not plan.apply(self):
+                # mvo: disabled as it casues to many errornous installs
+                #self._apply_dselect_upgrade()
+                if self.config.getWithDefault("Distro", "ResolverWorker",
+                                              False):
+                    self._resolveInWorker(view, serverMode)
+                else:
+                    self._resolve(view, serverMode)
 
         except SystemError as e:
             # the most likely problem is the 3rd party pkgs so don't address
@@ -740,11 +895,11 @@ class MyCache(apt.Cache):
             pass
         if len(downgrade) > 0:
             downgrade.sort()
-            logging.error("Packages to downgrade found: '%s'" %
+            logging.error("Packages to downgrade found: '%s'",
                           " ".join(downgrade))
         if len(untrusted) > 0:
             untrusted.sort()
-            logging.error("Unauthenticated packages found: '%s'" %
+            logging.error("Unauthenticated packages found: '%s'",
                           " ".join(untrusted))
             # FIXME: maybe ask a question here? instead of failing?
             self._stopAptResolverLog()
@@ -812,7 +967,7 @@ class MyCache(apt.Cache):
         installed_tasks = set()
         for pkg in self:
             if not self._lookupPkgRecord(pkg):
-                logging.debug("no PkgRecord found for '%s', skipping " % pkg.name)
+                logging.debug("no PkgRecord found for '%s', skipping ", pkg.name)
                 continue
             for line in pkg._pcache._records.record.split("\n"):
                 if line.startswith("Task:"):
@@ -841,7 +996,7 @@ class MyCache(apt.Cache):
                 continue
             self._lookupPkgRecord(pkg)
             if not (hasattr(pkg._pcache._records, "record") and pkg._pcache._records.record):
-                logging.warning("can not find Record for '%s'" % pkg.name)
+                logging.warning("can not find Record for '%s'", pkg.name)
                 continue
             for line in pkg._pcache._records.record.split("\n"):
                 if line.startswith("Task:"):
@@ -866,7 +1021,7 @@ class MyCache(apt.Cache):
                 if key in self:
                     pkg = self[key]
                     if pkg.is_installed and pkg.marked_delete:
-                        logging.debug("metapkg '%s' installed but marked_delete" % pkg.name)
+                        logging.debug("metapkg '%s' installed but marked_delete", pkg.name)
                     if ((pkg.is_installed and not pkg.marked_delete)
                         or self[key].marked_install):
                         return True
@@ -886,27 +1041,27 @@ class MyCache(apt.Cache):
                 if (key in self and
                     self[key].is_installed and
                     self[key].is_upgradable):
-                    logging.debug("Marking '%s' for upgrade" % key)
+                    logging.debug("Marking '%s' for upgrade", key)
                     self[key].mark_upgrade()
             except SystemError as e:
                 # warn here, but don't fail, its possible that meta-packages
                 # conflict (like ubuntu-desktop vs xubuntu-desktop) LP: #775411
-                logging.warning("Can't mark '%s' for upgrade (%s)" % (key, e))
+                logging.warning("Can't mark '%s' for upgrade (%s)", key, e)
 
         # check if we have a meta-pkg, if not, try to guess which one to pick
         if not metaPkgInstalled():
-            logging.debug("none of the '%s' meta-pkgs installed" % metapkgs)
+            logging.debug("none of the '%s' meta-pkgs installed", metapkgs)
             for key in metapkgs:
                 deps_found = True
                 for pkg in self.config.getlist(key, "KeyDependencies"):
                     deps_found &= pkg in self and self[pkg].is_installed
                 if deps_found:
-                    logging.debug("guessing '%s' as missing meta-pkg" % key)
+                    logging.debug("guessing '%s' as missing meta-pkg", key)
                     try:
                         self[key].mark_install()
                     except (SystemError, KeyError) as e:
-                        logging.error("failed to mark '%s' for install (%s)" %
-                                      (key, e))
+                        logging.error("failed to mark '%s' for install (%s)",
+                                      key, e)
                         view.error(_("Can't install '%s'") % key,
                                    _("It was impossible to install a "
                                      "required package. Please report "
@@ -914,7 +1069,7 @@ class MyCache(apt.Cache):
                                      "'ubuntu-bug ubuntu-release-upgrader-core' in "
                                      "a terminal."))
                         return False
-                    logging.debug("marked_install: '%s' -> '%s'" % (key, self[key].marked_install))
+                    logging.debug("marked_install: '%s' -> '%s'", key, self[key].marked_install)
                     break
         # check if we actually found one
         if not metaPkgInstalled():
@@ -934,7 +1089,7 @@ class MyCache(apt.Cache):
     def _inRemovalBlacklist(self, pkgname):
         for expr in self.removal_blacklist:
             if re.compile(expr).match(pkgname):
-                logging.debug("blacklist expr '%s' matches '%s'" % (expr, pkgname))
+                logging.debug("blacklist expr '%s' matches '%s'", expr, pkgname)
                 return True
         return False
 
@@ -943,19 +1098,19 @@ class MyCache(apt.Cache):
         #logging.debug("tryMarkObsoleteForRemoval(): %s" % pkgname)
         # sanity check, first see if it looks like a running kernel pkg
         if pkgname.endswith(self.uname):
-            logging.debug("skipping running kernel pkg '%s'" % pkgname)
+            logging.debug("skipping running kernel pkg '%s'", pkgname)
             return False
         if pkgname == self.linux_metapackage:
-            logging.debug("skipping kernel metapackage '%s'" % pkgname)
+            logging.debug("skipping kernel metapackage '%s'", pkgname)
             return False
         if self._inRemovalBlacklist(pkgname):
-            logging.debug("skipping '%s' (in removalBlacklist)" % pkgname)
+            logging.debug("skipping '%s' (in removalBlacklist)", pkgname)
             return False
         # ensure we honor KeepInstalledSection here as well
         for section in self.config.getlist("Distro", "KeepInstalledSection"):
             if (pkgname in self and self[pkgname].installed and
                     self[pkgname].installed.section == section):
-                logging.debug("skipping '%s' (in KeepInstalledSection)" % pkgname)
+                logging.debug("skipping '%s' (in KeepInstalledSection)", pkgname)
                 return False
         # if we don't have the package anyway, we are fine (this can
         # happen when forced_obsoletes are specified in the config file)
@@ -978,6 +1133,8 @@ class MyCache(apt.Cache):
         self.create_snapshot()
         try:
             self[pkgname].mark_delete(purge=purge)
+            if purge:
+                self.purge_marked.add(pkgname)
             self.view.processEvents()
             if pkgname in forced_obsoletes:
                 return True
@@ -987,11 +1144,11 @@ class MyCache(apt.Cache):
                       pkg.name in foreign_pkgs or
                       self._inRemovalBlacklist(pkg.name) or
                       pkg.name == self.linux_metapackage):
-                    logging.debug("package '%s' produces an unwanted removal '%s', skipping" % (pkgname, pkg.name))
+                    logging.debug("package '%s' produces an unwanted removal '%s', skipping", pkgname, pkg.name)
                     self.restore_snapshot()
                     return False
         except (SystemError, KeyError) as e:
-            logging.warning("_tryMarkObsoleteForRemoval failed for '%s' (%s: %s)" % (pkgname, repr(e), e))
+            logging.warning("_tryMarkObsoleteForRemoval failed for '%s' (%s: %s)", pkgname, repr(e), e)
             self.restore_snapshot()
             return False
         return True
@@ -999,14 +1156,14 @@ class MyCache(apt.Cache):
     def _getObsoletesPkgs(self):
         " get all package names that are not downloadable "
         obsolete_pkgs = set()
-        for pkg in self:
-            if pkg.is_installed:
+        for rawpkg in self._raw_packages():
+            if rawpkg.current_ver:
                 # check if any version is downloadable. we need to check
                 # for older ones too, because there might be
                 # cases where e.g. firefox in gutsy-updates is newer
                 # than hardy
-                if not self.anyVersionDownloadable(pkg):
-                    obsolete_pkgs.add(pkg.name)
+                if not any(ver.downloadable for ver in rawpkg.version_list):
+                    obsolete_pkgs.add(rawpkg.get_fullname(True))
         return obsolete_pkgs
 
     def anyVersionDownloadable(self, pkg):
@@ -1019,9 +1176,9 @@ class MyCache(apt.Cache):
     def _getUnusedDependencies(self):
         " get all package names that are not downloadable "
         unused_dependencies = set()
-        for pkg in self:
-            if pkg.is_installed and self._depcache.is_garbage(pkg._pkg):
-                unused_dependencies.add(pkg.name)
+        for rawpkg in self._raw_packages():
+            if rawpkg.current_ver and self._depcache.is_garbage(rawpkg):
+                unused_dependencies.add(rawpkg.get_fullname(True))
         return unused_dependencies
 
     def get_installed_demoted_packages(self):
@@ -1105,15 +1262,11 @@ class MyCache(apt.Cache):
         mounted = []
         mnt_map = {}
         fs_free = {}
-        with open("/proc/mounts") as mounts:
-            for line in mounts:
-                try:
-                    (what, where, fs, options, a, b) = line.split()
-                except ValueError as e:
-                    logging.debug("line '%s' in /proc/mounts not understood (%s)" % (line, e))
-                    continue
-                if not where in mounted:
-                    mounted.append(where)
+        # the mounts may have changed since they were last read
+        self.facts.forget("mounts")
+        for mount in self.facts.mounts:
+            if not mount.where in mounted:
+                mounted.append(mount.where)
         # make sure mounted is sorted by longest path
         mounted.sort(key=len, reverse=True)
         archivedir = apt_pkg.config.find_dir("Dir::Cache::archives")
@@ -1123,7 +1276,7 @@ class MyCache(apt.Cache):
             aufs_rw_dir = self.config.get("Aufs", "RWDir")
             if not os.path.exists(aufs_rw_dir):
                 os.makedirs(aufs_rw_dir)
-        logging.debug("cache aufs_rw_dir: %s" % aufs_rw_dir)
+        logging.debug("cache aufs_rw_dir: %s", aufs_rw_dir)
         for d in ["/", "/usr", "/var", "/boot", archivedir, aufs_rw_dir, "/home", "/tmp/"]:
             d = os.path.realpath(d)
             fs_id = make_fs_id(d)
@@ -1131,36 +1284,37 @@ class MyCache(apt.Cache):
                 st = os.statvfs(d)
                 free = st.f_bavail * st.f_frsize
             else:
-                logging.warning("directory '%s' does not exists" % d)
+                logging.warning("directory '%s' does not exists", d)
                 free = 0
             if fs_id in mnt_map:
-                logging.debug("Dir %s mounted on %s" %
-                              (d, mnt_map[fs_id]))
+                logging.debug("Dir %s mounted on %s",
+                              d, mnt_map[fs_id])
                 fs_free[d] = fs_free[mnt_map[fs_id]]
             else:
-                logging.debug("Free space on %s: %s" %
-                              (d, free))
+                logging.debug("Free space on %s: %s",
+                              d, free)
                 mnt_map[fs_id] = d
                 fs_free[d] = FreeSpace(free)
         del mnt_map
-        logging.debug("fs_free contains: '%s'" % fs_free)
+        logging.debug("fs_free contains: '%s'", fs_free)
 
         # now calculate the space that is required on /boot
         # we do this by checking how many linux-image-$ver packages
         # are installed or going to be installed
+        (kernel_size, initrd_size) = kernel_initrd_size_in_boot()
         kernel_count = 0
-        for pkg in self:
+        for pkg in self.name_index.with_prefix("linux-image-"):
             # we match against everything that looks like a kernel
             # and add space check to filter out metapackages
             if re.match("^linux-(image|image-debug)-[0-9.]*-.*", pkg.name):
                 # upgrade because early in the release cycle the major version
                 # may be the same or they might be -lts- kernels
                 if pkg.marked_install or pkg.marked_upgrade:
-                    logging.debug("%s (new-install) added with %s to boot space" % (pkg.name, KERNEL_SIZE))
+                    logging.debug("%s (new-install) added with %s to boot space", pkg.name, kernel_size)
                     kernel_count += 1
         # space calculated per LP: #1646222
-        space_in_boot = (kernel_count * KERNEL_SIZE
-                         + (kernel_count + 1) * INITRD_SIZE)
+        space_in_boot = (kernel_count * kernel_size
+                         + (kernel_count + 1) * initrd_size)
 
         # we check for various sizes:
         # archivedir is where we download the debs
@@ -1185,7 +1339,7 @@ class MyCache(apt.Cache):
                 if (pkg.is_installed and
                     (pkg.marked_upgrade or pkg.marked_delete)):
                     required_for_snapshots += pkg.installed.installed_size
-            logging.debug("additional space for the snapshots: %s" % required_for_snapshots)
+            logging.debug("additional space for the snapshots: %s", required_for_snapshots)
 
         # sum up space requirements
         for (dir, size) in [(archivedir, self.required_download),
@@ -1205,7 +1359,7 @@ class MyCache(apt.Cache):
             if size < 0:
                 continue
             dir = os.path.realpath(dir)
-            logging.debug("dir '%s' needs '%s' of '%s' (%f)" % (dir, size, fs_free[dir], fs_free[dir].free))
+            logging.debug("dir '%s' needs '%s' of '%s' (%f)", dir, size, fs_free[dir], fs_free[dir].free)
             fs_free[dir].free -= size
             fs_free[dir].need += size
 
@@ -1228,7 +1382,7 @@ class MyCache(apt.Cache):
                 required_list[make_fs_id(dir)] = FreeSpaceRequired(free_needed, make_fs_id(dir), free_at_least)
         # raise exception if free space check fails
         if len(required_list) > 0:
-            logging.error("Not enough free space: %s" % [str(i) for i in required_list])
+            logging.error("Not enough free space: %s", [str(i) for i in required_list])
             raise NotEnoughFreeSpaceError(list(required_list.values()))
         return True
 
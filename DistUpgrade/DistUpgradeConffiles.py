@@ -0,0 +1,130 @@
+# DistUpgradeConffiles.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+Find the locally modified conffiles of the packages that get upgraded.
+
+dpkg only asks about a conffile if it was modified locally, so the
+number of modified conffiles of the upgraded packages is an upper
+bound for the number of conffile prompts during the upgrade.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import apt_pkg
+
+
+def parse_conffiles(field):
+    """ return the (path, md5sum) pairs of a dpkg Conffiles field """
+    conffiles = []
+    for line in field.splitlines():
+        words = line.split()
+        if len(words) < 2:
+            continue
+        # obsolete and remove-on-upgrade conffiles are never asked about
+        # and "newconffile" means it was never installed
+        if len(words) > 2 or words[1] == "newconffile":
+            continue
+        conffiles.append((words[0], words[1]))
+    return conffiles
+
+
+def read_conffiles(pkgnames, status_file=None):
+    """ return a dict pkgname -> [(path, md5sum), ...] from the dpkg
+        status for the given package names
+    """
+    if status_file is None:
+        status_file = apt_pkg.config.find_file("Dir::State::status")
+    conffiles = {}
+    with open(status_file) as f:
+        for section in apt_pkg.TagFile(f):
+            name = section.get("Package")
+            if name not in pkgnames or "Conffiles" not in section:
+                continue
+            conffiles.setdefault(name, []).extend(
+                parse_conffiles(section["Conffiles"]))
+    return conffiles
+
+
+def md5sum(path):
+    """ the md5sum of path or None if it does not exist """
+    h = hashlib.md5()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(64 * 1024), b""):
+                h.update(block)
+    except (IOError, OSError):
+        return None
+    return h.hexdigest()
+
+
+class ConffileScan(object):
+    """ scan the conffiles of the given packages in the background
+
+    result() returns a dict path -> pkgname of all conffiles that
+    exist and differ from the version the package shipped
+    """
+
+    def __init__(self, pkgnames, status_file=None, root="/", workers=None):
+        self.pkgnames = set(pkgnames)
+        self.status_file = status_file
+        self.root = root
+        self.workers = workers or min(8, (os.cpu_count() or 1) * 2)
+        self._modified = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _path(self, conffile):
+        return os.path.join(self.root, conffile.lstrip("/"))
+
+    def _run(self):
+        try:
+            conffiles = read_conffiles(self.pkgnames, self.status_file)
+            files = [(path, md5, pkgname)
+                     for (pkgname, entries) in conffiles.items()
+                     for (path, md5) in entries]
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                sums = pool.map(lambda f: md5sum(self._path(f[0])), files)
+                modified = {}
+                for ((path, md5, pkgname), current) in zip(files, sums):
+                    if current is not None and current != md5:
+                        modified[path] = pkgname
+            self._modified = modified
+        except Exception:
+            logging.exception("scanning the conffiles failed")
+            self._modified = {}
+
+    def done(self):
+        return self._thread is not None and not self._thread.is_alive()
+
+    def result(self, timeout=None):
+        """ wait for the scan and return the modified conffiles """
+        if self._thread is None:
+            self._run()
+        else:
+            self._thread.join(timeout)
+        return self._modified
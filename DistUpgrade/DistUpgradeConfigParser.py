@@ -26,19 +26,61 @@ import subprocess
 import os.path
 import logging
 import glob
+import shlex
 
 CONFIG_OVERRIDE_DIR = "/etc/update-manager/release-upgrades.d"
+OS_RELEASE_FILES = ("/etc/os-release", "/usr/lib/os-release")
+
+
+def read_os_release(paths=OS_RELEASE_FILES):
+    """ return the os-release(5) fields of the first file found """
+    for path in paths:
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            continue
+        result = {}
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            (key, value) = line.split("=", 1)
+            try:
+                # values are shell strings
+                result[key] = " ".join(shlex.split(value))
+            except ValueError:
+                logging.debug("ignoring invalid os-release line '%s'", line)
+        return result
+    return {}
+
+
+def distro_codename(paths=OS_RELEASE_FILES):
+    """ the codename of the running release, like lsb_release -c -s """
+    os_release = read_os_release(paths)
+    codename = (os_release.get("VERSION_CODENAME") or
+                os_release.get("UBUNTU_CODENAME"))
+    if codename:
+        return codename
+    try:
+        return subprocess.Popen(
+            ["lsb_release", "-c", "-s"], stdout=subprocess.PIPE,
+            universal_newlines=True).communicate()[0].strip()
+    except OSError as e:
+        logging.warning("can not get the release codename: %s", e)
+        return ""
 
 
 class DistUpgradeConfig(SafeConfigParser):
     def __init__(self, datadir, name="DistUpgrade.cfg", 
                  override_dir=None, defaults_dir=None):
+        # parsed getlist()/getListFromFile() results, the base class
+        # may already call set() from its constructor
+        self._list_cache = {}
         SafeConfigParser.__init__(self)
         # we support a config overwrite, if DistUpgrade.cfg.dapper exists
         # and the user runs dapper, that one will be used
-        from_release = subprocess.Popen(
-            ["lsb_release", "-c", "-s"], stdout=subprocess.PIPE,
-            universal_newlines=True).communicate()[0].strip()
+        from_release = distro_codename()
         self.datadir = datadir
         maincfg = os.path.join(datadir, name)
         if os.path.exists(maincfg + "." + from_release):
@@ -70,7 +112,31 @@ class DistUpgradeConfig(SafeConfigParser):
         except (NoSectionError, NoOptionError):
             return default
 
-    def getlist(self, section, option):
+    # any change of the values invalidates the parsed lists
+    def set(self, section, option, value=None):
+        self._list_cache.clear()
+        SafeConfigParser.set(self, section, option, value)
+
+    def remove_option(self, section, option):
+        self._list_cache.clear()
+        return SafeConfigParser.remove_option(self, section, option)
+
+    def remove_section(self, section):
+        self._list_cache.clear()
+        return SafeConfigParser.remove_section(self, section)
+
+    def _read(self, fp, fpname):
+        self._list_cache.clear()
+        SafeConfigParser._read(self, fp, fpname)
+
+    def _cached_list(self, kind, section, option, parse):
+        key = (kind, section, option)
+        if key not in self._list_cache:
+            self._list_cache[key] = tuple(parse(section, option))
+        # callers are free to modify the list they get
+        return list(self._list_cache[key])
+
+    def _parse_list(self, section, option):
         try:
             tmp = self.get(section, option)
         except (NoSectionError, NoOptionError):
@@ -78,7 +144,10 @@ class DistUpgradeConfig(SafeConfigParser):
         items = [x.strip() for x in tmp.split(",")]
         return items
 
-    def getListFromFile(self, section, option):
+    def getlist(self, section, option):
+        return self._cached_list("list", section, option, self._parse_list)
+
+    def _parse_list_file(self, section, option):
         try:
             filename = self.get(section, option)
         except NoOptionError:
@@ -90,6 +159,25 @@ class DistUpgradeConfig(SafeConfigParser):
             items = [x.strip() for x in f]
         return [s for s in items if not s.startswith("#") and not s == ""]
 
+    def getListFromFile(self, section, option):
+        return self._cached_list("file", section, option,
+                                 self._parse_list_file)
+
+
+_shared_configs = {}
+
+
+def get_config(datadir=".", name="DistUpgrade.cfg"):
+    """ return the config of datadir that is shared in this process
+
+    the main program, the controller and the views all read the same
+    configuration, so it is only parsed once
+    """
+    key = (os.path.realpath(datadir), name, CONFIG_OVERRIDE_DIR)
+    if key not in _shared_configs:
+        _shared_configs[key] = DistUpgradeConfig(datadir, name)
+    return _shared_configs[key]
+
 
 if __name__ == "__main__":
     c = DistUpgradeConfig(".")
@@ -22,6 +22,8 @@
 
 import apt
 import apt_pkg
+import atexit
+import ctypes
 import distro_info
 import sys
 import os
@@ -50,7 +52,21 @@ from urllib.parse import urlsplit
 from .DistUpgradeView import Step
 from .DistUpgradeCache import MyCache
 from .DistUpgradeConfigParser import DistUpgradeConfig
+from .DistUpgradeConffiles import ConffileScan
+from .DistUpgradeHookQueue import HookQueue, RestartQueue, RESTART_JOBS
+from .DistUpgradeMemory import get_memory_report, is_low_memory
 from .DistUpgradeQuirks import DistUpgradeQuirks
+from .DistUpgradeSystemFacts import (
+    get_system_facts, mount_point, writable_filesystems)
+from .DistUpgradePlan import (UpgradePlan,
+                              UpgradePlanStore,
+                              changes_from_cache,
+                              system_fingerprint)
+from .DistUpgradePlanOnly import PrivateAptRoot, write_report
+from .DistUpgradePrefetch import IndexPrefetch, target_entries
+from .DistUpgradeMirrorRanking import (
+    CACHE_PATH, DEFAULT_TTL, MirrorRanking, mirror_shortlist)
+from .DistUpgradeVersion import VERSION
 
 # workaround broken relative import in python-apt (LP: #871007), we
 # want the local version of distinfo.py from oneiric, but because of
@@ -60,8 +76,10 @@ from aptsources import distinfo
 from aptsources import sourceslist
 sourceslist.DistInfo = distinfo.DistInfo
 
-from aptsources.sourceslist import SourcesList, is_mirror
-from .distro import get_distro, NoDistroTemplateException
+from aptsources.sourceslist import SourceEntry, SourcesList, is_mirror
+from .DistUpgradeSourcesList import TrackedSourcesList
+from .distro import NoDistroTemplateException
+from .DistUpgradeDistro import get_distro
 
 from .DistUpgradeGettext import gettext as _
 from .DistUpgradeGettext import ngettext
@@ -86,6 +104,31 @@ def component_ordering_key(a):
         return len(ordering)+1
 
 
+def syncfs(path="/"):
+    """ write out the filesystem that path is on, like "sync -f" """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.syncfs(fd) != 0:
+            raise OSError(ctypes.get_errno(), "syncfs failed")
+    except (AttributeError, OSError) as e:
+        logging.debug("syncfs(%s) failed (%s), using sync()", path, e)
+        os.sync()
+    finally:
+        os.close(fd)
+
+
+class _NoAuthEntry(object):
+    """ a source entry for the log, the credentials are only stripped
+        if the message is actually logged
+    """
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __str__(self):
+        return get_string_with_no_auth_from_source_entry(self.entry)
+
+
 class NoBackportsFoundException(Exception):
     pass
 
@@ -93,7 +136,8 @@ class NoBackportsFoundException(Exception):
 class DistUpgradeController(object):
     """ this is the controller that does most of the work """
     
-    def __init__(self, distUpgradeView, options=None, datadir=None):
+    def __init__(self, distUpgradeView, options=None, datadir=None,
+                 config=None):
         # setup the paths
         localedir = "/usr/share/locale/"
         if datadir == None or datadir == '.':
@@ -107,24 +151,28 @@ class DistUpgradeController(object):
         gettext.textdomain("ubuntu-release-upgrader")
 
         # setup the view
-        logging.debug("Using '%s' view" % distUpgradeView.__class__.__name__)
+        logging.debug("Using '%s' view", distUpgradeView.__class__.__name__)
         self._view = distUpgradeView
         self._view.updateStatus(_("Reading cache"))
         self.cache = None
         self.fetcher = None
+        self.conffile_scan = None
 
         if not self.options or self.options.withNetwork == None:
             self.useNetwork = True
         else:
             self.useNetwork = self.options.withNetwork
 
-        # the configuration
-        self.config = DistUpgradeConfig(datadir)
+        # the configuration (shared with the view when it is passed in)
+        if config is None:
+            config = DistUpgradeConfig(datadir)
+        self.config = config
         self.sources_backup_ext = "."+self.config.get("Files","BackupExt")
 
         # move some of the options stuff into the self.config, 
         # ConfigParser deals only with strings it seems *sigh*
-        self.config.add_section("Options")
+        if not self.config.has_section("Options"):
+            self.config.add_section("Options")
         self.config.set("Options","withNetwork", str(self.useNetwork))
         self.config.set("Options","devRelease", "False")
         if self.options:
@@ -144,12 +192,32 @@ class DistUpgradeController(object):
 
         # we run in full upgrade mode by default
         self._partialUpgrade = False
+        # only report what the upgrade would do (--plan-only)
+        self.plan_only = bool(self.options and
+                              getattr(self.options, "plan_only", None))
         
+        # what we know about the system, shared by the quirks and caches
+        self.facts = get_system_facts()
+
         # install the quirks handler
-        self.quirks = DistUpgradeQuirks(self, self.config)
+        self.quirks = DistUpgradeQuirks(self, self.config, self.facts)
+        # small VMs and boards, see DistUpgradeMemory
+        self.low_memory = is_low_memory(self.config, self.facts)
+        if self.low_memory:
+            logging.info("running in low memory mode (%s MB RAM)",
+                         self.facts.mem_total // (1024 * 1024))
+
+        # plans calculated on identical systems, the command line wins
+        # over the configuration
+        export_plan = (getattr(self.options, "export_plan", None) or
+                       self.config.getWithDefault("Plan", "ExportDir", ""))
+        import_plan = (getattr(self.options, "import_plan", None) or
+                       self.config.getWithDefault("Plan", "Import", ""))
+        self.plans = UpgradePlanStore(export_plan, import_plan)
 
         # install a logind sleep inhibitor
-        self.inhibitor_fd = inhibit_sleep()
+        if not self.plan_only:
+            self.inhibitor_fd = inhibit_sleep()
 
         # setup env var 
         os.environ["RELEASE_UPGRADE_IN_PROGRESS"] = "1"
@@ -157,6 +225,16 @@ class DistUpgradeController(object):
         os.environ["PATH"] = "%s:%s" % (os.getcwd()+"/imported",
                                         os.environ["PATH"])
         check_and_fix_xbit("./imported/invoke-rc.d")
+        check_and_fix_xbit("./imported/coalesce-hook")
+        logdir = self.config.getWithDefault("Files", "LogDir",
+                                            "/var/log/dist-upgrade")
+        # update-initramfs and friends are run once after the install
+        self.hook_queue = HookQueue(os.path.join(logdir, "hook-queue"))
+        # service restarts are queued by invoke-rc.d during the install
+        # and run in parallel after every commit
+        self.restart_queue = RestartQueue(
+            os.path.join(logdir, "restart-queue"),
+            self.config.getWithDefault("Distro", "RestartJobs", RESTART_JOBS))
 
         # set max retries
         maxRetries = self.config.getint("Network","MaxRetries")
@@ -178,6 +256,10 @@ class DistUpgradeController(object):
         self.forced_obsoletes = self.config.getlist("Distro","ForcedObsoletes")
         # list of valid mirrors that we can add
         self.valid_mirrors = self.config.getListFromFile("Sources","ValidMirrors")
+        # indexes of the target release downloaded by the initial update
+        self.prefetch = None
+        # the working archive mirrors, the fastest first
+        self._ranked_mirrors = None
         # third party mirrors
         self.valid_3p_mirrors = []
         if self.config.has_section('ThirdPartyMirrors'):
@@ -212,10 +294,10 @@ class DistUpgradeController(object):
                 self._view.processEvents()
                 time.sleep(0.1)
                 logging.debug(
-                    "failed to lock the cache, retrying (%i)" % lock_retry)
+                    "failed to lock the cache, retrying (%i)", lock_retry)
                 # and give up after some time
                 if lock_retry > MAX_LOCK_RETRIES:
-                    logging.error("Cache can not be locked (%s)" % e)
+                    logging.error("Cache can not be locked (%s)", e)
                     self._view.error(_("Unable to get exclusive lock"),
                                      _("This usually means that another "
                                        "package management application "
@@ -233,7 +315,8 @@ class DistUpgradeController(object):
                                  self._view,
                                  self.quirks,
                                  self._view.getOpCacheProgress(),
-                                 lock)
+                                 lock,
+                                 facts=self.facts)
             # alias name for the plugin interface code
             self.apt_cache = self.cache
         # if we get a dpkg error that it was interrupted, just
@@ -244,12 +327,14 @@ class DistUpgradeController(object):
             if os.environ.get("DEBIAN_FRONTEND") == "noninteractive":
                 cmd.append("--force-confold")
             self._view.getTerminal().call(cmd)
+            self.restart_queue.flush()
             self.cache = MyCache(self.config,
                                  self._view,
                                  self.quirks,
-                                 self._view.getOpCacheProgress())
+                                 self._view.getOpCacheProgress(),
+                                 facts=self.facts)
         self.cache.partialUpgrade = self._partialUpgrade
-        logging.debug("/openCache(), new cache size %i" % len(self.cache))
+        logging.debug("/openCache(), new cache size %i", len(self.cache))
 
     def _viewSupportsSSH(self):
       """
@@ -368,17 +453,17 @@ class DistUpgradeController(object):
                 try:
                     expected_default = config.get('DEFAULT', 'default-version')
                 except NoOptionError:
-                    logging.debug("no default version for %s found in '%s'" %
-                                  (binary, config))
+                    logging.debug("no default version for %s found in '%s'",
+                                  binary, config)
                     return False
                 try:
                     fs_default_version = os.readlink('/usr/bin/%s' % binary)
                 except OSError as e:
-                    logging.error("os.readlink failed (%s)" % e)
+                    logging.error("os.readlink failed (%s)", e)
                     return False
                 if not fs_default_version in (expected_default, os.path.join('/usr/bin', expected_default)):
-                    logging.debug("%s symlink points to: '%s', but expected is '%s' or '%s'" %
-                                  (binary, fs_default_version, expected_default, os.path.join('/usr/bin', expected_default)))
+                    logging.debug("%s symlink points to: '%s', but expected is '%s' or '%s'",
+                                  binary, fs_default_version, expected_default, os.path.join('/usr/bin', expected_default))
                     return False
         return True
 
@@ -386,12 +471,10 @@ class DistUpgradeController(object):
     def prepare(self):
         """ initial cache opening, sanity checking, network checking """
         # first check if that is a good upgrade
-        self.release = release = subprocess.Popen(["lsb_release","-c","-s"],
-                                   stdout=subprocess.PIPE,
-                                   universal_newlines=True).communicate()[0].strip()
-        logging.debug("lsb-release: '%s'" % release)
+        self.release = release = self.facts.codename
+        logging.debug("lsb-release: '%s'", release)
         if not (release == self.fromDist or release == self.toDist):
-            logging.error("Bad upgrade: '%s' != '%s' " % (release, self.fromDist))
+            logging.error("Bad upgrade: '%s' != '%s' ", release, self.fromDist)
             self._view.error(_("Can not upgrade"),
                              _("An upgrade from '%s' to '%s' is not "
                                "supported with this tool." % (release, self.toDist)))
@@ -400,15 +483,15 @@ class DistUpgradeController(object):
         # setup backports (if we have them)
         if self.options and self.options.havePrerequists:
             backportsdir = os.getcwd()+"/backports"
-            logging.info("using backports in '%s' " % backportsdir)
-            logging.debug("have: %s" % glob.glob(backportsdir+"/*.udeb"))
+            logging.info("using backports in '%s' ", backportsdir)
+            logging.debug("have: %s", glob.glob(backportsdir+"/*.udeb"))
             if os.path.exists(backportsdir+"/usr/bin/dpkg"):
                 apt_pkg.config.set("Dir::Bin::dpkg",backportsdir+"/usr/bin/dpkg");
             if os.path.exists(backportsdir+"/usr/lib/apt/methods"):
                 apt_pkg.config.set("Dir::Bin::methods",backportsdir+"/usr/lib/apt/methods")
             conf = backportsdir+"/etc/apt/apt.conf.d/01ubuntu"
             if os.path.exists(conf):
-                logging.debug("adding config '%s'" % conf)
+                logging.debug("adding config '%s'", conf)
                 apt_pkg.read_config_file(apt_pkg.config, conf)
 
         # do the ssh check and warn if we run under ssh
@@ -424,7 +507,7 @@ class DistUpgradeController(object):
         try:
             self.openCache()
         except SystemError as e:
-            logging.error("openCache() failed: '%s'" % e)
+            logging.error("openCache() failed: '%s'", e)
             return False
         if not self.cache.sanity_check(self._view):
             return False
@@ -444,7 +527,7 @@ class DistUpgradeController(object):
         from .DistUpgradeMain import SYSTEM_DIRS
         for systemdir in SYSTEM_DIRS:
             if os.path.exists(systemdir) and not os.access(systemdir, os.W_OK):
-                logging.error("%s not writable" % systemdir)
+                logging.error("%s not writable", systemdir)
                 self._view.error(
                     _("Can not write to '%s'") % systemdir,
                     _("Its not possible to write to the system directory "
@@ -461,7 +544,7 @@ class DistUpgradeController(object):
         helper that checks if a sources.list entry points to 
         something downloadable
         """
-        logging.debug("verifySourcesListEntry: %s" % entry)
+        logging.debug("verifySourcesListEntry: %s", entry)
         # no way to verify without network
         if not self.useNetwork:
             logging.debug("skipping downloadable check (no network)")
@@ -470,6 +553,31 @@ class DistUpgradeController(object):
         uri = "%s/dists/%s/Release" % (entry.uri, entry.dist)
         return url_downloadable(uri, logging.debug)
 
+    def _rankedMirrors(self):
+        """ the archive mirrors that were probed, the fastest first,
+            nothing if the mirrors are not ranked
+        """
+        if self._ranked_mirrors is not None:
+            return self._ranked_mirrors
+        if (not self.useNetwork or
+                not self.config.getWithDefault("Network", "RankMirrors",
+                                               True)):
+            self._ranked_mirrors = []
+            return self._ranked_mirrors
+        # --plan-only does not write the measurements to the system
+        cache_path = None
+        if not self.plan_only:
+            cache_path = self.config.getWithDefault(
+                "Network", "MirrorRankingCache", CACHE_PATH)
+        ranking = MirrorRanking(
+            self.toDist,
+            cache_path,
+            self.config.getWithDefault("Network", "MirrorRankingTTL",
+                                       DEFAULT_TTL))
+        self._ranked_mirrors = ranking.rank(
+            mirror_shortlist(self.valid_mirrors, country_mirror()))
+        return self._ranked_mirrors
+
     def rewriteSourcesList(self, mirror_check=True):
         if mirror_check:
             logging.debug("rewriteSourcesList() with mirror_check")
@@ -494,7 +602,7 @@ class DistUpgradeController(object):
             #    need to enable it
             logging.debug(self.config.getlist("Distro", "BaseMetaPkgs"))
             for pkgname in self.config.getlist("Distro", "BaseMetaPkgs"):
-                logging.debug("Checking pkg: %s" % pkgname)
+                logging.debug("Checking pkg: %s", pkgname)
                 if ((not pkgname in self.cache or
                      not self.cache[pkgname].candidate or
                      len(self.cache[pkgname].candidate.origins) == 0)
@@ -503,7 +611,7 @@ class DistUpgradeController(object):
                      len(self.cache[pkgname].candidate.origins) == 1 and
                      self.cache[pkgname].candidate.origins[0].archive == "now")
                    ):
-                    logging.debug("BaseMetaPkg '%s' has no candidate.origins" % pkgname)
+                    logging.debug("BaseMetaPkg '%s' has no candidate.origins", pkgname)
                     try:
                         distro = get_distro()
                         distro.get_sources(self.sources)
@@ -511,7 +619,7 @@ class DistUpgradeController(object):
                         main_was_missing = True
                         logging.debug('get_distro().enable_component("main") succeeded')
                     except NoDistroTemplateException as e:
-                        logging.exception('NoDistroTemplateException raised: %s' % e)
+                        logging.exception('NoDistroTemplateException raised: %s', e)
                         # fallback if everything else does not work,
                         # we replace the sources.list with lines to
                         # main and restricted
@@ -541,7 +649,7 @@ class DistUpgradeController(object):
 
         # Special quirk to remove extras.ubuntu.com
         new_list = []
-        for entry in self.sources.list[:]:
+        for entry in self.sources.list:
             if "/extras.ubuntu.com" in entry.uri:
                 continue
             if entry.line.startswith(
@@ -570,7 +678,7 @@ class DistUpgradeController(object):
             # we disable breezy cdrom sources to make sure that demoted
             # packages are removed
             if entry.uri.startswith("cdrom:") and entry.dist == self.fromDist:
-                logging.debug("disabled '%s' cdrom entry (dist == fromDist)" % entry)
+                logging.debug("disabled '%s' cdrom entry (dist == fromDist)", entry)
                 entry.disabled = True
                 continue
             # check if there is actually a lists file for them available
@@ -584,7 +692,7 @@ class DistUpgradeController(object):
                                        "dists",
                                        entry.dist,
                                        "Release")):
-                    logging.warning("disabling cdrom source '%s' because it has no Release file" % entry)
+                    logging.warning("disabling cdrom source '%s' because it has no Release file", entry)
                     entry.disabled = True
                 continue
 
@@ -596,7 +704,7 @@ class DistUpgradeController(object):
                 entry.dist == cdist):
                 entry.dist = self.toDist
                 entry.comps = ["partner"]
-                logging.debug("transitioned commercial to '%s' " % entry)
+                logging.debug("transitioned commercial to '%s' ", entry)
                 continue
 
             # special case for landscape.canonical.com because they
@@ -623,20 +731,22 @@ class DistUpgradeController(object):
             if (not entry.disabled and
                 "old-releases.ubuntu.com/" in entry.uri):
                 logging.debug("upgrade from old-releases.ubuntu.com detected")
-                # test country mirror first, then archive.u.c
-                for uri in ["http://%sarchive.ubuntu.com/ubuntu" % country_mirror(),
-                            "http://archive.ubuntu.com/ubuntu"]:
+                # test the fastest mirrors (or the country mirror)
+                # first, then archive.u.c
+                mirrors = self._rankedMirrors() or [
+                    "http://%sarchive.ubuntu.com/ubuntu" % country_mirror()]
+                for uri in mirrors + ["http://archive.ubuntu.com/ubuntu"]:
                     test_entry = copy.copy(entry)
                     test_entry.uri = uri
                     test_entry.dist = self.toDist
                     if self._sourcesListEntryDownloadable(test_entry):
-                        logging.info("transition from old-release.u.c to %s" % uri)
+                        logging.info("transition from old-release.u.c to %s", uri)
                         entry.uri = uri
                         if entry.uri not in entry_uri_test_results:
                             entry_uri_test_results[entry.uri] = 'passed'
                         break
 
-            logging.debug("examining: '%s'" %  get_string_with_no_auth_from_source_entry(entry))
+            logging.debug("examining: '%s'", _NoAuthEntry(entry))
             # check if it's a mirror (or official site)
             validMirror = self.isMirror(entry.uri)
             thirdPartyMirror = not mirror_check or self.isThirdPartyMirror(entry.uri)
@@ -656,7 +766,7 @@ class DistUpgradeController(object):
                 if entry.dist in toDists:
                     # so the self.sources.list is already set to the new
                     # distro
-                    logging.debug("entry '%s' is already set to new dist" % get_string_with_no_auth_from_source_entry(entry))
+                    logging.debug("entry '%s' is already set to new dist", _NoAuthEntry(entry))
                     foundToDist |= validTo
                 elif entry.dist in fromDists:
                     if entry_uri_test_results[entry.uri] == 'unknown':
@@ -671,11 +781,11 @@ class DistUpgradeController(object):
                     if entry_uri_test_results[entry.uri] == 'failed':
                         entry.disabled = True
                         self.sources_disabled = True
-                        logging.debug("entry '%s' was disabled (no Release file)" % get_string_with_no_auth_from_source_entry(entry))
+                        logging.debug("entry '%s' was disabled (no Release file)", _NoAuthEntry(entry))
                     else:
                         foundToDist |= validTo
                         entry.dist = toDists[fromDists.index(entry.dist)]
-                        logging.debug("entry '%s' updated to new dist" % get_string_with_no_auth_from_source_entry(entry))
+                        logging.debug("entry '%s' updated to new dist", _NoAuthEntry(entry))
                 elif entry.type == 'deb-src':
                     continue
                 elif validMirror:
@@ -683,7 +793,7 @@ class DistUpgradeController(object):
                     # point to either "to" or "from" dist
                     entry.disabled = True
                     self.sources_disabled = True
-                    logging.debug("entry '%s' was disabled (unknown dist)" % get_string_with_no_auth_from_source_entry(entry))
+                    logging.debug("entry '%s' was disabled (unknown dist)", _NoAuthEntry(entry))
 
                 # if we make it to this point, we have an official or
                 # third-party mirror check if the arch is one not on the main
@@ -692,7 +802,7 @@ class DistUpgradeController(object):
                     ("archive.ubuntu.com" in entry.uri or
                      "security.ubuntu.com" in entry.uri) and
                     (self.arch not in ("amd64", "i386"))):
-                    logging.debug("moving %s source entry to 'ports.ubuntu.com' " % self.arch)
+                    logging.debug("moving %s source entry to 'ports.ubuntu.com' ", self.arch)
                     entry.uri = "http://ports.ubuntu.com/ubuntu-ports/"
 
                 # gather what components are enabled and are inconsistent
@@ -721,7 +831,7 @@ class DistUpgradeController(object):
                     entry.comment += disable_comment
                 entry.disabled = True
                 self.sources_disabled = True
-                logging.debug("entry '%s' was disabled (unknown mirror)" % get_string_with_no_auth_from_source_entry(entry))
+                logging.debug("entry '%s' was disabled (unknown mirror)", _NoAuthEntry(entry))
                 # if its not a valid mirror and we manually added main, be
                 # nice and add pockets and components corresponding to what we
                 # disabled.
@@ -742,14 +852,14 @@ class DistUpgradeController(object):
                                 if not comp in sync_components:
                                     continue
                                 self.found_components[d].add(comp)
-                    logging.debug("Adding entry: %s %s %s" % (entry.type, entry.dist, entry.comps))
+                    logging.debug("Adding entry: %s %s %s", entry.type, entry.dist, entry.comps)
                     uri = "http://archive.ubuntu.com/ubuntu"
                     comment = " auto generated by ubuntu-release-upgrader"
                     self.sources.add(entry.type, uri, entry.dist, entry.comps, comment)
 
         # now go over the list again and check for missing components
         # in $dist-updates and $dist-security and add them
-        for entry in self.sources.list[:]:
+        for entry in self.sources.list:
             # skip all comps that are not relevant (including e.g. "hardy")
             if (entry.invalid or entry.disabled or entry.type == "deb-src" or
                 entry.uri.startswith("cdrom:") or entry.dist == self.toDist):
@@ -758,18 +868,18 @@ class DistUpgradeController(object):
             if entry.dist in self.found_components:
                 component_diff = self.found_components[self.toDist]-self.found_components[entry.dist]
                 if component_diff:
-                    logging.info("fixing components inconsistency from '%s'" % get_string_with_no_auth_from_source_entry(entry))
+                    logging.info("fixing components inconsistency from '%s'", _NoAuthEntry(entry))
                     # extend and make sure to keep order
                     entry.comps.extend(
                         sorted(component_diff, key=component_ordering_key))
-                    logging.info("to new entry '%s'" % get_string_with_no_auth_from_source_entry(entry))
+                    logging.info("to new entry '%s'", _NoAuthEntry(entry))
                     del self.found_components[entry.dist]
         return foundToDist
 
     def updateSourcesList(self):
         logging.debug("updateSourcesList()")
-        self.sources = SourcesList(matcherPath=self.datadir)
-        # backup first!
+        # only the files that are changed get backed up and written
+        self.sources = TrackedSourcesList(matcherPath=self.datadir)
         self.sources.backup(self.sources_backup_ext)
 
         if not any(e.type == "deb" and e.dist == self.fromDist for e in self.sources):
@@ -799,7 +909,8 @@ class DistUpgradeController(object):
                                ) % (self.fromDist, self.toDist))
             if res:
                 # re-init the sources and try again
-                self.sources = SourcesList(matcherPath=self.datadir)
+                self.sources = TrackedSourcesList(matcherPath=self.datadir)
+                self.sources.backup(self.sources_backup_ext)
                 # its ok if rewriteSourcesList fails here if
                 # we do not use a network, the sources.list may be empty
                 if (not self.rewriteSourcesList(mirror_check=False)
@@ -815,9 +926,14 @@ class DistUpgradeController(object):
                         self.abort()
 
                     # add some defaults here
-                    # FIXME: find mirror here
                     logging.info("Generated new default sources.list")
                     uri = "http://archive.ubuntu.com/ubuntu"
+                    for mirror in self._rankedMirrors():
+                        test_entry = SourceEntry(
+                            "deb %s %s main" % (mirror, self.toDist))
+                        if self._sourcesListEntryDownloadable(test_entry):
+                            uri = mirror
+                            break
                     comps = ["main","restricted"]
                     self.sources.add("deb", uri, self.toDist, comps)
                     self.sources.add("deb", uri, self.toDist+"-updates", comps)
@@ -868,7 +984,9 @@ class DistUpgradeController(object):
         return True
 
     def _logChanges(self):
-        # debugging output
+        # debugging output, do not walk the cache if it is not logged
+        if not logging.getLogger().isEnabledFor(logging.DEBUG):
+            return
         logging.debug("About to apply the following changes")
         inst = []
         up = []
@@ -881,11 +999,11 @@ class DistUpgradeController(object):
             elif pkg.marked_delete: rm.append(pkg.name)
             elif (pkg.is_installed and pkg.is_upgradable): held.append(pkg.name)
             elif pkg.is_installed and pkg.marked_keep: keep.append(pkg.name)
-        logging.debug("Keep at same version: %s" % " ".join(keep))
-        logging.debug("Upgradable, but held- back: %s" % " ".join(held))
-        logging.debug("Remove: %s" % " ".join(rm))
-        logging.debug("Install: %s" % " ".join(inst))
-        logging.debug("Upgrade: %s" % " ".join(up))
+        logging.debug("Keep at same version: %s", " ".join(keep))
+        logging.debug("Upgradable, but held- back: %s", " ".join(held))
+        logging.debug("Remove: %s", " ".join(rm))
+        logging.debug("Install: %s", " ".join(inst))
+        logging.debug("Upgrade: %s", " ".join(up))
 
     def doPostInitialUpdate(self):
         # check if we have packages in ReqReinst state that are not
@@ -921,11 +1039,17 @@ class DistUpgradeController(object):
         for pkg in self.config.getlist("Distro","MetaPkgs"):
             if pkg in self.cache and self.cache[pkg].is_installed:
                 meta_pkgs.append(pkg)
-        logging.debug("MetaPkgs: %s" % " ".join(sorted(meta_pkgs)))
+        logging.debug("MetaPkgs: %s", " ".join(sorted(meta_pkgs)))
         # FIXME: check out what packages are downloadable etc to
         # compare the list after the update again
-        self.obsolete_pkgs = self.cache._getObsoletesPkgs()
-        self.foreign_pkgs = self.cache._getForeignPkgs(self.origin, self.fromDist, self.toDist)
+        fingerprint = self._planFingerprint("PostInitialUpdate")
+        plan = self._lookupPlan("PostInitialUpdate", fingerprint)
+        if plan:
+            self.obsolete_pkgs = set(plan.data["obsolete"])
+            self.foreign_pkgs = set(plan.data["foreign"])
+        else:
+            self.obsolete_pkgs = self.cache._getObsoletesPkgs()
+            self.foreign_pkgs = self.cache._getForeignPkgs(self.origin, self.fromDist, self.toDist)
         # If a PPA has already been disabled the pkgs won't be considered
         # foreign
         if len(self.foreign_pkgs) > 0:
@@ -933,13 +1057,22 @@ class DistUpgradeController(object):
         else:
             self.config.set("Options","foreignPkgs", "False")
         if self.serverMode:
-            self.tasks = self.cache.installedTasks
-        logging.debug("Foreign: %s" % " ".join(sorted(self.foreign_pkgs)))
-        logging.debug("Obsolete: %s" % " ".join(sorted(self.obsolete_pkgs)))
+            if plan:
+                self.tasks = set(plan.data["tasks"])
+            else:
+                self.tasks = self.cache.installedTasks
+        if fingerprint and not plan:
+            self.plans.save(UpgradePlan(
+                "PostInitialUpdate", fingerprint,
+                {"obsolete": sorted(self.obsolete_pkgs),
+                 "foreign": sorted(self.foreign_pkgs),
+                 "tasks": sorted(self.tasks) if self.serverMode else []}))
+        logging.debug("Foreign: %s", " ".join(sorted(self.foreign_pkgs)))
+        logging.debug("Obsolete: %s", " ".join(sorted(self.obsolete_pkgs)))
         return True
 
     def doUpdate(self, showErrors=True, forceRetries=None):
-        logging.debug("running doUpdate() (showErrors=%s)" % showErrors)
+        logging.debug("running doUpdate() (showErrors=%s)", showErrors)
         if not self.useNetwork:
             logging.debug("doUpdate() will not use the network because self.useNetwork==false")
             return True
@@ -958,7 +1091,7 @@ class DistUpgradeController(object):
                 self.cache.update(progress)
             except (SystemError, IOError) as e:
                 error_msg = str(e)
-                logging.error("IOError/SystemError in cache.update(): '%s'. Retrying (currentRetry: %s)" % (e,currentRetry))
+                logging.error("IOError/SystemError in cache.update(): '%s'. Retrying (currentRetry: %s)", e,currentRetry)
                 currentRetry += 1
                 continue
             # no exception, so all was fine, we are done
@@ -973,12 +1106,38 @@ class DistUpgradeController(object):
                                "connection and retry."), "%s" % error_msg)
         return False
 
+    def _startIndexPrefetch(self):
+        """ download the indexes of the target release while the
+            initial update runs
+        """
+        if (not self.useNetwork or
+                not self.config.getWithDefault("Network", "PrefetchIndexes",
+                                               True)):
+            return
+        sources = SourcesList(matcherPath=self.datadir)
+        lines = target_entries(sources, self.fromDist, self.toDist,
+                               self.config.getlist("Sources", "Pockets"),
+                               self.isMirror)
+        self.prefetch = IndexPrefetch(
+            apt_pkg.config.find_dir("Dir::State::lists"), lines)
+        if self.prefetch.start():
+            logging.info("prefetching the indexes of %s", self.toDist)
+
+    def _installPrefetchedIndexes(self):
+        """ hand the prefetched indexes to the update after the
+            sources.list rewrite
+        """
+        if self.prefetch is None:
+            return
+        self.prefetch.install()
+        self.prefetch = None
+
 
     def _checkBootEfi(self):
         " check that /boot/efi is a mounted partition on an EFI system"
 
         # Not an UEFI system
-        if not os.path.exists("/sys/firmware/efi"):
+        if not self.facts.efi:
             logging.debug("Not an UEFI system")
             return True
 
@@ -991,23 +1150,15 @@ class DistUpgradeController(object):
 
         mounted=False
 
-        with open("/proc/mounts") as mounts:
-            for line in mounts:
-                line=line.strip()
-                try:
-                    (what, where, fs, options, a, b) = line.split()
-                except ValueError as e:
-                    logging.debug("line '%s' in /proc/mounts not understood (%s)" % (line, e))
-                    continue
-
-                if where != "/boot/efi":
-                    continue
+        for mount in self.facts.mounts:
+            if mount.where != "/boot/efi":
+                continue
 
-                mounted=True
+            mounted=True
 
-                if "rw" in options.split(","):
-                    logging.debug("Found writable ESP %s", line)
-                    return True
+            if "rw" in mount.options:
+                logging.debug("Found writable ESP %s", mount)
+                return True
 
         if not mounted:
             self._view.error(_("EFI System Partition (ESP) not usable"),
@@ -1079,19 +1230,51 @@ class DistUpgradeController(object):
         return True
 
 
+    def _planFingerprint(self, stage, **facts):
+        """ fingerprint of the inputs of the given resolver stage or
+            None if upgrade plans are not used
+        """
+        if not self.plans.enabled:
+            return None
+        facts.update({"version": VERSION,
+                      "from": self.fromDist,
+                      "to": self.toDist,
+                      "kernel": self.cache.uname,
+                      "serverMode": getattr(self, "serverMode", None),
+                      "partialUpgrade": self._partialUpgrade,
+                      "useNetwork": self.useNetwork})
+        return system_fingerprint(stage, self.config, facts)
+
+    def _lookupPlan(self, stage, fingerprint):
+        if fingerprint is None:
+            return None
+        return self.plans.lookup(stage, fingerprint)
+
     def calcDistUpgrade(self):
         self._view.updateStatus(_("Calculating the changes"))
-        if not self.cache.distUpgrade(self._view, self.serverMode, self._partialUpgrade):
+        fingerprint = self._planFingerprint("DistUpgrade")
+        plan = self._lookupPlan("DistUpgrade", fingerprint)
+        if not self.cache.distUpgrade(self._view, self.serverMode, self._partialUpgrade, plan):
             return False
 
-        if self.serverMode:
+        if self.serverMode and not (plan and plan.applied):
             if not self.cache.installTasks(self.tasks):
                 return False
 
+        if fingerprint and not (plan and plan.applied):
+            self.plans.save(UpgradePlan.from_cache(
+                "DistUpgrade", fingerprint, self.cache))
+
         # show changes and confirm
         changes = self.cache.get_changes()
         self._view.processEvents()
 
+        # look for modified conffiles while the upgrade is prepared and
+        # downloaded, the result is needed before the commit
+        self.conffile_scan = ConffileScan(
+            [pkg.shortname for pkg in changes
+             if pkg.is_installed and not pkg.marked_delete]).start()
+
         # log the changes for debugging
         self._logChanges()
         self._view.processEvents()
@@ -1110,8 +1293,8 @@ class DistUpgradeController(object):
         self.installed_demotions = self.cache.get_installed_demoted_packages()
         if len(self.installed_demotions) > 0:
             self.installed_demotions.sort()
-            logging.debug("demoted: '%s'" % " ".join([x.name for x in self.installed_demotions]))
-            logging.debug("found components: %s" % self.found_components)
+            logging.debug("demoted: '%s'", " ".join([x.name for x in self.installed_demotions]))
+            logging.debug("found components: %s", self.found_components)
 
         # flush UI
         self._view.processEvents()
@@ -1123,6 +1306,11 @@ class DistUpgradeController(object):
         if not changes:
             return False
 
+        # the scan must not delay the question, only show it if it
+        # is already finished
+        if self.conffile_scan.done():
+            self._view.modified_conffiles = self.conffile_scan.result()
+
         # ask the user
         res = self._view.confirmChanges(_("Do you want to start the upgrade?"),
                                         changes,
@@ -1151,7 +1339,7 @@ class DistUpgradeController(object):
     def _disableAptCronJob(self):
         if os.path.exists("/etc/cron.daily/apt"):
             #self._aptCronJobPerms = os.stat("/etc/cron.daily/apt")[ST_MODE]
-            logging.debug("disabling apt cron job (%s)" % oct(self._aptCronJobPerms))
+            logging.debug("disabling apt cron job (%s)", oct(self._aptCronJobPerms))
             os.chmod("/etc/cron.daily/apt",0o644)
     def _enableAptCronJob(self):
         if os.path.exists("/etc/cron.daily/apt"):
@@ -1167,7 +1355,9 @@ class DistUpgradeController(object):
         #iprogress = self._view.getInstallProgress(self.cache)
         # start slideshow
         url = self.config.getWithDefault("Distro","SlideshowUrl",None)
-        if url:
+        if url and self.low_memory:
+            logging.info("not showing the slideshow in low memory mode")
+        elif url:
             try:
                 lang = locale.getdefaultlocale()[0].split('_')[0]
             except:
@@ -1207,7 +1397,7 @@ class DistUpgradeController(object):
                 break
             except IOError as e:
                 # fetch failed, will be retried
-                logging.error("IOError in cache.commit(): '%s'. Retrying (currentTry: %s)" % (e,currentRetry))
+                logging.error("IOError in cache.commit(): '%s'. Retrying (currentTry: %s)", e,currentRetry)
                 currentRetry += 1
                 exception = e
                 continue
@@ -1244,18 +1434,80 @@ class DistUpgradeController(object):
         except:
             logging.exception("failed to check btrfs support")
             return False
-        logging.debug("apt btrfs snapshots supported: %s" % res)
+        logging.debug("apt btrfs snapshots supported: %s", res)
         return res
 
     def _maybe_create_apt_btrfs_snapshot(self):
-        """ create btrfs snapshot (if btrfs layout is there) """
+        """ create btrfs snapshot (if btrfs layout is there), return
+            True if there is a snapshot of the root now
+        """
         if not self._is_apt_btrfs_snapshot_supported():
-            return
+            return False
         import apt_btrfs_snapshot
         apt_btrfs = apt_btrfs_snapshot.AptBtrfsSnapshot()
         prefix = "release-upgrade-%s-" % self.toDist
         res = apt_btrfs.create_btrfs_root_snapshot(prefix)
-        logging.info("creating snapshot '%s' (success=%s)" % (prefix, res))
+        logging.info("creating snapshot '%s' (success=%s)", prefix, res)
+        return bool(res)
+
+    def _enableUnsafeIo(self):
+        """ let dpkg skip its fsync() calls, a crash during the install
+            rolls back to the root snapshot anyway
+        """
+        if not self.config.getWithDefault("Distro", "UnsafeIoWithSnapshot",
+                                          True):
+            logging.debug("unsafe io with snapshot disabled via config")
+            return False
+        # the kernels and initrds would not be rolled back
+        boot = mount_point("/boot", self.facts.mounts)
+        if boot != "/":
+            logging.info("/boot is not on the root snapshot but on '%s', "
+                         "not using --force-unsafe-io", boot)
+            return False
+        logging.info("root snapshot created, running dpkg with "
+                     "--force-unsafe-io")
+        apt_pkg.config.set("DPkg::Options::", "--force-unsafe-io")
+        return True
+
+    def _disableUnsafeIo(self):
+        """ stop using --force-unsafe-io and write out everything dpkg
+            did not sync with a syncfs() of every filesystem
+        """
+        options = [o for o in apt_pkg.config.value_list("DPkg::Options")
+                   if o != "--force-unsafe-io"]
+        apt_pkg.config.clear("DPkg::Options")
+        for option in options:
+            apt_pkg.config.set("DPkg::Options::", option)
+        start = time.time()
+        # the mount table may have changed during the install
+        self.facts.forget("mounts")
+        for where in writable_filesystems(self.facts.mounts) or ["/"]:
+            syncfs(where)
+        logging.info("syncfs() after the unsafe io install took %.1fs",
+                     time.time() - start)
+
+    def replayHooks(self, show_errors=True):
+        """ run the hooks that were recorded during the install, a
+            failure (e.g. of update-initramfs) may leave the system
+            unbootable and is an error
+        """
+        for (argv, res) in self.hook_queue.replay():
+            if not show_errors:
+                continue
+            self._view.error(
+                _("A post-installation hook failed"),
+                _("'%s' failed after the packages were installed. The "
+                  "system may not boot until it runs successfully.") %
+                " ".join(argv), "%s" % res)
+
+    def _replayHooksAtExit(self, pid):
+        """ the upgrade ended before the recorded hooks ran """
+        # not in forked children
+        if os.getpid() != pid or not self.hook_queue.pending():
+            return
+        logging.warning("running the recorded hooks before exiting")
+        # the view may be gone already, the failures are logged
+        self.replayHooks(show_errors=False)
 
     def doDistUpgradeSimulation(self):
         backups = {}
@@ -1273,6 +1525,19 @@ class DistUpgradeController(object):
                 for item in backups[lst]:
                     apt_pkg.config.set(lst, item)
 
+    def _applyConffileScan(self, iprogress):
+        """ log the modified conffiles and pass them to the install
+            progress so that it can decide about the prompts upfront
+        """
+        if self.conffile_scan is None:
+            return
+        modified = self.conffile_scan.result()
+        logging.info("%s locally modified conffiles: %s",
+                     len(modified), " ".join(sorted(modified)))
+        if hasattr(iprogress, "set_conffile_decisions"):
+            iprogress.set_conffile_decisions(
+                dict((path, False) for path in modified))
+
     def doDistUpgrade(self):
         # add debug code only here
         #apt_pkg.config.set("Debug::pkgDpkgPM", "1")
@@ -1283,20 +1548,33 @@ class DistUpgradeController(object):
         currentRetry = 0
         fprogress = self._view.getAcquireProgress()
         iprogress = self._view.getInstallProgress(self.cache)
+        self._applyConffileScan(iprogress)
         # retry the fetching in case of errors
         maxRetries = self.config.getint("Network","MaxRetries")
+        unsafe_io = False
         if not self._partialUpgrade:
             self.quirks.run("StartUpgrade")
             # FIXME: take this into account for diskspace calculation
-            self._maybe_create_apt_btrfs_snapshot()
+            if self._maybe_create_apt_btrfs_snapshot():
+                unsafe_io = self._enableUnsafeIo()
+            if self.config.getWithDefault("Distro", "CoalesceHooks", True):
+                self.hook_queue.enable()
+                # the hooks still run if the upgrade is interrupted
+                # before the PostUpgrade quirk
+                atexit.register(self._replayHooksAtExit, os.getpid())
+        if self.config.getWithDefault("Distro", "BatchRestarts", True):
+            self.restart_queue.enable()
+        if self.low_memory:
+            # dpkg and the maintainer scripts need it more than we do
+            self.cache.release_memory()
         res = False
         exception = None
         while currentRetry < maxRetries:
             try:
                 res = self.cache.commit(fprogress,iprogress)
-                logging.debug("cache.commit() returned %s" % res)
+                logging.debug("cache.commit() returned %s", res)
             except SystemError as e:
-                logging.error("SystemError from cache.commit(): %s" % e)
+                logging.error("SystemError from cache.commit(): %s", e)
                 exception = e
                 # if its a ordering bug we can cleanly revert to
                 # the previous release, no packages have been installed
@@ -1304,7 +1582,7 @@ class DistUpgradeController(object):
                 if os.path.exists("/var/run/ubuntu-release-upgrader-apt-exception"):
                     with open("/var/run/ubuntu-release-upgrader-apt-exception") as f:
                         e = f.read()
-                    logging.error("found exception: '%s'" % e)
+                    logging.error("found exception: '%s'", e)
                     # if its a ordering bug we can cleanly revert but we need to write
                     # a marker for the parent process to know its this kind of error
                     pre_configure_errors = [
@@ -1335,16 +1613,23 @@ class DistUpgradeController(object):
                                  "to the bug report.\n"
                                  "%s" % e)
                 self._view.error(_("Could not install the upgrades"), msg)
+                if unsafe_io:
+                    self._disableUnsafeIo()
+                self.hook_queue.disable()
+                self.restart_queue.disable()
                 # installing the packages failed, can't be retried
                 cmd = ["/usr/bin/dpkg","--configure","-a"]
                 if os.environ.get("DEBIAN_FRONTEND") == "noninteractive":
                     cmd.append("--force-confold")
                 self._view.getTerminal().call(cmd)
+                # the PostUpgrade quirk will not run
+                self.replayHooks()
+                self.restart_queue.flush()
                 self._enableAptCronJob()
                 return False
             except IOError as e:
                 # fetch failed, will be retried
-                logging.error("IOError in cache.commit(): '%s'. Retrying (currentTry: %s)" % (e,currentRetry))
+                logging.error("IOError in cache.commit(): '%s'. Retrying (currentTry: %s)", e,currentRetry)
                 currentRetry += 1
                 exception = e
                 continue
@@ -1362,11 +1647,19 @@ class DistUpgradeController(object):
                     # abort() exits cleanly
                     self.abort()
             # no exception, so all was fine, we are done
+            if unsafe_io:
+                self._disableUnsafeIo()
+            # the PostUpgrade quirk runs the recorded hooks
+            self.hook_queue.disable()
+            self.restart_queue.disable()
+            self.restart_queue.flush()
             self._enableAptCronJob()
             return True
 
         # maximum fetch-retries reached without a successful commit
         logging.error("giving up on fetching after maximum retries")
+        self.hook_queue.disable()
+        self.restart_queue.disable()
         self._view.error(_("Could not download the upgrades"),
                          _("The upgrade has aborted. Please check your "\
                            "Internet connection or "\
@@ -1399,14 +1692,14 @@ class DistUpgradeController(object):
         self._view.updateStatus(_("Searching for obsolete software"))
         now_obsolete = self.cache._getObsoletesPkgs()
         now_foreign = self.cache._getForeignPkgs(self.origin, self.fromDist, self.toDist)
-        logging.debug("Obsolete: %s" % " ".join(sorted(now_obsolete)))
-        logging.debug("Foreign: %s" % " ".join(sorted(now_foreign)))
+        logging.debug("Obsolete: %s", " ".join(sorted(now_obsolete)))
+        logging.debug("Foreign: %s", " ".join(sorted(now_foreign)))
         # now sanity check - if a base meta package is in the obsolete list now, that means
         # that something went wrong (see #335154) badly with the network. this should never happen, but it did happen
         # at least once so we add extra paranoia here
         for pkg in self.config.getlist("Distro","BaseMetaPkgs"):
             if pkg in now_obsolete:
-                logging.error("the BaseMetaPkg '%s' is in the obsolete list, something is wrong, ignoring the obsoletes" % pkg)
+                logging.error("the BaseMetaPkg '%s' is in the obsolete list, something is wrong, ignoring the obsoletes", pkg)
                 now_obsolete = set()
                 break
         # check if we actually want obsolete removal
@@ -1418,7 +1711,7 @@ class DistUpgradeController(object):
         for pkg in self.config.getlist("Distro","MetaPkgs"):
             if pkg in self.cache and self.cache[pkg].is_installed:
                 self.forced_obsoletes.extend(self.config.getlist(pkg,"ForcedObsoletes"))
-        logging.debug("forced_obsoletes: %s" % self.forced_obsoletes)
+        logging.debug("forced_obsoletes: %s", self.forced_obsoletes)
 
         # mark packages that are now obsolete (and were not obsolete
         # before) to be deleted. make sure to not delete any foreign
@@ -1437,28 +1730,37 @@ class DistUpgradeController(object):
 
         # now go for the unused dependencies
         unused_dependencies = self.cache._getUnusedDependencies()
-        logging.debug("Unused dependencies: %s" %" ".join(unused_dependencies))
+        logging.debug("Unused dependencies: %s", " ".join(unused_dependencies))
         remove_candidates |= set(unused_dependencies)
 
         # see if we actually have to do anything here
         if not self.config.getWithDefault("Distro","RemoveObsoletes", True):
             logging.debug("Skipping RemoveObsoletes as stated in the config")
             remove_candidates = set()
-        logging.debug("remove_candidates: '%s'" % remove_candidates)
-        logging.debug("Start checking for obsolete pkgs")
-        progress = self._view.getOpCacheProgress()
-        for (i, pkgname) in enumerate(remove_candidates):
-            progress.update((i/float(len(remove_candidates)))*100.0)
-            if pkgname not in self.foreign_pkgs:
-                self._view.processEvents()
-                if not self.cache.tryMarkObsoleteForRemoval(pkgname, remove_candidates, self.forced_obsoletes, self.foreign_pkgs):
-                    logging.debug("'%s' scheduled for remove but not safe to remove, skipping", pkgname)
-        logging.debug("Finish checking for obsolete pkgs")
-        progress.done()
+        logging.debug("remove_candidates: '%s'", remove_candidates)
+        fingerprint = self._planFingerprint(
+            "Cleanup",
+            remove_candidates=" ".join(sorted(remove_candidates)),
+            foreign=" ".join(sorted(self.foreign_pkgs)))
+        plan = self._lookupPlan("Cleanup", fingerprint)
+        if plan is None or not plan.apply(self.cache):
+            logging.debug("Start checking for obsolete pkgs")
+            progress = self._view.getOpCacheProgress()
+            for (i, pkgname) in enumerate(remove_candidates):
+                progress.update((i/float(len(remove_candidates)))*100.0)
+                if pkgname not in self.foreign_pkgs:
+                    self._view.processEvents()
+                    if not self.cache.tryMarkObsoleteForRemoval(pkgname, remove_candidates, self.forced_obsoletes, self.foreign_pkgs):
+                        logging.debug("'%s' scheduled for remove but not safe to remove, skipping", pkgname)
+            logging.debug("Finish checking for obsolete pkgs")
+            progress.done()
+            if fingerprint:
+                self.plans.save(UpgradePlan.from_cache(
+                    "Cleanup", fingerprint, self.cache))
 
         # get changes
         changes = self.cache.get_changes()
-        logging.debug("The following packages are marked for removal: %s" % " ".join([pkg.name for pkg in changes]))
+        logging.debug("The following packages are marked for removal: %s", " ".join([pkg.name for pkg in changes]))
         summary = _("Remove obsolete packages?")
         actions = [_("_Keep"), _("_Remove")]
         # FIXME Add an explanation about what obsolete packages are
@@ -1470,7 +1772,7 @@ class DistUpgradeController(object):
             try:
                 self.cache.commit(fprogress,iprogress)
             except (SystemError, IOError) as e:
-                logging.error("cache.commit() in doPostUpgrade() failed: %s" % e)
+                logging.error("cache.commit() in doPostUpgrade() failed: %s", e)
                 self._view.error(_("Error during commit"),
                                  _("A problem occurred during the clean-up. "
                                    "Please see the below message for more "
@@ -1498,23 +1800,32 @@ class DistUpgradeController(object):
         # now run the post-upgrade fixup scripts (if any)
         for script in self.config.getlist("Distro","PostInstallScripts"):
             if not os.path.exists(script):
-                logging.warning("PostInstallScript: '%s' not found" % script)
+                logging.warning("PostInstallScript: '%s' not found", script)
                 continue
-            logging.debug("Running PostInstallScript: '%s'" % script)
+            logging.debug("Running PostInstallScript: '%s'", script)
             try:
                 # work around kde tmpfile problem where it eats permissions
                 check_and_fix_xbit(script)
                 self._view.getTerminal().call([script], hidden=True)
             except Exception as e:
-                logging.error("got error from PostInstallScript %s (%s)" % (script, e))
+                logging.error("got error from PostInstallScript %s (%s)", script, e)
         if self.cache:
             self.cache.get_lock()
 
     def abort(self):
         """ abort the upgrade, cleanup (as much as possible) """
         logging.debug("abort called")
+        if self.plan_only:
+            # nothing was changed, the sources are private copies
+            sys.exit(1)
         if hasattr(self, "sources"):
             self.sources.restore_backup(self.sources_backup_ext)
+        if self.prefetch is not None:
+            self.prefetch.cancel()
+        # packages may have been installed already
+        self.replayHooks()
+        self.restart_queue.disable()
+        self.restart_queue.flush()
         # generate a new cache
         self._view.updateStatus(_("Restoring original system state"))
         self._view.abort()
@@ -1524,20 +1835,20 @@ class DistUpgradeController(object):
     def _checkDep(self, depstr):
         " check if a given depends can be satisfied "
         for or_group in apt_pkg.parse_depends(depstr):
-            logging.debug("checking: '%s' " % or_group)
+            logging.debug("checking: '%s' ", or_group)
             for dep in or_group:
                 depname = dep[0]
                 ver = dep[1]
                 oper = dep[2]
                 if depname not in self.cache:
-                    logging.error("_checkDep: '%s' not in cache" % depname)
+                    logging.error("_checkDep: '%s' not in cache", depname)
                     return False
                 inst = self.cache[depname]
                 instver = getattr(inst.installed, "version", None)
                 if (instver != None and
                     apt_pkg.check_dep(instver,oper,ver) == True):
                     return True
-        logging.error("depends '%s' is not satisfied" % depstr)
+        logging.error("depends '%s' is not satisfied", depstr)
         return False
 
     def checkViewDepends(self):
@@ -1573,7 +1884,7 @@ class DistUpgradeController(object):
             self.openCache()
             for pkgname in backportslist:
                 if pkgname not in self.cache:
-                    logging.error("Can not find backport '%s'" % pkgname)
+                    logging.error("Can not find backport '%s'", pkgname)
                     raise NoBackportsFoundException(pkgname)
             if self._allBackportsAuthenticated(backportslist):
                 break
@@ -1627,7 +1938,7 @@ class DistUpgradeController(object):
             # both apt-debtorrent and apt-cacher use this (LP: #365537)
             mirror_host_part = mirror.split("//")[1]
             if uri.endswith(mirror_host_part):
-                logging.debug("found apt-cacher/apt-torrent style uri %s" % uri)
+                logging.debug("found apt-cacher/apt-torrent style uri %s", uri)
                 return True
         return False
 
@@ -1667,14 +1978,14 @@ class DistUpgradeController(object):
         " add prerequists based on template into the path outfile "
         # go over the sources.list and try to find a valid mirror
         # that we can use to add the backports dir
-        logging.debug("writing prerequists sources.list at: '%s' " % out)
+        logging.debug("writing prerequists sources.list at: '%s' ", out)
         mirrorlines = self._getPreReqMirrorLines(dumb)
         with open(out, "w") as outfile, open(template) as infile:
             for line in infile:
                 template = Template(line)
                 outline = template.safe_substitute(mirror=mirrorlines)
                 outfile.write(outline)
-                logging.debug("adding '%s' prerequists" % outline)
+                logging.debug("adding '%s' prerequists", outline)
         return True
 
     def getRequiredBackports(self):
@@ -1710,7 +2021,7 @@ class DistUpgradeController(object):
             conf_option = conf_option + "-%s" % self.arch
         prereq_template = self.config.get("PreRequists",conf_option)
         if not os.path.exists(prereq_template):
-            logging.error("sourceslist not found '%s'" % prereq_template)
+            logging.error("sourceslist not found '%s'", prereq_template)
             return False
         outpath = os.path.join(apt_pkg.config.find_dir("Dir::Etc::sourceparts"), prereq_template)
         outfile = os.path.join(apt_pkg.config.find_dir("Dir::Etc::sourceparts"), prereq_template)
@@ -1722,7 +2033,7 @@ class DistUpgradeController(object):
             try:
                 self._verifyBackports()
             except NoBackportsFoundException as e:
-                logging.warning("no backport for '%s' found" % e)
+                logging.warning("no backport for '%s' found", e)
             return False
         
         # FIXME: sanity check the origin (just for safety)
@@ -1731,14 +2042,14 @@ class DistUpgradeController(object):
             # look for the right version (backport)
             ver = self.cache._depcache.get_candidate_ver(pkg._pkg)
             if not ver:
-                logging.error("No candidate for '%s'" % pkgname)
+                logging.error("No candidate for '%s'", pkgname)
                 os.unlink(outpath)
                 return False
             if ver.file_list == None:
-                logging.error("No ver.file_list for '%s'" % pkgname)
+                logging.error("No ver.file_list for '%s'", pkgname)
                 os.unlink(outpath)
                 return False
-            logging.debug("marking '%s' for install" % pkgname)
+            logging.debug("marking '%s' for install", pkgname)
             # mark install
             pkg.mark_install(auto_inst=False, auto_fix=False)
 
@@ -1748,10 +2059,10 @@ class DistUpgradeController(object):
             res = self.cache.commit(self._view.getAcquireProgress(),
                                     self._view.getInstallProgress(self.cache))
         except IOError as e:
-            logging.error("fetch_archives returned '%s'" % e)
+            logging.error("fetch_archives returned '%s'", e)
             res = False
         except SystemError as e:
-            logging.error("install_archives returned '%s'" % e)
+            logging.error("install_archives returned '%s'", e)
             res = False
 
         if res == False:
@@ -1761,7 +2072,7 @@ class DistUpgradeController(object):
         try:
             os.unlink(outfile)
         except Exception as e:
-            logging.error("failed to unlink pre-requists file: '%s'" % e)
+            logging.error("failed to unlink pre-requists file: '%s'", e)
         return self.setupRequiredBackports()
 
     # used by both cdrom/http fetcher
@@ -1786,6 +2097,91 @@ class DistUpgradeController(object):
         os.execve(sys.argv[0],args, os.environ)
 
     # this is the core
+    def doPlanOnly(self, report_path, stdout=None):
+        """ calculate what the upgrade would do and write a JSON report
+            to report_path (or stdout for "-"), without changing the
+            system
+        """
+        report = {"from": self.fromDist,
+                  "to": self.toDist,
+                  "result": "failed"}
+        apt_root = PrivateAptRoot()
+        # the package cache of the system is not updated either
+        apt_root.no_cache_files()
+        try:
+            self._planOnly(apt_root, report)
+        except Exception as e:
+            logging.exception("planning the upgrade failed")
+            report["error"] = str(e)
+        finally:
+            apt_root.cleanup()
+            write_report(report, report_path, stdout)
+        return report["result"] == "ok"
+
+    def _planOnly(self, apt_root, report):
+        # the current system, as described by the indexes on disk
+        self.openCache(lock=False)
+        self.serverMode = self.cache.need_server_mode()
+        report["reinstall_required"] = sorted(self.cache.req_reinstall_pkgs)
+        self.obsolete_pkgs = self.cache._getObsoletesPkgs()
+        self.foreign_pkgs = self.cache._getForeignPkgs(
+            self.origin, self.fromDist, self.toDist)
+        self.config.set("Options", "foreignPkgs",
+                        str(len(self.foreign_pkgs) > 0))
+        report["obsolete"] = sorted(self.obsolete_pkgs)
+        report["foreign"] = sorted(self.foreign_pkgs)
+        if self.serverMode:
+            self.tasks = self.cache.installedTasks
+
+        # the sources of the target release, in the private apt root
+        self._view.updateStatus(_("Updating repository information"))
+        apt_root.enable()
+        self.sources = TrackedSourcesList(matcherPath=self.datadir)
+        enabled = [(entry, str(entry)) for entry in self.sources.list
+                   if not (entry.invalid or entry.disabled)]
+        if not self.rewriteSourcesList(mirror_check=True):
+            report["error"] = "no valid mirror found"
+            return
+        self.sources.save()
+        report["disabled_sources"] = [
+            {"line": line, "third_party": not self.isMirror(entry.uri)}
+            for (entry, line) in enabled
+            if entry.disabled or entry not in self.sources.list]
+        if not self.doUpdate(showErrors=False):
+            report["error"] = "updating the package lists failed"
+            return
+
+        # the upgrade
+        self.openCache(lock=False)
+        self.serverMode = self.cache.need_server_mode()
+        report["server_mode"] = self.serverMode
+        self._view.updateStatus(_("Calculating the changes"))
+        if (not self.cache.distUpgrade(self._view, self.serverMode,
+                                       self._partialUpgrade) or
+                (self.serverMode and
+                 not self.cache.installTasks(self.tasks))):
+            report["error"] = "the upgrade can not be calculated"
+            return
+        report["changes"] = changes_from_cache(self.cache)
+        report["download_bytes"] = self.cache.required_download
+        report["install_bytes"] = self.cache.additional_required_space
+        report["free_space"] = self._planFreeSpace()
+        report["demotions"] = sorted(
+            pkg.name for pkg in self.cache.get_installed_demoted_packages())
+        report["result"] = "ok"
+
+    def _planFreeSpace(self):
+        """ the free space verdict of the upgrade for the report """
+        try:
+            self.cache.checkFreeSpace(self._is_apt_btrfs_snapshot_supported())
+        except NotEnoughFreeSpaceError as e:
+            return {"ok": False,
+                    "required": [{"dir": req.dir,
+                                  "total": req.size_total,
+                                  "needed": req.size_needed}
+                                 for req in e.free_space_required_list]}
+        return {"ok": True, "required": []}
+
     def fullUpgrade(self):
         # sanity check (check for ubuntu-desktop, brokenCache etc)
         self._view.updateStatus(_("Checking package manager"))
@@ -1853,6 +2249,7 @@ class DistUpgradeController(object):
         # because the (unmodified) sources.list of the user
         # may contain bad/unreachable entries we run only
         # with a single retry
+        self._startIndexPrefetch()
         self.doUpdate(showErrors=False, forceRetries=1)
         self.openCache()
 
@@ -1867,7 +2264,9 @@ class DistUpgradeController(object):
             if not self.updateSourcesList():
                 self.abort()
 
-            # then update the package index files
+            # then update the package index files, most of them were
+            # prefetched during the initial update
+            self._installPrefetchedIndexes()
             if not self.doUpdate():
                 self.abort()
 
@@ -1894,11 +2293,11 @@ class DistUpgradeController(object):
                     #        but we need to be careful to not duplicate them
                     #        (i.e. the error here could be something else than
                     #        missing sources entries but network errors etc)
-                    logging.error("No '%s' available/downloadable after sources.list rewrite+update" % pkg)
+                    logging.error("No '%s' available/downloadable after sources.list rewrite+update", pkg)
                     if pkg not in self.cache:
-                        logging.error("'%s' was not in the cache" % pkg)
+                        logging.error("'%s' was not in the cache", pkg)
                     if not self.cache.anyVersionDownloadable(self.cache[pkg]):
-                        logging.error("'%s' was not downloadable" % pkg)
+                        logging.error("'%s' was not downloadable", pkg)
                     self._view.error(_("Invalid package information"),
                                      _("After updating your package "
                                        "information, the essential package '%s' "
@@ -2012,6 +2411,7 @@ class DistUpgradeController(object):
         self._view.setStep(Step.REBOOT)
         self._view.updateStatus(_("System upgrade is complete."))            
         get_telemetry().done()
+        get_memory_report().done()
         # FIXME should we look into /var/run/reboot-required here?
         if (not inside_chroot() and
             self._view.confirmRestart()):
@@ -0,0 +1,160 @@
+# DistUpgradeDistro.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+The distribution abstraction of distro.py, without the parts that are
+slow and not needed for an upgrade.
+
+Distribution.get_mirrors() parses all of iso_3166.xml every time
+get_sources() is called, just to know the name of the country of the
+locale. Here the country table is read on demand and only as far as
+needed, once per process. The distribution template is looked up by
+codename in the index of the sources list matcher.
+"""
+
+import gettext
+import os
+from collections.abc import Mapping
+from xml.etree.ElementTree import iterparse
+
+from .distro import UbuntuDistribution
+from .distro import get_distro as _get_distro
+
+
+ISO_3166_FILE = "/usr/share/xml/iso-codes/iso_3166.xml"
+
+
+class CountryTable(Mapping):
+    """ lowercase country code -> translated name, read from
+        iso_3166.xml as far as the looked up codes require
+    """
+
+    def __init__(self, fname=ISO_3166_FILE):
+        self.fname = fname
+        self._names = {}
+        self._translated = {}
+        self._entries = None
+
+    def _parse(self):
+        if not os.path.exists(self.fname):
+            return
+        for (event, elm) in iterparse(self.fname):
+            if elm.tag != "iso_3166_entry":
+                continue
+            code = elm.get("alpha_2_code") or elm.get("alpha_3_code")
+            name = elm.get("common_name") or elm.get("name")
+            elm.clear()
+            if code and name:
+                yield (code.lower(), name)
+
+    def _read_until(self, code=None):
+        """ read entries until code is found (or the end of the file) """
+        if self._entries is None:
+            self._entries = self._parse()
+        for (entry_code, name) in self._entries:
+            self._names.setdefault(entry_code, name)
+            if entry_code == code:
+                return
+
+    def __getitem__(self, code):
+        if code not in self._names:
+            self._read_until(code)
+        if code not in self._translated:
+            self._translated[code] = gettext.dgettext(
+                "iso_3166", self._names[code])
+        return self._translated[code]
+
+    def __iter__(self):
+        self._read_until()
+        return iter(list(self._names))
+
+    def __len__(self):
+        self._read_until()
+        return len(self._names)
+
+
+_countries = None
+
+
+def get_countries():
+    """ return the CountryTable of this process """
+    global _countries
+    if _countries is None:
+        _countries = CountryTable()
+    return _countries
+
+
+class _TemplatesView(object):
+    """ a sources list whose matcher only has the given templates """
+
+    def __init__(self, sourceslist, templates):
+        self.list = sourceslist.list
+        self.matcher = self
+        self.templates = templates
+
+
+class UpgradeDistribution(UbuntuDistribution):
+    """ UbuntuDistribution with the template looked up by codename and
+        the country table read on demand
+    """
+
+    MIRROR_TEMPLATE = "http://%s.archive.ubuntu.com/ubuntu/"
+
+    def get_sources(self, sourceslist):
+        templates_named = getattr(sourceslist.matcher, "templates_named",
+                                  None)
+        if templates_named is None:
+            return UbuntuDistribution.get_sources(self, sourceslist)
+        UbuntuDistribution.get_sources(
+            self, _TemplatesView(sourceslist, templates_named(self.codename)))
+        self.sourceslist = sourceslist
+
+    def get_mirrors(self):
+        self.main_server = self.source_template.base_uri
+        for medium in self.used_media:
+            if not medium.startswith("cdrom:"):
+                self.used_servers.append(medium)
+        if len(self.main_sources) == 0:
+            self.default_server = self.main_server
+        else:
+            self.default_server = self.main_sources[0].uri
+        self.countries = get_countries()
+        # try to guess the nearest mirror from the locale
+        self.country = None
+        self.country_code = None
+        locale = os.getenv("LANG", default="en_UK")
+        a = locale.find("_")
+        z = locale.find(".")
+        if z == -1:
+            z = len(locale)
+        country_code = locale[a + 1:z].lower()
+        self.nearest_server = self.MIRROR_TEMPLATE % country_code
+        if country_code in self.countries:
+            self.country = self.countries[country_code]
+            self.country_code = country_code
+
+
+def get_distro(*args, **kwargs):
+    """ distro.get_distro(), an UpgradeDistribution for Ubuntu """
+    distro = _get_distro(*args, **kwargs)
+    if type(distro) is UbuntuDistribution:
+        return UpgradeDistribution(distro.id, distro.codename,
+                                   distro.description, distro.release,
+                                   distro.is_like)
+    return distro
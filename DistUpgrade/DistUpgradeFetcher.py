@@ -36,6 +36,8 @@ import socket
 
 
 class DistUpgradeFetcherGtk(DistUpgradeFetcherCore):
+    # the progress belongs to the main loop of the view
+    BACKGROUND_PROGRESS_IN_THREAD = False
 
     def __init__(self, new_dist, progress, parent, datadir):
         DistUpgradeFetcherCore.__init__(self, new_dist, progress)
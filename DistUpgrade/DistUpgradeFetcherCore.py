@@ -22,10 +22,13 @@
 
 from string import Template
 import os
+import apt
 import apt_pkg
+import atexit
 import logging
 import tarfile
 import tempfile
+import threading
 import shutil
 import socket
 import sys
@@ -37,6 +40,175 @@ from urllib.error import HTTPError
 
 from .utils import get_dist, url_downloadable, country_mirror
 from .DistUpgradeViewText import readline
+from .DistUpgradeTarballCache import CACHE_DIR, TarballCache
+from .DistUpgradeMirrorRanking import CACHE_PATH, MirrorRanking
+
+try:
+    import gpg
+except ImportError:
+    gpg = None
+
+
+DEFAULT_KEYRING = "/usr/share/keyrings/ubuntu-archive-keyring.gpg"
+
+# gpgme contexts with the keys of a keyring already imported
+_gpg_contexts = {}
+
+
+def _gpg_context(keyring):
+    """ return a gpgme context that knows the keys of keyring,
+        the keys are imported once per process
+    """
+    st = os.stat(keyring)
+    key = (keyring, st.st_mtime_ns, st.st_size)
+    if key not in _gpg_contexts:
+        home = tempfile.mkdtemp(prefix="ubuntu-release-upgrader-gpg-")
+        atexit.register(shutil.rmtree, home, True)
+        # like gpgv, every key of the keyring is trusted
+        with open(os.path.join(home, "gpg.conf"), "w") as f:
+            f.write("trust-model always\n")
+        ctx = gpg.Context(home_dir=home)
+        with open(keyring, "rb") as f:
+            ctx.key_import(f.read())
+        _gpg_contexts[key] = ctx
+    return _gpg_contexts[key]
+
+
+def _valid_signatures(result):
+    """ gpgme only raises for bad signatures, a missing signature or one
+        by an unknown key has to be checked for in the result
+    """
+    return (bool(result.signatures) and
+            all(sig.status == 0 and
+                sig.summary & gpg.constants.sigsum.VALID
+                for sig in result.signatures))
+
+
+def verify_signature(file, signature, keyring=DEFAULT_KEYRING):
+    """ check the detached signature of file against keyring
+
+    this is done in process with gpgme if python3-gpg is available and
+    with a single gpgv call otherwise
+    """
+    if gpg is not None:
+        try:
+            with open(file, "rb") as data, open(signature, "rb") as sig:
+                (_, result) = _gpg_context(keyring).verify(data,
+                                                           signature=sig)
+            if _valid_signatures(result):
+                return True
+            logging.warning("no valid signature for '%s' found by gpgme, "
+                            "using gpgv", file)
+        except gpg.errors.BadSignatures as e:
+            logging.warning("bad signature for '%s': %s", file, e)
+            return False
+        except (gpg.errors.GpgError, IOError, OSError) as e:
+            logging.warning("gpgme can not verify '%s' (%s), using gpgv",
+                            file, e)
+    try:
+        ret = subprocess.call(["gpgv", "--keyring", keyring, signature, file],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    except OSError as e:
+        logging.error("can not run gpgv: %s", e)
+        return False
+    return ret == 0
+
+
+class BackgroundAcquireProgress(apt.progress.base.AcquireProgress):
+    """ progress of a download that runs while something else is shown
+
+    nothing is reported until attach() is called, from then on
+    everything is passed on to the real progress. If the download
+    already finished by then its start, last pulse and stop are
+    replayed. cancel() makes the download stop at the next pulse.
+    """
+
+    ATTRIBUTES = ("current_bytes", "current_cps", "current_items",
+                  "elapsed_time", "fetched_bytes", "last_bytes",
+                  "total_bytes", "total_items")
+
+    def __init__(self, progress):
+        apt.progress.base.AcquireProgress.__init__(self)
+        self._progress = progress
+        self._lock = threading.Lock()
+        self._attached = False
+        self._cancelled = False
+        self._started = False
+        self._stopped = False
+        self._pulsed = False
+        self._owner = None
+
+    def _sync(self):
+        for name in self.ATTRIBUTES:
+            setattr(self._progress, name, getattr(self, name))
+
+    def _forward(self):
+        return self._attached and self._progress is not None
+
+    def attach(self):
+        with self._lock:
+            self._attached = True
+            if not self._forward() or not self._started:
+                return
+            self._progress.start()
+            if self._stopped:
+                self._sync()
+                if self._pulsed:
+                    self._progress.pulse(self._owner)
+                self._progress.stop()
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+
+    def start(self):
+        with self._lock:
+            self._started = True
+            if self._forward():
+                self._progress.start()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            if self._forward():
+                self._sync()
+                self._progress.stop()
+
+    def pulse(self, owner):
+        with self._lock:
+            self._pulsed = True
+            self._owner = owner
+            if self._cancelled:
+                return False
+            if self._forward():
+                self._sync()
+                return self._progress.pulse(owner)
+        return True
+
+    def fetch(self, item):
+        with self._lock:
+            if self._forward():
+                self._progress.fetch(item)
+
+    def done(self, item):
+        with self._lock:
+            if self._forward():
+                self._progress.done(item)
+
+    def fail(self, item):
+        with self._lock:
+            if self._forward():
+                self._progress.fail(item)
+
+    def ims_hit(self, item):
+        with self._lock:
+            if self._forward():
+                self._progress.ims_hit(item)
+
+    def media_change(self, medium, drive):
+        # nobody can insert a medium for a background download
+        return False
 
 
 class DistUpgradeFetcherCore(object):
@@ -45,6 +217,15 @@ class DistUpgradeFetcherCore(object):
     DEFAULT_MIRROR = "http://archive.ubuntu.com/ubuntu"
     DEFAULT_COMPONENT = "main"
     DEBUG = "DEBUG_UPDATE_MANAGER" in os.environ
+    # the progress of the background download can be updated from the
+    # download thread once the release notes are gone, graphical
+    # progress widgets need to stay in the main thread
+    BACKGROUND_PROGRESS_IN_THREAD = True
+    # authenticated tarballs are kept here for the next run
+    TARBALL_CACHE_DIR = CACHE_DIR
+    # the mirror measurements are shared with the release upgrader,
+    # None probes the mirrors every time
+    MIRROR_RANKING_CACHE = CACHE_PATH
 
     def __init__(self, new_dist, progress):
         self.new_dist = new_dist
@@ -52,6 +233,17 @@ class DistUpgradeFetcherCore(object):
         self._progress = progress
         # options to pass to the release upgrader when it is run
         self.run_options = []
+        self.tmpdir = None
+        self.uri = None
+        # the download that runs while the release notes are shown
+        self._prefetch = None
+        self._prefetch_result = False
+        self.tarball_cache = None
+        if self.TARBALL_CACHE_DIR:
+            self.tarball_cache = TarballCache(self.TARBALL_CACHE_DIR)
+        # set if the tarball was taken from the cache
+        self._cached_sha256 = None
+        self._cache_validators = None
 
     def _debug(self, msg):
         " helper to show debug information "
@@ -108,16 +300,9 @@ class DistUpgradeFetcherCore(object):
         """ authenticated a file against a given signature, if no keyring
             is given use the apt default keyring
         """
-        gpg = ["apt-key"]
-
         if not keyring:
-            keyring = '/usr/share/keyrings/ubuntu-archive-keyring.gpg'
-
-        gpg += ["--keyring", keyring]
-
-        gpg += ["verify", signature, file]
-        ret = subprocess.call(gpg, stderr=subprocess.PIPE)
-        return ret == 0
+            keyring = DEFAULT_KEYRING
+        return verify_signature(file, signature, keyring)
 
     def extractDistUpgrader(self):
         # extract the tarball
@@ -125,13 +310,15 @@ class DistUpgradeFetcherCore(object):
         print(_("extracting '%s'") % os.path.basename(fname))
         if not os.path.exists(fname):
             return False
+        # the tarball is authenticated, extract it as it is in a
+        # single streaming pass
+        kwargs = {}
+        if hasattr(tarfile, "fully_trusted_filter"):
+            kwargs["filter"] = "fully_trusted"
         try:
-            tar = tarfile.open(self.tmpdir + "/" +
-                               os.path.basename(self.uri), "r")
-            for tarinfo in tar:
-                tar.extract(tarinfo)
-            tar.close()
-        except tarfile.ReadError as e:
+            with tarfile.open(fname, "r|*") as tar:
+                tar.extractall(self.tmpdir, **kwargs)
+        except (tarfile.TarError, EOFError) as e:
             logging.error("failed to open tarfile (%s)" % e)
             return False
         return True
@@ -192,8 +379,12 @@ class DistUpgradeFetcherCore(object):
             new_uri = self.mirror_from_sources_list(uri, self.DEFAULT_MIRROR)
             if new_uri:
                 return new_uri
-        # if that fails, use old method
         uri_template = Template(uri)
+        # then the fastest of the country mirror and the main server
+        new_uri = self._rankedUri(uri_template)
+        if new_uri:
+            return new_uri
+        # if that fails, use old method
         m = country_mirror()
         new_uri = uri_template.safe_substitute(countrymirror=m)
         # be paranoid and check if the given uri is really downloadable
@@ -206,8 +397,28 @@ class DistUpgradeFetcherCore(object):
             new_uri = uri_template.safe_substitute(countrymirror='')
         return new_uri
 
-    def fetchDistUpgrader(self):
-        " download the tarball with the upgrade script "
+    def _rankedUri(self, uri_template):
+        """
+        return the uri on the mirror that answers the fastest, the
+        candidates are the country mirror and the main server
+        """
+        default_uri = uri_template.safe_substitute(countrymirror='')
+        if (default_uri == uri_template.template or
+                not default_uri.startswith(self.DEFAULT_MIRROR)):
+            return ""
+        candidates = ["http://%sarchive.ubuntu.com/ubuntu" % country_mirror(),
+                      self.DEFAULT_MIRROR]
+        ranking = MirrorRanking(self.new_dist.name, self.MIRROR_RANKING_CACHE)
+        for mirror in ranking.rank(candidates):
+            new_uri = mirror + default_uri[len(self.DEFAULT_MIRROR):]
+            if url_downloadable(new_uri, self._debug):
+                return new_uri
+        self._debug("no ranked mirror found")
+        return ""
+
+    def _prepareTmpdir(self):
+        if self.tmpdir is not None:
+            return
         tmpdir = tempfile.mkdtemp(prefix="ubuntu-release-upgrader-")
         self.tmpdir = tmpdir
         os.chdir(tmpdir)
@@ -216,20 +427,71 @@ class DistUpgradeFetcherCore(object):
         if self.DEBUG > 0:
             apt_pkg.config.set("Debug::Acquire::http", "1")
             apt_pkg.config.set("Debug::Acquire::ftp", "1")
-        #os.listdir(tmpdir)
-        fetcher = apt_pkg.Acquire(self._progress)
+
+    def _fetchFromCache(self):
+        """ copy the tarball and signature from the cache into the
+            tmpdir if they did not change on the server
+        """
+        if (getattr(self, "tarball_cache", None) is None or
+                self.new_dist.upgradeTool is None or
+                self.new_dist.upgradeToolSig is None):
+            return False
+        # newer meta-release files have the hash of the tarball
+        sha256 = getattr(self.new_dist, "upgradeToolSHA256", None)
+        uri = self.new_dist.upgradeTool
+        if not sha256:
+            uri = self.uri = self._expandUri(uri)
+        (found, self._cache_validators) = self.tarball_cache.lookup(
+            uri, sha256)
+        if found is None:
+            return False
+        try:
+            self.tarball_cache.copy_to(
+                found,
+                os.path.join(self.tmpdir,
+                             os.path.basename(self.new_dist.upgradeTool)),
+                os.path.join(self.tmpdir,
+                             os.path.basename(self.new_dist.upgradeToolSig)))
+        except (IOError, OSError) as e:
+            logging.warning("can not use the cached tarball: %s", e)
+            return False
+        logging.info("using cached upgrader tarball %s", found)
+        self.uri = uri
+        self._cached_sha256 = found
+        return True
+
+    def _storeInCache(self):
+        " keep the authenticated tarball for the next run "
+        if (getattr(self, "tarball_cache", None) is None or
+                self._cached_sha256 is not None or not self.uri):
+            return
+        self.tarball_cache.add(
+            self.uri,
+            os.path.join(self.tmpdir, os.path.basename(self.uri)),
+            os.path.join(self.tmpdir,
+                         os.path.basename(self.new_dist.upgradeToolSig)),
+            self._cache_validators)
+
+    def _fetch(self, progress):
+        " download the tarball and its signature into the tmpdir "
+        if self._fetchFromCache():
+            return True
+        fetcher = apt_pkg.Acquire(progress)
         if self.new_dist.upgradeToolSig is not None:
             uri = self._expandUri(self.new_dist.upgradeToolSig)
             af1 = apt_pkg.AcquireFile(fetcher,
                                       uri,
-                                      descr=_("Upgrade tool signature"))
+                                      descr=_("Upgrade tool signature"),
+                                      destdir=self.tmpdir)
             # reference it here to shut pyflakes up
             af1
         if self.new_dist.upgradeTool is not None:
-            self.uri = self._expandUri(self.new_dist.upgradeTool)
+            if not self.uri:
+                self.uri = self._expandUri(self.new_dist.upgradeTool)
             af2 = apt_pkg.AcquireFile(fetcher,
                                       self.uri,
-                                      descr=_("Upgrade tool"))
+                                      descr=_("Upgrade tool"),
+                                      destdir=self.tmpdir)
             # reference it here to shut pyflakes up
             af2
             result = fetcher.run()
@@ -239,12 +501,59 @@ class DistUpgradeFetcherCore(object):
             # check that both files are really there and non-null
             for f in [os.path.basename(self.new_dist.upgradeToolSig),
                       os.path.basename(self.new_dist.upgradeTool)]:
+                f = os.path.join(self.tmpdir, f)
                 if not (os.path.exists(f) and os.path.getsize(f) > 0):
                     logging.warning("file '%s' missing" % f)
                     return False
             return True
         return False
 
+    def _runPrefetch(self, progress):
+        try:
+            self._prefetch_result = self._fetch(progress)
+        except Exception:
+            logging.exception("background download failed")
+            self._prefetch_result = False
+
+    def startFetchDistUpgrader(self):
+        """ start downloading the tarball in the background, e.g.
+            while the release notes are shown
+        """
+        self._prepareTmpdir()
+        progress = BackgroundAcquireProgress(self._progress)
+        thread = threading.Thread(target=self._runPrefetch,
+                                  args=(progress,), daemon=True)
+        self._prefetch = (thread, progress)
+        thread.start()
+
+    def cancelFetchDistUpgrader(self):
+        " stop the background download and throw away what it got "
+        if self._prefetch is None:
+            return
+        (thread, progress) = self._prefetch
+        self._prefetch = None
+        progress.cancel()
+        thread.join()
+        self.cleanup()
+
+    def fetchDistUpgrader(self):
+        " download the tarball with the upgrade script "
+        if self._prefetch is not None:
+            (thread, progress) = self._prefetch
+            self._prefetch = None
+            if thread.is_alive() and not self.BACKGROUND_PROGRESS_IN_THREAD:
+                # start over in the foreground with the real progress
+                progress.cancel()
+                thread.join()
+            else:
+                progress.attach()
+                thread.join()
+                if self._prefetch_result:
+                    return True
+                logging.debug("background download failed, retrying")
+        self._prepareTmpdir()
+        return self._fetch(self._progress)
+
     def runDistUpgrader(self):
         args = [self.script] + self.run_options
         if os.getuid() != 0:
@@ -257,10 +566,14 @@ class DistUpgradeFetcherCore(object):
         os.chdir("..")
         # del tmpdir
         shutil.rmtree(self.tmpdir)
+        self.tmpdir = None
 
     def run(self):
+        # download while the user reads the release notes
+        self.startFetchDistUpgrader()
         # see if we have release notes
         if not self.showReleaseNotes():
+            self.cancelFetchDistUpgrader()
             return
         if not self.fetchDistUpgrader():
             self.error(_("Failed to fetch"),
@@ -273,6 +586,7 @@ class DistUpgradeFetcherCore(object):
                          "problem with the network or with the server. "))
             self.cleanup()
             return
+        self._storeInCache()
         if not self.extractDistUpgrader():
             self.error(_("Failed to extract"),
                        _("Extracting the upgrade failed. There may be a "
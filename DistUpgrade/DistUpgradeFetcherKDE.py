@@ -112,6 +112,8 @@ def _icon(name):
 
 
 class DistUpgradeFetcherKDE(DistUpgradeFetcherCore):
+    # the progress belongs to the main loop of the view
+    BACKGROUND_PROGRESS_IN_THREAD = False
 
     def __init__(self, new_dist, progress, parent, datadir):
         DistUpgradeFetcherCore.__init__(self, new_dist, progress)
@@ -26,6 +26,9 @@ from .DistUpgradeFetcherCore import DistUpgradeFetcherCore
 
 
 class DistUpgradeFetcherSelf(DistUpgradeFetcherCore):
+    # the progress belongs to the view
+    BACKGROUND_PROGRESS_IN_THREAD = False
+
     def __init__(self, new_dist, progress, options, view):
         DistUpgradeFetcherCore.__init__(self, new_dist, progress)
         self.view = view
@@ -0,0 +1,195 @@
+# DistUpgradeHookQueue.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+Coalescing of expensive hooks that packages run during the install.
+
+The tools in COALESCED_HOOKS are linked to imported/coalesce-hook,
+which is first in PATH during the upgrade. While the queue is enabled
+the wrapper only records the invocations, replay() runs every distinct
+invocation once when the install is done.
+
+Service restarts are queued the same way by imported/invoke-rc.d and
+run in parallel after every commit.
+"""
+
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# in the order a kernel install runs them
+COALESCED_HOOKS = ("update-initramfs",
+                   "update-grub",
+                   "fc-cache",
+                   "gtk-update-icon-cache",
+                   "update-desktop-database")
+
+QUEUE_ENV = "RELEASE_UPGRADE_HOOK_QUEUE"
+
+
+class HookQueue(object):
+    """ the invocations recorded by imported/coalesce-hook """
+
+    def __init__(self, path):
+        self.path = path
+
+    def enable(self):
+        """ start recording the hooks instead of running them """
+        with open(self.path, "a"):
+            pass
+        os.environ[QUEUE_ENV] = self.path
+        logging.info("deferring %s until the end of the install",
+                     ", ".join(COALESCED_HOOKS))
+
+    def disable(self):
+        """ run the hooks right away again, the queue is kept """
+        os.environ.pop(QUEUE_ENV, None)
+
+    def pending(self):
+        """ the distinct invocations as (argv, times called), ordered
+            by their last call
+        """
+        calls = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    argv = tuple(line.rstrip("\n").split("\t"))
+                    if argv[0] not in COALESCED_HOOKS:
+                        continue
+                    # move to the end
+                    calls[argv] = calls.pop(argv, 0) + 1
+        except IOError:
+            return []
+        return list(calls.items())
+
+    def replay(self, call=subprocess.call):
+        """ run each recorded invocation once and empty the queue,
+            returns the (argv, result) of the ones that failed
+        """
+        self.disable()
+        failed = []
+        for (argv, count) in self.pending():
+            start = time.time()
+            try:
+                res = call(list(argv))
+            except OSError as e:
+                res = e
+            logging.info("ran '%s' (called %s times during the install), "
+                         "returned %s, took %.1fs", " ".join(argv), count,
+                         res, time.time() - start)
+            if res != 0:
+                logging.error("'%s' failed: %s", " ".join(argv), res)
+                failed.append((argv, res))
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        return failed
+
+
+RESTART_QUEUE_ENV = "RELEASE_UPGRADE_RESTART_QUEUE"
+# systemctl restart waits for the unit, a few at a time is enough
+RESTART_JOBS = 4
+
+
+def _restart(action, unit):
+    start = time.time()
+    try:
+        proc = subprocess.run(["systemctl", action, unit],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT,
+                              universal_newlines=True)
+    except OSError as e:
+        logging.error("systemctl %s %s failed: %s", action, unit, e)
+        return
+    if proc.returncode != 0:
+        logging.error("systemctl %s %s returned %s: %s", action, unit,
+                      proc.returncode, proc.stdout.strip())
+    else:
+        logging.debug("systemctl %s %s took %.1fs", action, unit,
+                      time.time() - start)
+
+
+class RestartQueue(object):
+    """ the service restarts queued by imported/invoke-rc.d """
+
+    def __init__(self, path, jobs=RESTART_JOBS):
+        self.path = path
+        self.jobs = jobs
+
+    @classmethod
+    def from_environ(cls, jobs=RESTART_JOBS):
+        """ the queue invoke-rc.d uses now, None if there is none """
+        path = os.environ.get(RESTART_QUEUE_ENV)
+        return cls(path, jobs) if path else None
+
+    def enable(self):
+        """ start queueing restart and try-restart """
+        try:
+            with open(self.path, "a"):
+                pass
+        except (IOError, OSError) as e:
+            logging.warning("can not queue service restarts: %s", e)
+            return
+        os.environ[RESTART_QUEUE_ENV] = self.path
+
+    def disable(self):
+        """ restart right away again, the queue is kept """
+        os.environ.pop(RESTART_QUEUE_ENV, None)
+
+    def pending(self):
+        """ (action, unit) in the order the units were first queued,
+            restart wins over try-restart
+        """
+        units = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    fields = line.split()
+                    if (len(fields) != 2 or
+                            fields[0] not in ("restart", "try-restart")):
+                        continue
+                    (action, unit) = fields
+                    if units.get(unit) != "restart":
+                        units[unit] = action
+        except IOError:
+            return []
+        return [(action, unit) for (unit, action) in units.items()]
+
+    def flush(self, restart=_restart):
+        """ run the queued restarts, self.jobs at a time """
+        # restarts queued from now on go into the next flush
+        tmp = "%s.%s" % (self.path, os.getpid())
+        try:
+            os.rename(self.path, tmp)
+        except OSError:
+            return
+        pending = RestartQueue(tmp).pending()
+        if pending:
+            logging.info("restarting %s services", len(pending))
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                for (action, unit) in pending:
+                    executor.submit(restart, action, unit)
+            logging.info("restarting services took %.1fs",
+                         time.time() - start)
+        os.unlink(tmp)
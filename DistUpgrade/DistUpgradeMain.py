@@ -19,15 +19,18 @@
 #  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
 #  USA
 
-import apt
+import apt_pkg
 import atexit
 import gettext
 import glob
 import logging
+import logging.handlers
 import os
+import queue
 import shutil
 import subprocess
 import sys
+import tempfile
 
 from datetime import datetime
 from optparse import OptionParser
@@ -47,8 +50,12 @@ SYSTEM_DIRS = ["/bin",
               "/var",
               ]
 
+# views that need a display, they are not even imported without one
+GUI_VIEWS = ("DistUpgradeViewGtk3", "DistUpgradeViewKDE")
 
-from .DistUpgradeConfigParser import DistUpgradeConfig
+
+from .DistUpgradeConfigParser import get_config
+from .DistUpgradeSystemFacts import get_system_facts
 
 
 def do_commandline():
@@ -74,8 +81,129 @@ def do_commandline():
     parser.add_option("--devel-release", action="store_true",
                       dest="devel_release", default=False,
                       help=_("Upgrade to the development release"))
+    parser.add_option("--export-plan", dest="export_plan", default=None,
+                      help=_("Write the calculated upgrade plan to the "
+                             "given directory"))
+    parser.add_option("--import-plan", dest="import_plan", default=None,
+                      help=_("Use an upgrade plan from the given directory "
+                             "or file URL if it matches this system"))
+    parser.add_option("--plan-only", dest="plan_only", default=None,
+                      metavar="REPORT",
+                      help=_("Only calculate what the upgrade would do and "
+                             "write a JSON report to REPORT ('-' for stdout), "
+                             "the system is not changed"))
     return parser.parse_args()
 
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+
+
+class LogWriterFileHandler(logging.FileHandler):
+    """
+    File handler used by the log writer thread, it only flushes
+    once all the queued records are written
+    """
+    def __init__(self, filename, log_queue, mode="a"):
+        logging.FileHandler.__init__(self, filename, mode)
+        self.log_queue = log_queue
+
+    def flush(self):
+        if self.log_queue.empty():
+            logging.FileHandler.flush(self)
+
+
+class LogWriterQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand the records over to the log writer thread, closing it (e.g.
+    via logging.shutdown() before an exec) writes out all records
+    that are still queued
+    """
+    def __init__(self, log_queue, listener, filename):
+        logging.handlers.QueueHandler.__init__(self, log_queue)
+        self.listener = listener
+        self.filename = filename
+        self.listener.start()
+        self.running = True
+
+    def flush(self):
+        """ wait until the writer thread wrote all queued records """
+        if self.running:
+            self.queue.join()
+            for handler in self.listener.handlers:
+                logging.FileHandler.flush(handler)
+
+    def close(self):
+        if self.running:
+            self.running = False
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+        logging.handlers.QueueHandler.close(self)
+
+
+def _log_directly_in_child():
+    """
+    There is no writer thread in a forked child (e.g. the one that
+    runs dpkg), so write to the log file from there directly
+    """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, LogWriterQueueHandler):
+            root.removeHandler(handler)
+            # the writer thread of the parent is not there to wait for
+            handler.running = False
+            file_handler = logging.FileHandler(handler.filename)
+            file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            root.addHandler(file_handler)
+
+
+os.register_at_fork(after_in_child=_log_directly_in_child)
+
+
+def setup_log_writer(fname):
+    """ log to fname from a separate writer thread """
+    log_queue = queue.Queue()
+    # start with an empty log but append, forked children write to
+    # the same file
+    with open(fname, "w"):
+        pass
+    file_handler = LogWriterFileHandler(fname, log_queue, mode="a")
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    queue_handler = LogWriterQueueHandler(
+        log_queue, logging.handlers.QueueListener(log_queue, file_handler),
+        fname)
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    root.addHandler(queue_handler)
+    return queue_handler
+
+
+def installed_version(pkgname, status_file=None):
+    """ the installed version of pkgname from the dpkg status
+
+    this is a lot cheaper than building an apt cache just to look
+    at a single package
+    """
+    if status_file is None:
+        status_file = apt_pkg.config.find_file("Dir::State::status",
+                                               "/var/lib/dpkg/status")
+    try:
+        with open(status_file) as f:
+            for section in apt_pkg.TagFile(f):
+                if (section.get("Package") == pkgname and
+                        section.get("Status", "").endswith(" installed")):
+                    return section.get("Version")
+    except (IOError, OSError) as e:
+        logging.debug("can not read '%s': %s", status_file, e)
+    return None
+
+
+def is_headless(environ=None):
+    """ True if there is no display a graphical view could use """
+    if environ is None:
+        environ = os.environ
+    return not (environ.get("DISPLAY") or environ.get("WAYLAND_DISPLAY"))
+
+
 def setup_logging(options, config):
     " setup the logging "
     logdir = config.getWithDefault("Files","LogDir","/var/log/dist-upgrade/")
@@ -95,16 +223,12 @@ def setup_logging(options, config):
         fname += ".partial"
     with open(fname, "a"):
         pass
-    logging.basicConfig(level=logging.DEBUG,
-                        filename=fname,
-                        format='%(asctime)s %(levelname)s %(message)s',
-                        filemode='w')
+    setup_log_writer(fname)
     # log what config files are in use here to detect user
     # changes
     logging.info("Using config files '%s'" % config.config_files)
     logging.info("uname information: '%s'" % " ".join(os.uname()))
-    cache = apt.apt_pkg.Cache(None)
-    apt_version = cache['apt'].current_ver.ver_str
+    apt_version = installed_version("apt")
     logging.info("apt version: '%s'" % apt_version)
     logging.info("python version: '%s'" % sys.version)
     return logdir
@@ -126,22 +250,28 @@ def save_system_state(logdir):
         scrub_sources=True)
     # reset umask
     os.umask(old_umask)
-    # lspci output
+    # pci devices in the format of lspci -n
     try:
-        s=subprocess.Popen(["lspci","-nn"], stdout=subprocess.PIPE,
-                           universal_newlines=True).communicate()[0]
         with open(os.path.join(logdir, "lspci.txt"), "w") as f:
-            f.write(s)
+            for (slot, klass, ids) in get_system_facts().pci_devices:
+                f.write("%s %s: %s\n" % (slot, klass, ids))
     except OSError as e:
-        logging.debug("lspci failed: %s" % e)
+        logging.debug("writing lspci.txt failed: %s", e)
     
 def setup_view(options, config, logdir):
     " setup view based on the config and commandline "
 
+    headless = is_headless()
     # the commandline overwrites the configfile
     for requested_view in [options.frontend]+config.getlist("View","View"):
         if not requested_view:
             continue
+        # importing the toolkits is slow and bound to fail without a
+        # display, unless asked for explicitly skip right to the next
+        if (headless and requested_view in GUI_VIEWS and
+                requested_view != options.frontend):
+            logging.info("no display, not trying view '%s'", requested_view)
+            continue
         try:
             # this should work with py3 and py2.7
             from importlib import import_module
@@ -179,6 +309,7 @@ def run_new_gnu_screen_window_or_reattach():
     # check if a release upgrade is among them
     if SCREENNAME in out:
         logging.info("found active screen session, re-attaching")
+        logging.shutdown()
         # if we have it, attach to it
         os.execv("/usr/bin/screen",  ["screen", "-d", "-r", "-p", SCREENNAME])
     # otherwise re-exec inside screen with (-L) for logging enabled
@@ -191,6 +322,7 @@ def run_new_gnu_screen_window_or_reattach():
            "-c", "screenrc",
            "-S", SCREENNAME]+sys.argv
     logging.info("re-exec inside screen: '%s'" % cmd)
+    logging.shutdown()
     os.execv("/usr/bin/screen", cmd)
 
 
@@ -199,7 +331,18 @@ def main():
 
     # commandline setup and config
     (options, args) = do_commandline()
-    config = DistUpgradeConfig(options.datadir)
+    config = get_config(options.datadir)
+    report_stdout = None
+    if options.plan_only:
+        # the logs of the last upgrade are left alone as well, the logs
+        # of the plan are removed when it is done
+        plan_logdir = tempfile.mkdtemp(prefix="release-upgrade-plan-")
+        atexit.register(shutil.rmtree, plan_logdir, True)
+        config.set("Files", "LogDir", plan_logdir)
+        if options.plan_only == "-":
+            # the views print their progress to stdout
+            from .DistUpgradePlanOnly import redirect_stdout
+            report_stdout = redirect_stdout()
     logdir = setup_logging(options, config)
 
     from .DistUpgradeVersion import VERSION
@@ -216,11 +359,20 @@ def main():
     # gnu screen support
     if (view.needs_screen and
         not "RELEASE_UPGRADER_NO_SCREEN" in os.environ and
-        not options.disable_gnu_screen):
+        not options.disable_gnu_screen and
+        not options.plan_only):
         run_new_gnu_screen_window_or_reattach()
 
     from .DistUpgradeController import DistUpgradeController
-    app = DistUpgradeController(view, options, datadir=options.datadir)
+    app = DistUpgradeController(view, options, datadir=options.datadir,
+                               config=config)
+
+    # report what the upgrade would do
+    if options.plan_only:
+        if not app.doPlanOnly(options.plan_only, report_stdout):
+            sys.exit(1)
+        sys.exit(0)
+
     atexit.register(app._enableAptCronJob)
 
     # partial upgrade only
@@ -230,7 +382,10 @@ def main():
         sys.exit(0)
 
     # save system state (only if not doing just a partial upgrade)
-    save_system_state(logdir)
+    if app.low_memory:
+        logging.info("not saving the system state in low memory mode")
+    else:
+        save_system_state(logdir)
 
     # full upgrade, return error code for success/failure
     if app.run():
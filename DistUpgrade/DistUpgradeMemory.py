@@ -0,0 +1,131 @@
+# DistUpgradeMemory.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+Memory use of the upgrader.
+
+The peak resident set size of every step of the upgrade is logged, and
+on small machines (512 MB VMs, ARM boards) the upgrader runs in a low
+memory mode that gives back what it does not need before dpkg runs.
+"""
+
+import gc
+import logging
+import time
+
+
+# below this much RAM (in MB) the low memory mode is used by default
+LOW_MEMORY_THRESHOLD = 1024
+
+
+def read_rss(status="/proc/self/status"):
+    """ return (current, peak) resident set size in bytes, (0, 0) if
+        it is not known
+    """
+    rss = {}
+    try:
+        with open(status) as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    (key, value) = line.split(":", 1)
+                    rss[key] = int(value.split()[0]) * 1024
+    except (IOError, OSError, ValueError) as e:
+        logging.debug("can not read '%s': %s", status, e)
+    return (rss.get("VmRSS", 0), rss.get("VmHWM", 0))
+
+
+def reset_peak_rss():
+    """ start a new peak (VmHWM), linux >= 4.0 """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except (IOError, OSError) as e:
+        logging.debug("can not reset the peak rss: %s", e)
+
+
+def release_heap():
+    """ collect the garbage and hand the free heap back to the kernel """
+    gc.collect()
+    # not imported before it is needed, the views import this module
+    import ctypes
+    try:
+        ctypes.CDLL(None).malloc_trim(0)
+    except (OSError, AttributeError):
+        # not glibc
+        pass
+
+
+def is_low_memory(config, facts):
+    """ True if the upgrade should run in low memory mode
+
+    [Distro] LowMemory is yes, no or auto (the default), auto turns
+    it on if the machine has less than LowMemoryThreshold MB of RAM.
+    """
+    mode = config.getWithDefault("Distro", "LowMemory", "auto").lower()
+    if mode in ("yes", "true", "1", "on"):
+        return True
+    if mode != "auto":
+        return False
+    threshold = config.getWithDefault("Distro", "LowMemoryThreshold",
+                                      LOW_MEMORY_THRESHOLD)
+    return 0 < facts.mem_total < threshold * 1024 * 1024
+
+
+class MemoryReport(object):
+    """ log the peak rss of every step of the upgrade """
+
+    def __init__(self, status="/proc/self/status"):
+        self.status = status
+        self.peaks = {}
+        self._phase = None
+        self._start = None
+
+    def phase(self, name):
+        """ the previous phase ended, name starts """
+        self._finish()
+        self._phase = name
+        self._start = time.time()
+        reset_peak_rss()
+
+    def _finish(self):
+        if self._phase is None:
+            return
+        (rss, peak) = read_rss(self.status)
+        self.peaks[self._phase] = max(peak, self.peaks.get(self._phase, 0))
+        logging.info("peak rss in %s: %.1f MB (now %.1f MB, %.0fs)",
+                     self._phase, peak / 1024.0 / 1024, rss / 1024.0 / 1024,
+                     time.time() - self._start)
+
+    def done(self):
+        """ the last phase ended """
+        self._finish()
+        self._phase = None
+        if self.peaks:
+            logging.info("peak rss of the upgrade: %.1f MB",
+                         max(self.peaks.values()) / 1024.0 / 1024)
+
+
+_report = None
+
+
+def get_memory_report():
+    global _report
+    if _report is None:
+        _report = MemoryReport()
+    return _report
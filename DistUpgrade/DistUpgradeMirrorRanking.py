@@ -0,0 +1,197 @@
+# DistUpgradeMirrorRanking.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+Pick the archive mirror to use by measuring it instead of guessing it
+from the locale.
+
+A short list of candidate mirrors is probed in parallel: the connection
+is timed and the start of the Release file of the dist is downloaded.
+The mirrors are ranked by the estimated time to download a reference
+amount of data, which accounts for both latency and throughput. The
+measurements are kept in a small JSON cache for a while, so the fetcher
+and the upgrader do not probe the same mirrors again.
+"""
+
+import http.client
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+DEFAULT_MIRROR = "http://archive.ubuntu.com/ubuntu"
+# how much of the Release file is downloaded by a probe
+PROBE_BYTES = 64 * 1024
+# the download the mirrors are compared by
+REFERENCE_BYTES = 1024 * 1024
+PROBE_TIMEOUT = 3
+# in seconds
+DEFAULT_TTL = 24 * 60 * 60
+CACHE_FORMAT = 1
+# next to the tarball cache, which sweeps its own directory
+CACHE_PATH = "/var/cache/ubuntu-release-upgrader/mirrors/mirror-ranking.json"
+
+
+def mirror_shortlist(mirrors, country="", limit=8):
+    """ the mirrors worth probing: the country archive, the main
+        archive and the http mirrors of mirrors.cfg in the top level
+        domain of the country
+    """
+    country = country.rstrip(".")
+    shortlist = []
+    if country:
+        shortlist.append("http://%s.archive.ubuntu.com/ubuntu" % country)
+    shortlist.append(DEFAULT_MIRROR)
+    for mirror in mirrors:
+        if not country or len(shortlist) >= limit:
+            break
+        parts = urlsplit(mirror)
+        if (parts.scheme in ("http", "https") and parts.hostname and
+                parts.hostname.endswith("." + country)):
+            mirror = mirror.rstrip("/")
+            if mirror not in shortlist:
+                shortlist.append(mirror)
+    return shortlist[:limit]
+
+
+def probe_mirror(mirror, dist, timeout=PROBE_TIMEOUT):
+    """ the estimated time in seconds to download REFERENCE_BYTES from
+        the mirror, None if it does not serve the dist
+    """
+    parts = urlsplit(mirror)
+    if parts.scheme == "https":
+        conn = http.client.HTTPSConnection(parts.hostname, parts.port,
+                                           timeout=timeout)
+    elif parts.scheme == "http":
+        conn = http.client.HTTPConnection(parts.hostname, parts.port,
+                                          timeout=timeout)
+    else:
+        return None
+    path = "%s/dists/%s/Release" % (parts.path.rstrip("/"), dist)
+    try:
+        start = time.monotonic()
+        conn.connect()
+        connected = time.monotonic()
+        conn.request("GET", path,
+                     headers={"Range": "bytes=0-%d" % (PROBE_BYTES - 1)})
+        res = conn.getresponse()
+        first_byte = time.monotonic()
+        if res.status not in (200, 206):
+            logging.debug("mirror probe of '%s': %s %s", mirror,
+                          res.status, res.reason)
+            return None
+        # servers that ignore the range send the whole file
+        size = len(res.read(PROBE_BYTES))
+        done = time.monotonic()
+    except (OSError, http.client.HTTPException) as e:
+        logging.debug("mirror probe of '%s' failed: %s", mirror, e)
+        return None
+    finally:
+        conn.close()
+    latency = first_byte - start
+    throughput = size / max(done - first_byte, 1e-6)
+    score = latency + REFERENCE_BYTES / max(throughput, 1)
+    logging.debug("mirror probe of '%s': connect %.3fs, first byte %.3fs, "
+                  "%.0f bytes/s, score %.3f", mirror, connected - start,
+                  latency, throughput, score)
+    return score
+
+
+class MirrorRanking(object):
+    """ ranks mirrors by probing them, the measurements are cached
+        in cache_path for ttl seconds
+    """
+
+    def __init__(self, dist, cache_path=None, ttl=DEFAULT_TTL,
+                 timeout=PROBE_TIMEOUT, jobs=None):
+        self.dist = dist
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.jobs = jobs
+
+    def _load(self):
+        if not self.cache_path:
+            return {}
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if (not isinstance(cache, dict) or
+                cache.get("format") != CACHE_FORMAT):
+            return {}
+        return cache.get("mirrors", {})
+
+    def _save(self, scores):
+        if not self.cache_path:
+            return
+        cache = {"format": CACHE_FORMAT, "mirrors": scores}
+        try:
+            directory = os.path.dirname(os.path.abspath(self.cache_path))
+            os.makedirs(directory, exist_ok=True)
+            (fd, tmp) = tempfile.mkstemp(dir=directory,
+                                         prefix=".mirror-ranking-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(cache, f, indent=1, sort_keys=True)
+            os.rename(tmp, self.cache_path)
+        except OSError as e:
+            logging.debug("failed to write the mirror ranking to '%s': %s",
+                          self.cache_path, e)
+
+    def _fresh(self, entry, now):
+        return (isinstance(entry, dict) and
+                entry.get("dist") == self.dist and
+                0 <= now - entry.get("time", 0) < self.ttl)
+
+    def rank(self, mirrors):
+        """ the mirrors that serve the dist, the fastest first """
+        mirrors = list(dict.fromkeys(m.rstrip("/") for m in mirrors))
+        now = time.time()
+        scores = self._load()
+        stale = [m for m in mirrors if not self._fresh(scores.get(m), now)]
+        if stale:
+            # keep the cache from growing forever
+            scores = dict((m, e) for (m, e) in scores.items()
+                          if self._fresh(e, now))
+            with ThreadPoolExecutor(
+                    max_workers=self.jobs or len(stale)) as executor:
+                results = list(executor.map(
+                    lambda m: probe_mirror(m, self.dist, self.timeout),
+                    stale))
+            for (mirror, score) in zip(stale, results):
+                scores[mirror] = {"dist": self.dist, "time": now,
+                                  "score": score}
+            self._save(scores)
+        ranked = sorted((scores[m]["score"], i, m)
+                        for (i, m) in enumerate(mirrors)
+                        if scores[m]["score"] is not None)
+        logging.info("mirrors by speed: %s", [m for (s, i, m) in ranked])
+        return [m for (s, i, m) in ranked]
+
+    def best(self, mirrors):
+        """ the fastest of the mirrors, None if none works """
+        ranked = self.rank(mirrors)
+        if ranked:
+            return ranked[0]
+        return None
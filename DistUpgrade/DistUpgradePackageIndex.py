@@ -0,0 +1,65 @@
+# DistUpgradePackageIndex.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+Lookup of packages by name prefix.
+
+The quirks that look for kernels or ROS only care about a handful of
+names, walking the whole cache (and creating a Package object for each
+of the tens of thousands of entries) to find them is slow. The sorted
+list of names is bisected instead, only the matching packages are
+looked up.
+"""
+
+from bisect import bisect_left
+
+
+class PackageNameIndex(object):
+    """ the package names of a cache, sorted for prefix queries """
+
+    def __init__(self, cache):
+        if hasattr(cache, "keys"):
+            # apt.Cache.keys() is sorted already
+            self._names = sorted(cache.keys())
+            self._lookup = cache.__getitem__
+        else:
+            # any iterable of packages
+            by_name = dict((pkg.name, pkg) for pkg in cache)
+            self._names = sorted(by_name)
+            self._lookup = by_name.__getitem__
+
+    def names_with_prefix(self, prefix):
+        """ the names starting with prefix, in sorted order """
+        i = bisect_left(self._names, prefix)
+        while i < len(self._names) and self._names[i].startswith(prefix):
+            yield self._names[i]
+            i += 1
+
+    def with_prefix(self, prefix):
+        """ the packages whose name starts with prefix """
+        for name in self.names_with_prefix(prefix):
+            yield self._lookup(name)
+
+
+def get_name_index(cache):
+    """ the name index of cache, built once per open for a MyCache """
+    name_index = getattr(cache, "name_index", None)
+    if isinstance(name_index, PackageNameIndex):
+        return name_index
+    return PackageNameIndex(cache)
@@ -20,7 +20,10 @@
 #  USA
 
 import hashlib
+import os
 import re
+import tempfile
+from collections import namedtuple
 
 
 class PatchError(Exception):
@@ -28,83 +31,137 @@ class PatchError(Exception):
     pass
 
 
-def patch(orig, edpatch, result_md5sum=None):
-    """ python implementation of enough "ed" to apply ed-style
-        patches. Note that this patches in memory so its *not*
-        suitable for big files
-    """
+# a single ed command, start and end are 0-based and end is exclusive,
+# an append has start == end (the number of lines to keep before it)
+Hunk = namedtuple("Hunk", ["command", "start", "end", "lines"])
+
+
+def file_md5sum(path, blocksize=64 * 1024):
+    """ the md5sum of path, read in blocks """
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
 
+def _substitute(hunk, line):
+    """ apply a s/regexp/repl/ to the last line of the data of hunk """
+    if not hunk or not hunk.lines:
+        raise PatchError("s// is only supported after a or c: '%s'" % line)
+    # strip away the "s/" and chop off the flags at the end
+    subs, flags = line[2:].rsplit("/", 1)
+    if flags:
+        raise PatchError("flags for s// not supported yet")
+    regexp, sep, repl = subs.partition("/")
+    hunk.lines[-1] = re.sub(regexp, repl, hunk.lines[-1], count=1)
+
+
+def parse_edpatch(edpatch):
+    """ read the ed script edpatch and return its hunks in the order
+        of the file they apply to
+
+        Only scripts like the ones "diff -e" writes are supported: the
+        commands go from the end of the file to the start, so all
+        addresses refer to the unpatched file.
+    """
     # we only have two states, waiting for command or reading data
     (STATE_EXPECT_COMMAND,
      STATE_EXPECT_DATA) = range(2)
 
-    # this is inefficient for big files
-    with open(orig, encoding="UTF-8") as f:
-        orig_lines = f.readlines()
-    start = end = 0
-
-    # we start in wait-for-commend state
+    hunks = []
+    hunk = None
     state = STATE_EXPECT_COMMAND
-    with open(edpatch, encoding="UTF-8") as f:
-        lines = f.readlines()
-    for line in lines:
-        if state == STATE_EXPECT_COMMAND:
-            # in commands get rid of whitespace, 
+    with open(edpatch, encoding="UTF-8", newline="") as f:
+        for line in f:
+            if state == STATE_EXPECT_DATA:
+                # this is the data end marker
+                if line.rstrip("\r\n") == ".":
+                    state = STATE_EXPECT_COMMAND
+                else:
+                    hunk.lines.append(line)
+                continue
+            # in commands get rid of whitespace
             line = line.strip()
+            if not line:
+                continue
             # check if we have a substitute command
             if line.startswith("s/"):
-                # strip away the "s/"
-                line = line[2:]
-                # chop off the flags at the end 
-                subs, flags = line.rsplit("/", 1)
-                if flags:
-                    raise PatchError("flags for s// not supported yet")
-                # get the actual substitution regexp and replacement and 
-                # execute it
-                regexp, sep, repl = subs.partition("/")
-                new, count = re.subn(regexp, repl, orig_lines[start], count=1)
-                orig_lines[start] = new
+                _substitute(hunk, line)
                 continue
             # otherwise the last char is the command
             command = line[-1]
-            # read address
-            (start_str, sep, end_str) = line[:-1].partition(",")
-            # ed starts with 1 while python with 0
-            start = int(start_str)
-            start -= 1
-            # if we don't have end, set it to the next line
-            if end_str == "":
-                end = start + 1
-            else:
-                end = int(end_str)
-            # interpret command
-            if command == "c":
-                del orig_lines[start:end]
+            # "diff -e" continues after a "." line with a plain "a"
+            if line == "a" and hunk is not None and hunk.lines:
                 state = STATE_EXPECT_DATA
-                start -= 1
-            elif command == "a":
+                continue
+            (start_str, sep, end_str) = line[:-1].partition(",")
+            try:
+                # ed starts with 1 while python with 0
+                start = int(start_str) - 1
+                end = int(end_str) if end_str else start + 1
+            except ValueError:
+                raise PatchError("bad address: '%s'" % line)
+            if command == "a":
                 # not allowed to have a range in append
-                state = STATE_EXPECT_DATA
-            elif command == "d":
-                del orig_lines[start:end]
-            else:
+                if end_str:
+                    raise PatchError("a does not take a range: '%s'" % line)
+                start = end
+            elif command not in ("c", "d"):
                 raise PatchError("unknown command: '%s'" % line)
-        elif state == STATE_EXPECT_DATA:
-            # this is the data end marker
-            if line == ".\n":
-                state = STATE_EXPECT_COMMAND
-            else:
-                # copy line verbatim and increase position
-                start += 1
-                orig_lines.insert(start, line)
+            if start < 0 or end < start:
+                raise PatchError("bad address: '%s'" % line)
+            if hunks and end > hunks[-1].start:
+                raise PatchError("command '%s' overlaps or is not in "
+                                 "diff -e order" % line)
+            hunk = Hunk(command, start, end, [])
+            hunks.append(hunk)
+            if command in ("a", "c"):
+                state = STATE_EXPECT_DATA
+    if state == STATE_EXPECT_DATA:
+        raise PatchError("missing '.' at the end of the patch")
+    hunks.reverse()
+    return hunks
+
 
-    # done with the patching, (optional) verify and write result
-    result = "".join(orig_lines)
-    if result_md5sum:
-        md5 = hashlib.md5()
-        md5.update(result.encode("UTF-8"))
-        if md5.hexdigest() != result_md5sum:
+def patch(orig, edpatch, result_md5sum=None):
+    """ python implementation of enough "ed" to apply ed-style
+        patches. The patch is applied in a single pass over orig and
+        the result replaces it only if it has result_md5sum
+    """
+    hunks = parse_edpatch(edpatch)
+    md5 = hashlib.md5()
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(orig)),
+                                 prefix=".%s." % os.path.basename(orig))
+    try:
+        with open(orig, encoding="UTF-8", newline="") as src, \
+                os.fdopen(fd, "w", encoding="UTF-8", newline="") as dst:
+            def write(line):
+                md5.update(line.encode("UTF-8"))
+                dst.write(line)
+            lineno = 0
+            for hunk in hunks:
+                # copy up to the hunk and skip what it replaces
+                while lineno < hunk.end:
+                    line = src.readline()
+                    if not line:
+                        raise PatchError("line %s is past the end of '%s'"
+                                         % (hunk.end, orig))
+                    if lineno < hunk.start:
+                        write(line)
+                    lineno += 1
+                for line in hunk.lines:
+                    write(line)
+            for line in src:
+                write(line)
+        if result_md5sum and md5.hexdigest() != result_md5sum:
             raise PatchError("the md5sum after patching is not correct")
-    with open(orig, "w", encoding="UTF-8") as f:
-        f.write(result)
+        st = os.stat(orig)
+        os.chmod(tmp, st.st_mode & 0o7777)
+        if (st.st_uid, st.st_gid) != (os.getuid(), os.getgid()):
+            os.chown(tmp, st.st_uid, st.st_gid)
+        os.rename(tmp, orig)
+    except BaseException:
+        os.unlink(tmp)
+        raise
     return True
@@ -0,0 +1,262 @@
+# DistUpgradePlan.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+Reuse of upgrade plans between identical systems.
+
+A plan is the result of one resolver stage (e.g. the dist-upgrade
+calculation) stored together with a fingerprint of everything that
+went into it: the dpkg status, the sources, the downloaded Release
+files, the architectures, the upgrader configuration and the facts
+the quirks look at. A plan is only ever used when the fingerprint of
+the running system matches it exactly, everything else falls back to
+the normal calculation.
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from urllib.parse import urlsplit
+from urllib.request import url2pathname
+
+import apt_pkg
+
+
+PLAN_FORMAT = 1
+
+
+def _hash_file(h, path):
+    h.update(("\0file:%s\0" % path).encode("utf-8"))
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(64 * 1024), b""):
+                h.update(block)
+    except (IOError, OSError):
+        # a missing file is different from an empty one
+        h.update(b"\0missing\0")
+
+
+def fingerprint_files(datadir=None):
+    """ return the files whose content the resolver depends on """
+    files = [apt_pkg.config.find_file("Dir::State::status"),
+             apt_pkg.config.find_file("Dir::State::extended_states"),
+             apt_pkg.config.find_file("Dir::Etc::sourcelist")]
+    parts = apt_pkg.config.find_dir("Dir::Etc::sourceparts")
+    files.extend(sorted(glob.glob(os.path.join(parts, "*.list")) +
+                        glob.glob(os.path.join(parts, "*.sources"))))
+    # the Release files pin the content of all the indexes
+    lists = apt_pkg.config.find_dir("Dir::State::lists")
+    files.extend(sorted(glob.glob(os.path.join(lists, "*Release"))))
+    # the upgrader data files (removal blacklist, mirrors, demotions)
+    if datadir:
+        files.extend(sorted(glob.glob(os.path.join(datadir, "*.cfg"))))
+    return files
+
+
+def system_fingerprint(stage, config, facts):
+    """ calculate the fingerprint of the inputs of the given stage """
+    h = hashlib.sha256()
+    h.update(("format=%s\nstage=%s\n" % (PLAN_FORMAT, stage)).encode())
+    for path in fingerprint_files(getattr(config, "datadir", None)):
+        _hash_file(h, path)
+    for section in sorted(config.sections()):
+        # where plans are read from or written to does not matter
+        if section == "Plan":
+            continue
+        for (key, value) in sorted(config.items(section, raw=True)):
+            h.update(("[%s]%s=%s\n" % (section, key, value)).encode("utf-8"))
+    for key in ("APT::Architecture",
+                "APT::Install-Recommends",
+                "APT::Install-Suggests"):
+        h.update(("%s=%s\n" % (key, apt_pkg.config.find(key))).encode())
+    for arch in apt_pkg.config.value_list("APT::Architectures"):
+        h.update(("APT::Architectures=%s\n" % arch).encode())
+    for key in sorted(facts):
+        h.update(("fact:%s=%s\n" % (key, facts[key])).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _change_action(pkg):
+    if pkg.marked_delete:
+        return "delete"
+    elif pkg.marked_downgrade:
+        return "downgrade"
+    elif pkg.marked_reinstall:
+        return "reinstall"
+    elif pkg.marked_upgrade:
+        return "upgrade"
+    return "install"
+
+
+def changes_from_cache(cache):
+    """ return the marked changes of the cache in a serializable form """
+    purged = getattr(cache, "purge_marked", set())
+    changes = []
+    for pkg in sorted(cache.get_changes(), key=lambda p: p.name):
+        action = _change_action(pkg)
+        change = {"name": pkg.name, "action": action}
+        if action == "delete":
+            change["purge"] = pkg.name in purged
+        else:
+            change["version"] = pkg.candidate.version
+            change["auto"] = cache._depcache.is_auto_installed(pkg._pkg)
+        changes.append(change)
+    return changes
+
+
+class UpgradePlan(object):
+    """ the result of a resolver stage, keyed by the fingerprint of
+        its inputs
+    """
+
+    def __init__(self, stage, fingerprint, data=None):
+        self.stage = stage
+        self.fingerprint = fingerprint
+        self.data = data or {}
+        # set once the plan was successfully applied to a cache
+        self.applied = False
+
+    @classmethod
+    def from_cache(cls, stage, fingerprint, cache, **data):
+        data["changes"] = changes_from_cache(cache)
+        return cls(stage, fingerprint, data)
+
+    def apply(self, cache):
+        """ replace the marks of the cache with the changes of the plan,
+
+        returns False (with the cache cleared) if the result is not
+        exactly what the plan describes
+        """
+        changes = self.data.get("changes", [])
+        try:
+            with cache.actiongroup():
+                cache.clear()
+                for change in changes:
+                    if change["action"] == "delete":
+                        cache.mark_remove(change["name"], "upgrade plan",
+                                          auto_fix=False,
+                                          purge=change["purge"])
+                        if change["purge"]:
+                            cache.purge_marked.add(change["name"])
+                for change in changes:
+                    if change["action"] == "delete":
+                        continue
+                    pkg = cache[change["name"]]
+                    if (pkg.candidate is None or
+                            pkg.candidate.version != change["version"]):
+                        pkg.candidate = pkg.versions[change["version"]]
+                    if change["action"] == "reinstall":
+                        cache._depcache.set_reinstall(pkg._pkg, True)
+                    else:
+                        pkg.mark_install(auto_fix=False, auto_inst=False)
+                    cache._depcache.mark_auto(pkg._pkg, change["auto"])
+        except (KeyError, SystemError) as e:
+            logging.warning("applying the upgrade plan failed: %s", e)
+            cache.clear()
+            return False
+        if (cache._depcache.broken_count > 0 or
+                changes_from_cache(cache) != changes):
+            logging.warning("upgrade plan '%s' does not match the "
+                            "resulting changes, ignoring it",
+                            self.fingerprint)
+            cache.clear()
+            return False
+        self.applied = True
+        return True
+
+    def to_dict(self):
+        return {"format": PLAN_FORMAT,
+                "stage": self.stage,
+                "fingerprint": self.fingerprint,
+                "data": self.data}
+
+
+class UpgradePlanStore(object):
+    """ look up and store upgrade plans
+
+    export_dir is a local directory that plans are written to,
+    import_location is a local directory, a single plan file or a
+    file:// URL to either of them
+    """
+
+    def __init__(self, export_dir=None, import_location=None):
+        self.export_dir = export_dir
+        self.import_location = import_location
+        if import_location and import_location.startswith("file:"):
+            self.import_location = url2pathname(urlsplit(import_location).path)
+        elif import_location and "://" in import_location:
+            logging.warning("only local upgrade plans are supported, "
+                            "ignoring '%s'", import_location)
+            self.import_location = None
+
+    @property
+    def enabled(self):
+        return bool(self.export_dir or self.import_location)
+
+    @staticmethod
+    def filename(fingerprint):
+        return "%s.plan" % fingerprint
+
+    def lookup(self, stage, fingerprint):
+        """ return the plan matching the fingerprint or None """
+        if not self.import_location:
+            return None
+        path = self.import_location
+        if os.path.isdir(path):
+            path = os.path.join(path, self.filename(fingerprint))
+        if not os.path.exists(path):
+            logging.debug("no upgrade plan for %s (%s)", stage, fingerprint)
+            return None
+        try:
+            with open(path) as f:
+                content = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            logging.warning("can not read upgrade plan '%s': %s", path, e)
+            return None
+        if (not isinstance(content, dict) or
+                content.get("format") != PLAN_FORMAT or
+                content.get("stage") != stage or
+                content.get("fingerprint") != fingerprint):
+            logging.info("upgrade plan '%s' was built for a different "
+                         "system, ignoring it", path)
+            return None
+        logging.info("using upgrade plan '%s' for %s", path, stage)
+        return UpgradePlan(stage, fingerprint, content.get("data"))
+
+    def save(self, plan):
+        """ write the plan to the export directory (if any) """
+        if not self.export_dir:
+            return None
+        try:
+            os.makedirs(self.export_dir, exist_ok=True)
+            (fd, tmp) = tempfile.mkstemp(dir=self.export_dir,
+                                         prefix=".plan-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(plan.to_dict(), f, indent=1, sort_keys=True)
+            path = os.path.join(self.export_dir,
+                                self.filename(plan.fingerprint))
+            os.rename(tmp, path)
+        except (IOError, OSError) as e:
+            logging.warning("can not export upgrade plan: %s", e)
+            return None
+        logging.debug("exported %s plan to '%s'", plan.stage, path)
+        return path
@@ -0,0 +1,116 @@
+# DistUpgradePlanOnly.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+Support for --plan-only, which calculates what the upgrade would do
+without changing the system.
+
+The sources of the target release are written to and their indexes
+downloaded into a private apt root. The system package cache is never
+written and no lock is taken. The result is a JSON report.
+"""
+
+import glob
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import apt_pkg
+
+
+REPORT_FORMAT = 1
+
+
+class PrivateAptRoot(object):
+    """ a copy of the apt sources with their own (empty) lists
+        directory, enabled with enable()
+    """
+
+    def __init__(self, root=None):
+        self.root = root or tempfile.mkdtemp(prefix="release-upgrade-plan-")
+        self.sourcelist = os.path.join(self.root, "etc", "apt",
+                                       "sources.list")
+        self.sourceparts = os.path.join(self.root, "etc", "apt",
+                                        "sources.list.d")
+        self.lists = os.path.join(self.root, "var", "lib", "apt", "lists")
+        self._saved = {}
+
+    def _set(self, key, value):
+        if key not in self._saved:
+            self._saved[key] = apt_pkg.config.find(key)
+        apt_pkg.config.set(key, value)
+
+    def no_cache_files(self):
+        """ keep apt from writing the package cache of the system """
+        self._set("Dir::Cache::pkgcache", "")
+        self._set("Dir::Cache::srcpkgcache", "")
+
+    def enable(self):
+        """ copy the sources of the system and use the copies """
+        sourcelist = apt_pkg.config.find_file("Dir::Etc::sourcelist")
+        sourceparts = apt_pkg.config.find_dir("Dir::Etc::sourceparts")
+        os.makedirs(self.sourceparts, exist_ok=True)
+        os.makedirs(os.path.join(self.lists, "partial"), exist_ok=True)
+        if os.path.exists(sourcelist):
+            shutil.copy(sourcelist, self.sourcelist)
+        for path in (glob.glob(os.path.join(sourceparts, "*.list")) +
+                     glob.glob(os.path.join(sourceparts, "*.sources"))):
+            shutil.copy(path, self.sourceparts)
+        self.no_cache_files()
+        self._set("Dir::Etc::sourcelist", self.sourcelist)
+        self._set("Dir::Etc::sourceparts", self.sourceparts)
+        self._set("Dir::State::lists", self.lists + "/")
+        logging.debug("planning in the private apt root '%s'", self.root)
+
+    def cleanup(self):
+        """ go back to the apt configuration of the system """
+        for (key, value) in self._saved.items():
+            apt_pkg.config.set(key, value)
+        self._saved = {}
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def redirect_stdout():
+    """ send what the upgrader and its children write to stdout to
+        stderr, so that the report is the only thing on stdout; the
+        real stdout is returned
+    """
+    sys.stdout.flush()
+    stdout = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return stdout
+
+
+def write_report(report, path, stdout=None):
+    """ write the report to path, "-" is stdout (or the given stream) """
+    report = dict(report, format=REPORT_FORMAT)
+    if path == "-":
+        stdout = stdout or sys.stdout
+        json.dump(report, stdout, indent=1, sort_keys=True)
+        stdout.write("\n")
+        stdout.flush()
+        return
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                 prefix=".plan-report-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    os.rename(tmp, path)
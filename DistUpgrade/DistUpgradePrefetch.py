@@ -0,0 +1,175 @@
+# DistUpgradePrefetch.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+Prefetch of the index files of the target release.
+
+While the initial update refreshes the indexes of the current release,
+a separate apt-get update downloads the indexes of the official
+mirrors for the target release into a shadow lists directory. Once the
+sources.list was rewritten the prefetched files are moved into the
+real lists directory, so the second update only has to check that
+they are still current.
+"""
+
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+
+
+def target_entries(sources, from_dist, to_dist, pockets, is_mirror):
+    """ the sources.list lines of the official mirrors of sources
+        with from_dist replaced by to_dist
+    """
+    from_dists = [from_dist] + ["%s-%s" % (from_dist, p) for p in pockets]
+    to_dists = [to_dist] + ["%s-%s" % (to_dist, p) for p in pockets]
+    lines = []
+    for entry in sources:
+        if (entry.invalid or entry.disabled or
+                entry.type not in ("deb", "deb-src") or
+                entry.dist not in from_dists or
+                not is_mirror(entry.uri)):
+            continue
+        options = ""
+        if entry.architectures:
+            options = "[arch=%s] " % ",".join(entry.architectures)
+        line = "%s %s%s %s %s" % (
+            entry.type, options, entry.uri,
+            to_dists[from_dists.index(entry.dist)], " ".join(entry.comps))
+        if line not in lines:
+            lines.append(line)
+    return lines
+
+
+class IndexPrefetch(object):
+    """ download the indexes of the target release in the background
+
+    The shadow directory is created next to the lists directory, so
+    that the files can be renamed into place.
+    """
+
+    def __init__(self, lists_dir, lines, apt_get="apt-get"):
+        self.lists_dir = lists_dir.rstrip("/")
+        self.shadow = self.lists_dir + ".release-upgrade"
+        self.lines = lines
+        self.apt_get = apt_get
+        self.success = False
+        self._proc = None
+        self._thread = None
+
+    @property
+    def shadow_lists(self):
+        return os.path.join(self.shadow, "lists")
+
+    def _command(self):
+        sourcelist = os.path.join(self.shadow, "sources.list")
+        return [self.apt_get, "update", "-q",
+                "-o", "Dir::Etc::sourcelist=%s" % sourcelist,
+                "-o", "Dir::Etc::sourceparts=%s" % os.path.join(
+                    self.shadow, "sources.list.d"),
+                "-o", "Dir::State::lists=%s/" % self.shadow_lists,
+                # the package cache of the system is left alone
+                "-o", "Dir::Cache::pkgcache=",
+                "-o", "Dir::Cache::srcpkgcache="]
+
+    def start(self):
+        """ start downloading, False if there is nothing to prefetch """
+        if not self.lines:
+            return False
+        self.cleanup()
+        try:
+            os.makedirs(os.path.join(self.shadow_lists, "partial"))
+            os.makedirs(os.path.join(self.shadow, "sources.list.d"))
+            with open(os.path.join(self.shadow, "sources.list"), "w") as f:
+                f.write("\n".join(self.lines) + "\n")
+        except (IOError, OSError) as e:
+            logging.warning("can not prefetch the new indexes: %s", e)
+            return False
+        try:
+            self._proc = subprocess.Popen(self._command(),
+                                          stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT,
+                                          universal_newlines=True,
+                                          # cancel() stops the methods too
+                                          start_new_session=True)
+        except OSError as e:
+            logging.warning("prefetching the new indexes failed: %s", e)
+            return False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        start = time.time()
+        proc = self._proc
+        output = proc.communicate()[0]
+        logging.debug("prefetch output:\n%s", output)
+        self.success = proc.returncode == 0
+        logging.info("prefetching the new indexes returned %s, took %.1fs",
+                     proc.returncode, time.time() - start)
+
+    def wait(self):
+        """ wait for the download, True if it succeeded """
+        if self._thread is not None:
+            self._thread.join()
+        return self.success
+
+    def install(self):
+        """ move the prefetched files into the lists directory, returns
+            how many there were
+        """
+        moved = 0
+        if self._thread is None:
+            return moved
+        # a partial download still saves what it got, apt checks
+        # every file against the Release file again
+        self.wait()
+        try:
+            names = os.listdir(self.shadow_lists)
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(self.shadow_lists, name)
+            if name == "lock" or not os.path.isfile(path):
+                continue
+            try:
+                shutil.move(path, os.path.join(self.lists_dir, name))
+                moved += 1
+            except (IOError, OSError) as e:
+                logging.warning("can not move '%s': %s", path, e)
+        logging.info("%s prefetched index files", moved)
+        self.cleanup()
+        return moved
+
+    def cancel(self):
+        """ stop the download and remove what it got so far """
+        if self._proc is not None and self._proc.poll() is None:
+            try:
+                os.killpg(self._proc.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        self.wait()
+        self.cleanup()
+
+    def cleanup(self):
+        shutil.rmtree(self.shadow, ignore_errors=True)
@@ -26,13 +26,14 @@ import glob
 import logging
 import os
 import re
-import hashlib
 import subprocess
 from subprocess import PIPE, Popen
 
 from .utils import get_arch
 
 from .DistUpgradeGettext import gettext as _
+from .DistUpgradePackageIndex import get_name_index
+from .DistUpgradeSystemFacts import get_system_facts
 
 
 class DistUpgradeQuirks(object):
@@ -42,12 +43,12 @@ class DistUpgradeQuirks(object):
     releases have
     """
 
-    def __init__(self, controller, config):
+    def __init__(self, controller, config, facts=None):
         self.controller = controller
         self._view = controller._view
         self.config = config
-        self.uname = Popen(["uname", "-r"], stdout=PIPE,
-                           universal_newlines=True).communicate()[0].strip()
+        self.facts = facts or get_system_facts()
+        self.uname = self.facts.kernel_release
         self.arch = get_arch()
         self.extra_snap_space = 0
         self._poke = None
@@ -88,21 +89,21 @@ class DistUpgradeQuirks(object):
         funcname = "%s" % quirksName
         func = getattr(self, funcname, None)
         if func is not None:
-            logging.debug("quirks: running %s" % funcname)
+            logging.debug("quirks: running %s", funcname)
             func()
 
         # run the quirksHandler to-dist
         funcname = "%s%s" % (to_release, quirksName)
         func = getattr(self, funcname, None)
         if func is not None:
-            logging.debug("quirks: running %s" % funcname)
+            logging.debug("quirks: running %s", funcname)
             func()
 
         # now run the quirksHandler from_${FROM-DIST}Quirks
         funcname = "from_%s%s" % (from_release, quirksName)
         func = getattr(self, funcname, None)
         if func is not None:
-            logging.debug("quirks: running %s" % funcname)
+            logging.debug("quirks: running %s", funcname)
             func()
 
     # individual quirks handler that run *before* the cache is opened
@@ -147,6 +148,11 @@ class DistUpgradeQuirks(object):
                 self._replace_fkms_overlay()
 
     # individual quirks handler when the dpkg run is finished ---------
+    def PostUpgrade(self):
+        " run after the upgrade "
+        logging.debug("running Quirks.PostUpgrade")
+        self._replayCoalescedHooks()
+
     def PostCleanup(self):
         " run after cleanup "
         logging.debug("running Quirks.PostCleanup")
@@ -178,17 +184,8 @@ class DistUpgradeQuirks(object):
 
     # helpers
     def _get_pci_ids(self):
-        """ return a set of pci ids of the system (using lspci -n) """
-        lspci = set()
-        try:
-            p = subprocess.Popen(["lspci", "-n"], stdout=subprocess.PIPE,
-                                 universal_newlines=True)
-        except OSError:
-            return lspci
-        for line in p.communicate()[0].split("\n"):
-            if line:
-                lspci.add(line.split()[2])
-        return lspci
+        """ return a set of pci ids of the system (like lspci -n) """
+        return set(self.facts.pci_ids)
 
     def _get_from_and_to_version(self):
         di = distro_info.UbuntuDistroInfo()
@@ -223,8 +220,8 @@ class DistUpgradeQuirks(object):
         # if we are here, we need to test and warn
         return_code = subprocess.call([UNITY_SUPPORT_TEST])
         logging.debug(
-            "_test_and_warn_for_unity_3d_support '%s' returned '%s'" % (
-                UNITY_SUPPORT_TEST, return_code))
+            "_test_and_warn_for_unity_3d_support '%s' returned '%s'",
+            UNITY_SUPPORT_TEST, return_code)
         if return_code != 0:
             res = self._view.askYesNoQuestion(
                 _("Your graphics hardware may not be fully supported in "
@@ -297,7 +294,7 @@ class DistUpgradeQuirks(object):
                 "xorg-driver-fglrx-dev",
                 "libamdxvba1"
             ]
-            logging.debug("remove %s" % ", ".join(removals))
+            logging.debug("remove %s", ", ".join(removals))
             postupgradepurge = self.controller.config.getlist(
                 "Distro",
                 "PostUpgradePurge")
@@ -396,27 +393,21 @@ class DistUpgradeQuirks(object):
         """
 
         # These are the root ROS 1 and 2 dependencies as of 07/27/2020
-        ros_package_patterns = set()
-        for package_name in (
+        ros_package_pattern = re.compile(
+            "ros-[^\-]+-(%s)" % "|".join((
                 "catkin",
                 "rosboost-cfg",
                 "rosclean",
                 "ros-environment",
-                "ros-workspace"):
-            ros_package_patterns.add(
-                re.compile("ros-[^\-]+-%s" % package_name))
+                "ros-workspace")))
 
         ros_is_installed = False
-        for pkg in cache:
-            if ros_is_installed:
+        for pkg in get_name_index(cache).with_prefix("ros-"):
+            if (ros_package_pattern.match(pkg.name) and
+                    (pkg.is_installed or pkg.marked_install)):
+                ros_is_installed = True
                 break
 
-            for pattern in ros_package_patterns:
-                if pattern.match(pkg.name):
-                    if pkg.is_installed or pkg.marked_install:
-                        ros_is_installed = True
-                    break
-
         if ros_is_installed:
             res = self._view.askYesNoQuestion(
                 _("The Robot Operating System (ROS) is installed"),
@@ -440,11 +431,10 @@ class DistUpgradeQuirks(object):
         parse /proc/cpuinfo and search for ARMv6 or greater
         """
         logging.debug("checking for ARM CPU version")
-        if not os.path.exists("/proc/cpuinfo"):
+        cpuinfo = self.facts.cpuinfo
+        if not cpuinfo:
             logging.error("cannot open /proc/cpuinfo ?!?")
             return False
-        with open("/proc/cpuinfo") as f:
-            cpuinfo = f.read()
         if re.search("^Processor\s*:\s*ARMv[45]", cpuinfo,
                      re.MULTILINE):
             return False
@@ -456,11 +446,9 @@ class DistUpgradeQuirks(object):
         system specific issues with upgrading e.g LP: #1928434
         """
         logging.debug("checking for system vendor")
-        if not os.path.exists("/sys/class/dmi/id/sys_vendor"):
+        vendor = self.facts.dmi_vendor
+        if not vendor:
             logging.error("cannot open /sys/class/dmi/id/sys_vendor")
-            return ''
-        with open("/sys/class/dmi/id/sys_vendor") as f:
-            vendor = f.read()
         return vendor
 
     def _stopApparmor(self):
@@ -475,6 +463,12 @@ class DistUpgradeQuirks(object):
             logging.debug("/etc/init.d/docvert-converter stop")
             subprocess.call(["/etc/init.d/docvert-converter", "stop"])
 
+    def _replayCoalescedHooks(self):
+        " run update-initramfs etc once for all the packages installed "
+        self._view.updateStatus(_("Running post-installation hooks"))
+        self._view.processEvents()
+        self.controller.replayHooks()
+
     def _killUpdateNotifier(self):
         "kill update-notifier"
         # kill update-notifier now to suppress reboot required
@@ -523,10 +517,10 @@ class DistUpgradeQuirks(object):
         try:
             for ext in ['.crash', '.upload', '.uploaded']:
                 for f in glob.glob("/var/crash/*%s" % ext):
-                    logging.debug("removing old %s file '%s'" % (ext, f))
+                    logging.debug("removing old %s file '%s'", ext, f)
                     os.unlink(f)
         except Exception as e:
-            logging.warning("error during unlink of old crash files (%s)" % e)
+            logging.warning("error during unlink of old crash files (%s)", e)
 
     def _checkStoreConnectivity(self):
         """ check for connectivity to the snap store to install snaps"""
@@ -628,7 +622,7 @@ class DistUpgradeQuirks(object):
                 info = json.loads(response)
                 size = int(info['results'][0]['snap']['download']['size'])
             except (KeyError, URLError, ValueError):
-                logging.debug("Failed fetching size of snap %s" % snap)
+                logging.debug("Failed fetching size of snap %s", snap)
                 continue
             self.extra_snap_space += size
 
@@ -658,10 +652,10 @@ class DistUpgradeQuirks(object):
                     check=True)
                 self._view.processEvents()
             except subprocess.CalledProcessError:
-                logging.debug("%s of snap %s failed" % (command, snap))
+                logging.debug("%s of snap %s failed", command, snap)
                 continue
             if proc.returncode == 0:
-                logging.debug("%s of snap %s succeeded" % (command, snap))
+                logging.debug("%s of snap %s succeeded", command, snap)
             if command == 'install' and snap_object['deb']:
                 self.controller.forced_obsoletes.append(snap_object['deb'])
 
@@ -669,12 +663,7 @@ class DistUpgradeQuirks(object):
         " check PAE in /proc/cpuinfo "
         # upgrade from Precise will fail if PAE is not in cpu flags
         logging.debug("_checkPae")
-        pae = 0
-        with open('/proc/cpuinfo') as f:
-            cpuinfo = f.read()
-        if re.search("^flags\s+:.* pae ", cpuinfo, re.MULTILINE):
-            pae = 1
-        if not pae:
+        if "pae" not in self.facts.cpu_flags:
             logging.error("no pae in /proc/cpuinfo")
             summary = _("PAE not enabled")
             msg = _("Your system uses a CPU that does not have PAE enabled. "
@@ -709,43 +698,41 @@ class DistUpgradeQuirks(object):
         if not os.path.exists(patchdir):
             logging.debug("no patchdir")
             return
+        from .DistUpgradePatcher import file_md5sum, patch
         for f in os.listdir(patchdir):
             # skip, not a patch file, they all end with .$md5sum
             if "." not in f:
-                logging.debug("skipping '%s' (no '.')" % f)
+                logging.debug("skipping '%s' (no '.')", f)
                 continue
-            logging.debug("check if patch '%s' needs to be applied" % f)
+            logging.debug("check if patch '%s' needs to be applied", f)
             (encoded_path, md5sum, result_md5sum) = f.rsplit(".", 2)
             # FIXME: this is not clever and needs quoting support for
             #        filenames with "_" in the name
             path = encoded_path.replace("_", "/")
-            logging.debug("target for '%s' is '%s' -> '%s'" % (
-                f, encoded_path, path))
+            logging.debug("target for '%s' is '%s' -> '%s'",
+                          f, encoded_path, path)
             # target does not exist
             if not os.path.exists(path):
-                logging.debug("target '%s' does not exist" % path)
+                logging.debug("target '%s' does not exist", path)
                 continue
             # check the input md5sum, this is not strictly needed as patch()
             # will verify the result md5sum and discard the result if that
             # does not match but this will remove a misleading error in the
             # logs
-            md5 = hashlib.md5()
-            with open(path, "rb") as fd:
-                md5.update(fd.read())
-            if md5.hexdigest() == result_md5sum:
-                logging.debug("already at target hash, skipping '%s'" % path)
+            current_md5sum = file_md5sum(path)
+            if current_md5sum == result_md5sum:
+                logging.debug("already at target hash, skipping '%s'", path)
                 continue
-            elif md5.hexdigest() != md5sum:
-                logging.warning("unexpected target md5sum, skipping: '%s'"
-                                % path)
+            elif current_md5sum != md5sum:
+                logging.warning("unexpected target md5sum, skipping: '%s'",
+                                path)
                 continue
             # patchable, do it
-            from .DistUpgradePatcher import patch
             try:
                 patch(path, os.path.join(patchdir, f), result_md5sum)
-                logging.info("applied '%s' successfully" % f)
+                logging.info("applied '%s' successfully", f)
             except Exception:
-                logging.exception("ed failed for '%s'" % f)
+                logging.exception("ed failed for '%s'", f)
 
     def _supportInModaliases(self, pkgname, lspci=None):
         """
@@ -771,11 +758,11 @@ class DistUpgradeQuirks(object):
                 if m:
                     matchid = "%s:%s" % (m.group(1), m.group(2))
                     if matchid.lower() in lspci:
-                        logging.debug("found system pciid '%s' in modaliases"
-                                      % matchid)
+                        logging.debug("found system pciid '%s' in modaliases",
+                                      matchid)
                         return True
-        logging.debug("checking for %s support in modaliases but none found"
-                      % pkgname)
+        logging.debug("checking for %s support in modaliases but none found",
+                      pkgname)
         return False
 
     def _parse_modaliases_from_pkg_header(self, pkgrecord):
@@ -859,27 +846,29 @@ class DistUpgradeQuirks(object):
             term2 = '%s-%s' % (match2.group(1),
                                match2.group(2))
 
-        logging.debug('Comparing %s with %s' % (term1, term2))
+        logging.debug('Comparing %s with %s', term1, term2)
         return apt.apt_pkg.version_compare(term1, term2) > 0
 
-    def _get_linux_metapackage(self, cache, headers):
-        """ Get the linux headers or linux metapackage
-            copied from ubuntu-drivers-common
+    def _get_latest_kernel(self, cache):
+        """ Get the (version, flavour, source) of the newest installed
+            or marked linux-image, None if there is none. The result is
+            kept until the marks of the cache change.
         """
-        suffix = headers and '-headers' or ''
-        pattern = re.compile('linux-image-(.+)-([0-9]+)-(.+)')
-        source_pattern = re.compile('linux-(.+)')
+        changes = getattr(cache, "_changes_count", None)
+        memo = getattr(cache, "_latest_kernel", None)
+        if changes is not None and memo is not None and memo[0] == changes:
+            return memo[1]
 
-        metapackage = ''
+        pattern = re.compile('linux-image-(.+)-([0-9]+)-(.+)')
+        latest = None
         version = ''
-        for pkg in cache:
-            if ('linux-image' in pkg.name and 'extra' not in pkg.name and
+        for pkg in get_name_index(cache).with_prefix('linux-image-'):
+            if ('extra' not in pkg.name and
                     (pkg.is_installed or pkg.marked_install)):
                 match = pattern.match(pkg.name)
                 # Here we filter out packages such as
                 # linux-generic-lts-quantal
                 if match:
-                    source = pkg.candidate.record['Source']
                     current_version = '%s-%s' % (match.group(1),
                                                  match.group(2))
                     # See if the current version is greater than
@@ -887,28 +876,41 @@ class DistUpgradeQuirks(object):
                     if self._is_greater_than(current_version,
                                              version):
                         version = current_version
-                        match_source = source_pattern.match(source)
-                        # Set the linux-headers metapackage
-                        if '-lts-' in source and match_source:
-                            # This is the case of packages such as
-                            # linux-image-3.5.0-18-generic which
-                            # comes from linux-lts-quantal.
-                            # Therefore the linux-headers-generic
-                            # metapackage would be wrong here and
-                            # we should use
-                            # linux-headers-generic-lts-quantal
-                            # instead
-                            metapackage = 'linux%s-%s-%s' % (
-                                           suffix,
-                                           match.group(3),
-                                           match_source.group(1))
-                        else:
-                            # The scheme linux-headers-$flavour works
-                            # well here
-                            metapackage = 'linux%s-%s' % (
-                                           suffix,
-                                           match.group(3))
-        return metapackage
+                        # no Source field if it is the package name
+                        source = pkg.candidate.record.get('Source', pkg.name)
+                        latest = (current_version, match.group(3), source)
+
+        if changes is not None:
+            cache._latest_kernel = (changes, latest)
+        return latest
+
+    def _get_linux_metapackage(self, cache, headers):
+        """ Get the linux headers or linux metapackage
+            copied from ubuntu-drivers-common
+        """
+        suffix = headers and '-headers' or ''
+        source_pattern = re.compile('linux-(.+)')
+
+        latest = self._get_latest_kernel(cache)
+        if latest is None:
+            return ''
+        (version, flavour, source) = latest
+        match_source = source_pattern.match(source)
+        # Set the linux-headers metapackage
+        if '-lts-' in source and match_source:
+            # This is the case of packages such as
+            # linux-image-3.5.0-18-generic which
+            # comes from linux-lts-quantal.
+            # Therefore the linux-headers-generic
+            # metapackage would be wrong here and
+            # we should use
+            # linux-headers-generic-lts-quantal
+            # instead
+            return 'linux%s-%s-%s' % (suffix, flavour,
+                                      match_source.group(1))
+        # The scheme linux-headers-$flavour works
+        # well here
+        return 'linux%s-%s' % (suffix, flavour)
 
     def _install_linux_metapackage(self):
         """ Ensure the linux metapackage is installed for the newest_kernel
@@ -919,12 +921,12 @@ class DistUpgradeQuirks(object):
         # Seen on errors.u.c with linux-rpi2 metapackage
         # https://errors.ubuntu.com/problem/994bf05fae85fbcd44f721495db6518f2d5a126d
         if linux_metapackage not in cache:
-            logging.info("linux metapackage (%s) not available" %
+            logging.info("linux metapackage (%s) not available",
                          linux_metapackage)
             return
         # install the package if it isn't installed
         if not cache[linux_metapackage].is_installed:
-            logging.info("installing linux metapackage: %s" %
+            logging.info("installing linux metapackage: %s",
                          linux_metapackage)
             reason = "linux metapackage may have been accidentally uninstalled"
             cache.mark_install(linux_metapackage, reason)
@@ -949,18 +951,18 @@ class DistUpgradeQuirks(object):
         # can guide the code with auto_inst=True when it makes decisions
         for auto_inst in False, True:
             for old, new in replacements:
-                logging.info("checking for %s (auto_inst=%s)" %
-                             (old, auto_inst))
+                logging.info("checking for %s (auto_inst=%s)",
+                             old, auto_inst)
                 if old in cache and cache[old].is_installed:
                     if new:
-                        logging.info("installing %s because %s was installed" %
-                                     (new, old))
+                        logging.info("installing %s because %s was installed",
+                                     new, old)
                         reason = "%s was installed on the system" % old
                         if not cache.mark_install(new, reason, auto_fix=False,
                                                   auto_inst=auto_inst):
-                            logging.info("failed to install %s" % new)
-                    logging.info("removing %s because %s is being installed" %
-                                 (old, new))
+                            logging.info("failed to install %s", new)
+                    logging.info("removing %s because %s is being installed",
+                                 old, new)
                     reason = "%s is being installed on the system" % new
                     if not cache.mark_remove(old, reason, auto_fix=False):
                         logging.info("failed to remove %s", old)
@@ -1057,7 +1059,7 @@ class DistUpgradeQuirks(object):
                 from_chan = unseed.get("from_channel", from_channel)
                 unseeded_snaps[snap] = (deb, from_chan)
         except Exception as e:
-            logging.warning("error reading deb2snap.json file (%s)" % e)
+            logging.warning("error reading deb2snap.json file (%s)", e)
 
         snap_list = ''
         # list the installed snaps and add them to seeded ones
@@ -1084,12 +1086,12 @@ class DistUpgradeQuirks(object):
                                          stdout=subprocess.PIPE).communicate()
             self._view.processEvents()
             if re.search("^installed: ", snap_info[0], re.MULTILINE):
-                logging.debug("Snap %s is installed" % snap)
+                logging.debug("Snap %s is installed", snap)
                 # its not tracking the release channel so don't refresh
                 if not re.search(r"^tracking:.*%s" % from_channel,
                                  snap_info[0], re.MULTILINE):
-                    logging.debug("Snap %s is not tracking the release channel"
-                                  % snap)
+                    logging.debug(
+                        "Snap %s is not tracking the release channel", snap)
                     continue
                 snap_object['command'] = 'refresh'
             else:
@@ -1097,13 +1099,13 @@ class DistUpgradeQuirks(object):
                 cache = self.controller.cache
                 if (deb and (deb not in cache or not cache[deb].is_installed)):
                     logging.debug("Deb package %s is not installed. Skipping "
-                                  "snap package %s installation" % (deb, snap))
+                                  "snap package %s installation", deb, snap)
                     continue
 
                 match = re.search(r"snap-id:\s*(\w*)", snap_info[0])
                 if not match:
-                    logging.debug("Could not parse snap-id for the %s snap"
-                                  % snap)
+                    logging.debug("Could not parse snap-id for the %s snap",
+                                  snap)
                     continue
                 snap_object['command'] = 'install'
                 snap_object['deb'] = deb
@@ -1118,12 +1120,12 @@ class DistUpgradeQuirks(object):
                                          stdout=subprocess.PIPE).communicate()
             self._view.processEvents()
             if re.search("^installed: ", snap_info[0], re.MULTILINE):
-                logging.debug("Snap %s is installed" % snap)
+                logging.debug("Snap %s is installed", snap)
                 # its not tracking the release channel so don't remove
                 if not re.search(r"^tracking:.*%s" % from_channel,
                                  snap_info[0], re.MULTILINE):
-                    logging.debug("Snap %s is not tracking the release channel"
-                                  % snap)
+                    logging.debug(
+                        "Snap %s is not tracking the release channel", snap)
                     continue
 
                 snap_object['command'] = 'remove'
@@ -1146,8 +1148,8 @@ class DistUpgradeQuirks(object):
                         if plug_snap != '-' and \
                            plug_snap not in unseeded_snaps:
                             logging.debug("Snap %s is being used by %s. "
-                                          "Switching it to stable track"
-                                          % (snap, plug_snap))
+                                          "Switching it to stable track",
+                                          snap, plug_snap)
                             snap_object['command'] = 'refresh'
                             snap_object['channel'] = 'stable'
                             break
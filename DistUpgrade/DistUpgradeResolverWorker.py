@@ -0,0 +1,119 @@
+# DistUpgradeResolverWorker.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+Dependency resolution in a forked worker process.
+
+The worker calculates the marks on its copy of the cache while the
+parent only keeps the UI alive, so neither of them waits for the GIL.
+The resulting changes are sent back in the upgrade plan format and
+applied to the cache of the parent in one action group.
+"""
+
+import json
+import logging
+import os
+import time
+
+from .DistUpgradePlan import UpgradePlan, changes_from_cache
+
+
+class ResolverWorkerError(Exception):
+    """ the worker did not produce a usable result """
+    pass
+
+
+class RecordingView(object):
+    """ the view of the resolver in the worker, the errors it shows
+        are shown by the parent
+    """
+
+    def __init__(self):
+        self.errors = []
+
+    def error(self, summary, msg, extended_msg=None):
+        self.errors.append((summary, msg, extended_msg))
+        return False
+
+    def processEvents(self):
+        pass
+
+    def pulseProgress(self, finished=False):
+        pass
+
+
+def _run_worker(cache, resolve, fd):
+    """ resolve and write the result to fd, returns the exit status """
+    view = RecordingView()
+    result = {}
+    try:
+        resolve(view)
+        result["changes"] = changes_from_cache(cache)
+    except SystemError as e:
+        result["error"] = str(e)
+    except Exception:
+        logging.exception("resolver worker failed")
+        return 1
+    result["errors"] = view.errors
+    with os.fdopen(fd, "w") as f:
+        json.dump(result, f)
+    return 0
+
+
+def resolve_in_worker(cache, view, resolve):
+    """ run resolve(view) in a forked worker and apply the marks it
+        calculated to cache
+
+    The errors the resolver showed are shown on view and a SystemError
+    of the resolver is raised again, just as if resolve() ran here.
+    ResolverWorkerError is raised (with the cache cleared) if there is
+    no result to apply.
+    """
+    start = time.time()
+    (rfd, wfd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        res = 1
+        try:
+            os.close(rfd)
+            res = _run_worker(cache, resolve, wfd)
+        finally:
+            # no atexit handlers and no buffers of the parent
+            os._exit(res)
+    os.close(wfd)
+    with os.fdopen(rfd) as f:
+        data = f.read()
+    (pid, status) = os.waitpid(pid, 0)
+    logging.debug("resolver worker %s exited with %s after %.1fs",
+                  pid, status, time.time() - start)
+    if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+        raise ResolverWorkerError("exit status %s" % status)
+    try:
+        result = json.loads(data)
+    except ValueError as e:
+        raise ResolverWorkerError("invalid result: %s" % e)
+    if "error" not in result:
+        plan = UpgradePlan("DistUpgrade", None,
+                           {"changes": result.get("changes", [])})
+        if not plan.apply(cache):
+            raise ResolverWorkerError("the changes do not apply")
+    for (summary, msg, extended_msg) in result.get("errors", []):
+        view.error(summary, msg, extended_msg)
+    if "error" in result:
+        raise SystemError(result["error"])
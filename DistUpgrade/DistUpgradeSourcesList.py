@@ -0,0 +1,177 @@
+# DistUpgradeSourcesList.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+A SourcesList that only touches the files it changed.
+
+The plain SourcesList backs up every file up front and rewrites every
+file on save(). On systems with hundreds of sources.list.d snippets
+most of them are left alone by the upgrade, so the files are rendered
+when they are read and again on save() and only the ones whose
+rendering differs are backed up and written, atomically.
+
+The templates the entries are matched against are indexed by the dist
+they match, so matching does not try every template for every entry.
+"""
+
+import heapq
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from operator import itemgetter
+
+import apt_pkg
+from aptsources.sourceslist import SourceEntryMatcher, SourcesList
+
+
+class IndexedSourceEntryMatcher(object):
+    """ SourceEntryMatcher with the templates indexed by their name and
+        by the dist they match, the first matching template still wins
+    """
+
+    def __init__(self, templates):
+        self.templates = templates
+        self._by_name = {}
+        # "^impish-updates$" only matches a single dist, everything
+        # else is a pattern that is tried for every entry
+        self._by_dist = {}
+        self._patterns = []
+        for (pos, template) in enumerate(templates):
+            self._by_name.setdefault(template.name, []).append(template)
+            if template.match_name is None:
+                continue
+            m = re.match(r"^\^([\w-]+)\$$", template.match_name)
+            if m:
+                self._by_dist.setdefault(m.group(1), []).append(
+                    (pos, template))
+            else:
+                self._patterns.append((pos, template))
+
+    def templates_named(self, name):
+        """ the templates for the given (codename) name """
+        return self._by_name.get(name, [])
+
+    def match(self, source):
+        """ add the first matching template to the source """
+        if source.uri is None or source.dist is None:
+            return False
+        candidates = heapq.merge(self._by_dist.get(source.dist, []),
+                                 self._patterns, key=itemgetter(0))
+        for (pos, template) in candidates:
+            if not re.match(template.match_name, source.dist):
+                continue
+            # deb is a valid fallback for deb-src
+            if ((template.match_uri is not None and
+                 re.search(template.match_uri, source.uri) and
+                 (source.type == template.type or template.type == "deb")) or
+                    template.is_mirror(source.uri)):
+                source.template = template
+                return True
+        return False
+
+
+class TrackedSourcesList(SourcesList):
+    """ SourcesList that backs up and writes only the changed files """
+
+    def __init__(self, *args, **kwargs):
+        # file -> content as it was read (or last saved)
+        self._saved = {}
+        # files backed up by this object, only those are restored
+        self._backed_up = set()
+        self.backup_ext = None
+        SourcesList.__init__(self, *args, **kwargs)
+
+    def refresh(self):
+        if isinstance(self.matcher, SourceEntryMatcher):
+            self.matcher = IndexedSourceEntryMatcher(self.matcher.templates)
+        SourcesList.refresh(self)
+        self._saved = self._render()
+
+    def _render(self):
+        """ return a dict file -> content of the current entries """
+        chunks = {}
+        for source in self.list:
+            file_chunks = chunks.setdefault(source.file, [])
+            if file_chunks and source.file.endswith(".sources"):
+                file_chunks.append("\n")
+            file_chunks.append(source.str())
+        return dict((f, "".join(c)) for (f, c) in chunks.items())
+
+    def changed_files(self):
+        """ the files that differ from what was read, in list order """
+        return [f for (f, content) in self._render().items()
+                if self._saved.get(f) != content]
+
+    def backup(self, backup_ext=None):
+        """ remember the backup extension, the files are only backed up
+            when save() is about to change them
+        """
+        if backup_ext is None:
+            backup_ext = time.strftime("%y%m%d.%H%M")
+        self.backup_ext = backup_ext
+        return backup_ext
+
+    def _backup_file(self, path):
+        if (self.backup_ext is None or path in self._backed_up or
+                not os.path.exists(path)):
+            return
+        shutil.copy(path, path + self.backup_ext)
+        self._backed_up.add(path)
+
+    def restore_backup(self, backup_ext):
+        """ restore the files that were backed up by save() """
+        for path in sorted(self._backed_up):
+            if os.path.exists(path + backup_ext):
+                shutil.copy(path + backup_ext, path)
+
+    def _write(self, path, content):
+        (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(path),
+                                     prefix=".%s." % os.path.basename(path))
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+            if os.path.exists(path):
+                shutil.copymode(path, tmp)
+            else:
+                os.chmod(tmp, 0o644)
+            os.rename(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def save(self):
+        """ back up and write the files whose entries changed """
+        if len(self.list) == 0:
+            # the default sources.list with just a header
+            self._backup_file(
+                apt_pkg.config.find_file("Dir::Etc::sourcelist"))
+            SourcesList.save(self)
+            self._saved = {}
+            return
+        rendered = self._render()
+        for (path, content) in rendered.items():
+            if self._saved.get(path) == content:
+                continue
+            logging.debug("writing changed sources file '%s'", path)
+            self._backup_file(path)
+            self._write(path, content)
+        self._saved = rendered
@@ -0,0 +1,253 @@
+# DistUpgradeSystemFacts.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+Facts about the running system, read from /proc, /sys and /etc.
+
+Every fact is read the first time it is asked for and then kept for
+the lifetime of the object. Only the codename falls back to forking
+lsb_release, when os-release does not have one.
+"""
+
+import glob
+import logging
+import os
+import re
+from collections import namedtuple
+
+from .DistUpgradeConfigParser import distro_codename, read_os_release
+
+
+Mount = namedtuple("Mount", ["what", "where", "fstype", "options"])
+
+
+def _unescape_mount_field(field):
+    """ undo the octal escapes (e.g. \\040 for space) of /proc/mounts """
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)),
+                  field)
+
+
+def parse_mounts(content):
+    """ return the Mount entries of a /proc/mounts style content """
+    mounts = []
+    for line in content.splitlines():
+        try:
+            (what, where, fstype, options, a, b) = line.split()
+        except ValueError as e:
+            logging.debug("line '%s' in /proc/mounts not understood (%s)",
+                          line, e)
+            continue
+        mounts.append(Mount(_unescape_mount_field(what),
+                            _unescape_mount_field(where),
+                            fstype, tuple(options.split(","))))
+    return mounts
+
+
+def mount_point(path, mounts):
+    """ the mount point of the filesystem that path is on """
+    best = "/"
+    for mount in mounts:
+        where = mount.where.rstrip("/") + "/"
+        if ((path + "/").startswith(where) and
+                len(mount.where) > len(best)):
+            best = mount.where
+    return best
+
+
+def writable_filesystems(mounts):
+    """ one mount point of every writable block device filesystem """
+    seen = set()
+    result = []
+    for mount in mounts:
+        if (not mount.what.startswith("/dev/") or
+                "ro" in mount.options or mount.what in seen):
+            continue
+        seen.add(mount.what)
+        result.append(mount.where)
+    return result
+
+
+def _parse_cpu_list(content):
+    """ the number of cpus in a /sys cpu list like "0-3,6" """
+    count = 0
+    for part in content.strip().split(","):
+        if not part:
+            continue
+        (first, sep, last) = part.partition("-")
+        count += int(last) - int(first) + 1 if sep else 1
+    return count
+
+
+class SystemFacts(object):
+    """ lazily read and cached facts about the system
+
+    root is the directory /proc, /sys and /etc are looked up in,
+    which is only ever different from "/" in the tests
+    """
+
+    def __init__(self, root="/"):
+        self.root = root
+        self._facts = {}
+
+    def _path(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def _read(self, path, default=None):
+        try:
+            with open(self._path(path)) as f:
+                return f.read()
+        except (IOError, OSError, UnicodeDecodeError) as e:
+            logging.debug("can not read '%s': %s", path, e)
+            return default
+
+    def _fact(self, name, func):
+        if name not in self._facts:
+            self._facts[name] = func()
+        return self._facts[name]
+
+    def forget(self, *names):
+        """ re-read the given facts (or all of them) next time """
+        if not names:
+            self._facts.clear()
+        for name in names:
+            self._facts.pop(name, None)
+
+    @property
+    def kernel_release(self):
+        """ the release of the running kernel, like uname -r """
+        def read():
+            release = self._read("/proc/sys/kernel/osrelease")
+            if release is None and self.root == "/":
+                return os.uname()[2]
+            return (release or "").strip()
+        return self._fact("kernel_release", read)
+
+    @property
+    def os_release(self):
+        """ the fields of /etc/os-release """
+        return self._fact("os_release", lambda: read_os_release(
+            [self._path("/etc/os-release"),
+             self._path("/usr/lib/os-release")]))
+
+    @property
+    def codename(self):
+        """ the codename of the running release, like lsb_release -c """
+        def read():
+            os_release = self.os_release
+            codename = (os_release.get("VERSION_CODENAME") or
+                        os_release.get("UBUNTU_CODENAME"))
+            if not codename and self.root == "/":
+                codename = distro_codename()
+            return codename or ""
+        return self._fact("codename", read)
+
+    @property
+    def cpuinfo(self):
+        return self._fact("cpuinfo", lambda: self._read("/proc/cpuinfo", ""))
+
+    @property
+    def cpu_flags(self):
+        """ the flags (x86) or features (arm) of the first cpu """
+        def read():
+            m = re.search(r"^(?:flags|Features)\s*:(.*)$", self.cpuinfo,
+                          re.MULTILINE)
+            return frozenset(m.group(1).split()) if m else frozenset()
+        return self._fact("cpu_flags", read)
+
+    @property
+    def cpu_limit_reached(self):
+        """ True if the kernel does not use all present cpus """
+        def read():
+            present = self._read("/sys/devices/system/cpu/present")
+            kernel_max = self._read("/sys/devices/system/cpu/kernel_max")
+            if present is None or kernel_max is None:
+                return False
+            try:
+                return _parse_cpu_list(present) > int(kernel_max) + 1
+            except ValueError:
+                return False
+        return self._fact("cpu_limit_reached", read)
+
+    @property
+    def mem_total(self):
+        """ the RAM of the machine in bytes, 0 if unknown """
+        def read():
+            m = re.search(r"^MemTotal:\s*(\d+) kB",
+                          self._read("/proc/meminfo", ""), re.MULTILINE)
+            return int(m.group(1)) * 1024 if m else 0
+        return self._fact("mem_total", read)
+
+    @property
+    def dmi_vendor(self):
+        return self._fact("dmi_vendor", lambda: self._read(
+            "/sys/class/dmi/id/sys_vendor", ""))
+
+    @property
+    def pci_devices(self):
+        """ a list of (slot, class, "vendor:device") like lspci -n """
+        def read():
+            devices = []
+            pattern = self._path("/sys/bus/pci/devices/*")
+            for devdir in sorted(glob.glob(pattern)):
+                ids = []
+                for name in ("class", "vendor", "device"):
+                    try:
+                        with open(os.path.join(devdir, name)) as f:
+                            ids.append(f.read().strip().lower())
+                    except (IOError, OSError):
+                        break
+                if len(ids) != 3:
+                    continue
+                (klass, vendor, device) = [i.replace("0x", "") for i in ids]
+                slot = os.path.basename(devdir)
+                # lspci leaves out the (default) domain
+                if slot.startswith("0000:"):
+                    slot = slot[len("0000:"):]
+                devices.append((slot, klass[:4],
+                                "%s:%s" % (vendor, device)))
+            return devices
+        return self._fact("pci_devices", read)
+
+    @property
+    def pci_ids(self):
+        """ the set of "vendor:device" pci ids """
+        return self._fact("pci_ids", lambda: frozenset(
+            ids for (slot, klass, ids) in self.pci_devices))
+
+    @property
+    def efi(self):
+        return self._fact("efi", lambda: os.path.exists(
+            self._path("/sys/firmware/efi")))
+
+    @property
+    def mounts(self):
+        """ the Mount entries of /proc/mounts """
+        return self._fact("mounts", lambda: parse_mounts(
+            self._read("/proc/mounts", "")))
+
+
+_system_facts = None
+
+
+def get_system_facts():
+    """ return the SystemFacts of this process """
+    global _system_facts
+    if _system_facts is None:
+        _system_facts = SystemFacts()
+    return _system_facts
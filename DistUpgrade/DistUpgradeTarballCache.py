@@ -0,0 +1,218 @@
+# DistUpgradeTarballCache.py
+#
+#  Copyright (c) 2021 Canonical
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as
+#  published by the Free Software Foundation; either version 2 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
+#  USA
+
+"""
+Cache of authenticated upgrader tarballs.
+
+The tarballs and their signatures are stored under the SHA256 of the
+tarball. An index maps the upgrade tool URI to the hash together with
+the ETag and Last-Modified of the server, so a retry only needs a
+conditional request (or none at all when meta-release gives the hash).
+Cached files are copied to the tmpdir of the fetcher and authenticated
+again from there, the cache is never trusted on its own.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+
+CACHE_DIR = "/var/cache/ubuntu-release-upgrader"
+# the tarballs are a few MB, keep the last couple of them
+MAX_CACHE_SIZE = 64 * 1024 * 1024
+# the names of the cached files
+CACHE_FILE_RE = re.compile(r"^([0-9a-f]{64})\.(tar\.gz|gpg)$")
+
+
+def sha256sum(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(64 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _validators(headers):
+    return {"etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified")}
+
+
+class TarballCache(object):
+    """ content addressed store of verified upgrader tarballs """
+
+    def __init__(self, cachedir=CACHE_DIR, max_size=MAX_CACHE_SIZE,
+                 timeout=5):
+        self.cachedir = cachedir
+        self.max_size = max_size
+        self.timeout = timeout
+        self.index_file = os.path.join(cachedir, "index.json")
+
+    def _path(self, sha256, suffix=""):
+        return os.path.join(self.cachedir, sha256 + suffix)
+
+    def _read_index(self):
+        try:
+            with open(self.index_file) as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        return index if isinstance(index, dict) else {}
+
+    def _write_index(self, index):
+        (fd, tmp) = tempfile.mkstemp(dir=self.cachedir, prefix=".index-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.index_file)
+
+    def _valid(self, sha256):
+        """ True if the tarball and signature of sha256 are complete """
+        tarball = self._path(sha256, ".tar.gz")
+        if not (os.path.exists(tarball) and
+                os.path.exists(self._path(sha256, ".gpg"))):
+            return False
+        try:
+            return sha256sum(tarball) == sha256
+        except (IOError, OSError):
+            return False
+
+    def check(self, uri):
+        """ ask the server whether the tarball at uri changed
+
+        returns a tuple (unchanged, validators) where validators are
+        the ETag and Last-Modified to store with a new download
+        """
+        entry = self._read_index().get(uri, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            with urlopen(Request(uri, headers=headers, method="HEAD"),
+                         timeout=self.timeout) as res:
+                validators = _validators(res.headers)
+        except HTTPError as e:
+            if e.code == 304:
+                return (bool(entry), _validators(e.headers))
+            logging.debug("checking '%s' failed: %s", uri, e)
+            return (False, {})
+        except (URLError, IOError, OSError, ValueError) as e:
+            logging.debug("checking '%s' failed: %s", uri, e)
+            return (False, {})
+        # servers (and file:// URIs) that ignore the conditions
+        unchanged = bool(entry) and any(
+            validators[key] and validators[key] == entry.get(key)
+            for key in ("etag", "last_modified"))
+        return (unchanged, validators)
+
+    def lookup(self, uri, sha256=None):
+        """ look for the tarball of uri in the cache
+
+        returns a tuple (sha256, validators), sha256 is None if the
+        tarball is not cached or changed on the server. With the
+        sha256 from meta-release no request is made at all.
+        """
+        if sha256:
+            return (sha256 if self._valid(sha256) else None, {})
+        entry = self._read_index().get(uri, {})
+        (unchanged, validators) = self.check(uri)
+        if unchanged and self._valid(entry.get("sha256", "")):
+            return (entry["sha256"], validators)
+        return (None, validators)
+
+    def copy_to(self, sha256, tarball, signature):
+        """ copy the cached files of sha256 to the given paths """
+        shutil.copyfile(self._path(sha256, ".tar.gz"), tarball)
+        shutil.copyfile(self._path(sha256, ".gpg"), signature)
+        try:
+            index = self._read_index()
+            for entry in index.values():
+                if entry.get("sha256") == sha256:
+                    entry["used"] = time.time()
+            self._write_index(index)
+        except (IOError, OSError) as e:
+            logging.debug("can not update the tarball cache index: %s", e)
+
+    def add(self, uri, tarball, signature, validators=None):
+        """ store an authenticated tarball and its signature """
+        try:
+            os.makedirs(self.cachedir, mode=0o755, exist_ok=True)
+            sha256 = sha256sum(tarball)
+            for (src, suffix) in ((signature, ".gpg"), (tarball, ".tar.gz")):
+                (fd, tmp) = tempfile.mkstemp(dir=self.cachedir,
+                                             prefix=".partial-")
+                os.close(fd)
+                shutil.copyfile(src, tmp)
+                os.chmod(tmp, 0o644)
+                os.rename(tmp, self._path(sha256, suffix))
+            index = self._read_index()
+            entry = {"sha256": sha256,
+                     "size": os.path.getsize(tarball) +
+                     os.path.getsize(signature),
+                     "used": time.time()}
+            entry.update(validators or {})
+            index[uri] = entry
+            self._evict(index)
+            self._write_index(index)
+        except (IOError, OSError) as e:
+            logging.debug("can not add '%s' to the tarball cache: %s", uri, e)
+            return None
+        logging.debug("cached '%s' as %s", uri, sha256)
+        return sha256
+
+    def _evict(self, index):
+        """ drop the least recently used tarballs above max_size """
+        by_hash = {}
+        for (uri, entry) in index.items():
+            sha256 = entry.get("sha256")
+            used = max(entry.get("used", 0),
+                       by_hash.get(sha256, (0, 0))[0])
+            by_hash[sha256] = (used, entry.get("size", 0))
+        total = sum(size for (used, size) in by_hash.values())
+        for (sha256, (used, size)) in sorted(by_hash.items(),
+                                             key=lambda item: item[1][0]):
+            if total <= self.max_size or len(by_hash) == 1:
+                break
+            for suffix in (".tar.gz", ".gpg"):
+                try:
+                    os.unlink(self._path(sha256, suffix))
+                except OSError:
+                    pass
+            for uri in [u for (u, e) in index.items()
+                        if e.get("sha256") == sha256]:
+                del index[uri]
+            del by_hash[sha256]
+            total -= size
+            logging.debug("evicted %s from the tarball cache", sha256)
+        # files of the cache that lost their index entry, other files
+        # in the directory are left alone
+        for name in os.listdir(self.cachedir):
+            match = CACHE_FILE_RE.match(name)
+            if match and match.group(1) not in by_hash:
+                try:
+                    os.unlink(os.path.join(self.cachedir, name))
+                except OSError:
+                    pass
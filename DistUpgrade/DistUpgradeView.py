@@ -22,6 +22,7 @@
 from .DistUpgradeGettext import gettext as _
 from .DistUpgradeGettext import ngettext
 from .telemetry import get as get_telemetry
+from .DistUpgradeMemory import get_memory_report
 import apt
 from enum import Enum
 import errno
@@ -278,6 +279,9 @@ class DistUpgradeView(object):
     " abstraction for the upgrade view "
     def __init__(self):
         self.needs_screen = False
+        # conffile name -> package of the locally modified conffiles
+        # of the upgraded packages (if known)
+        self.modified_conffiles = None
         pass
     def getOpCacheProgress(self):
         " return a OpProgress() subclass for the given graphic"
@@ -310,7 +314,7 @@ class DistUpgradeView(object):
         5. Complete
         """
         get_telemetry().add_stage(step.name)
-        pass
+        get_memory_report().phase(step.name)
     def hideStep(self, step):
         " hide a certain step from the GUI "
         pass
@@ -384,6 +388,14 @@ class DistUpgradeView(object):
                           "%d packages are going to be upgraded.",
                           pkgs_upgrade) % pkgs_upgrade
           msg +=" "
+        modified_conffiles = getattr(self, "modified_conffiles", None)
+        if modified_conffiles:
+          msg += ngettext("%d locally modified configuration file may "
+                          "need your attention.",
+                          "%d locally modified configuration files may "
+                          "need your attention.",
+                          len(modified_conffiles)) % len(modified_conffiles)
+          msg += " "
         if downloadSize > 0:
           downloadSizeStr = apt_pkg.size_to_str(downloadSize)
           if isinstance(downloadSizeStr, bytes):
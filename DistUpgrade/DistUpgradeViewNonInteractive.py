@@ -21,8 +21,11 @@
 
 import apt
 import apt_pkg
+import codecs
+import fnmatch
 import logging
 import locale
+import re
 import time
 import sys
 import os
@@ -37,7 +40,7 @@ from subprocess import PIPE, Popen
 
 from .DistUpgradeView import DistUpgradeView, InstallProgress, AcquireProgress
 from .telemetry import get as get_telemetry
-from .DistUpgradeConfigParser import DistUpgradeConfig
+from .DistUpgradeConfigParser import get_config
 
 
 class NonInteractiveAcquireProgress(AcquireProgress):
@@ -59,14 +62,20 @@ class NonInteractiveInstallProgress(InstallProgress):
     hanging scripts are killed after a (long) timeout via ctrl-c
     """
 
-    def __init__(self, logdir):
+    # the question dpkg asks on the terminal, e.g.
+    # "*** foo.conf (Y/I/N/O/D/Z) [default=N] ? "
+    CONFFILE_PROMPT = re.compile(rb"\(Y/I/N/O/D/Z\) \[default=[YN]\] \? *$")
+
+    def __init__(self, logdir, config=None):
         InstallProgress.__init__(self)
         logging.debug("setting up environ for non-interactive use")
         if "DEBIAN_FRONTEND" not in os.environ:
             os.environ["DEBIAN_FRONTEND"] = "noninteractive"
         os.environ["APT_LISTCHANGES_FRONTEND"] = "none"
         os.environ["RELEASE_UPRADER_NO_APPORT"] = "1"
-        self.config = DistUpgradeConfig(".")
+        if config is None:
+            config = get_config(".")
+        self.config = config
         self.logdir = logdir
         self.install_run_number = 0
         try:
@@ -83,6 +92,55 @@ class NonInteractiveInstallProgress(InstallProgress):
             self.timeout = self.config.getint("NonInteractive","TerminalTimeout")
         except Exception:
             pass
+        # how long to wait for the conffile question after dpkg
+        # announced it on the status fd
+        self.conffile_prompt_timeout = self.config.getWithDefault(
+            "NonInteractive", "ConffilePromptTimeout", 5.0)
+        # conffile name -> True (install the package maintainer's version)
+        # or False (keep the local version)
+        self.conffile_decisions = {}
+        self.conffile_replace = self.config.getlist(
+            "NonInteractive", "ConffileReplace")
+        self._conffile_policy_set = False
+        policy = self.config.getWithDefault(
+            "NonInteractive", "ConffilePolicy", "prompt")
+        if policy == "keep":
+            self._set_conffile_policy("--force-confold")
+        elif policy == "new":
+            self._set_conffile_policy("--force-confnew")
+        # the last bit of terminal output, the conffile question may
+        # already be read when dpkg announces it
+        self._terminal_tail = b""
+        self._terminal_decoder = codecs.getincrementaldecoder(
+            locale.getpreferredencoding())(errors="ignore")
+
+    def _set_conffile_policy(self, option):
+        if self._conffile_policy_set:
+            return
+        logging.debug("enable dpkg %s" % option)
+        apt_pkg.config.set("DPkg::Options::", option)
+        self._conffile_policy_set = True
+
+    def set_conffile_decisions(self, decisions):
+        """
+        Precompute the answers to the conffile questions, decisions
+        maps conffile names to True (install the package maintainer's
+        version) or False (keep the local version).
+
+        If no file needs the new version dpkg is told to keep the
+        local versions and will not ask at all.
+        """
+        self.conffile_decisions.update(decisions)
+        if not self.conffile_replace and \
+                not any(self.conffile_decisions.values()):
+            self._set_conffile_policy("--force-confold")
+
+    def _take_new_conffile(self, current):
+        # the configured patterns win over the precomputed decisions
+        for pattern in self.conffile_replace:
+            if fnmatch.fnmatch(current, pattern):
+                return True
+        return self.conffile_decisions.get(current, False)
 
     def error(self, pkg, errormsg):
         logging.error("got a error from dpkg for pkg: '%s': '%s'" % (pkg, errormsg))
@@ -180,18 +238,58 @@ class NonInteractiveInstallProgress(InstallProgress):
         ret = subprocess.call(cmd, env=environ)
         logging.debug("%s script returned: %s" % (name,ret))
 
+    def _read_terminal(self, timeout):
+        """
+        Read the available terminal output (waiting up to timeout
+        seconds for it) and copy it to stdout, returns False if there
+        was nothing to read
+        """
+        res = select.select([self.master_fd], [], [], timeout)
+        if not res[0]:
+            return False
+        try:
+            data = os.read(self.master_fd, 4096)
+        except OSError:
+            # happens after we are finished because the fd is closed
+            return False
+        if not data:
+            return False
+        self.last_activity = time.time()
+        self._terminal_tail = (self._terminal_tail + data)[-512:]
+        sys.stdout.write(self._terminal_decoder.decode(data))
+        return True
+
+    def _wait_for_conffile_prompt(self):
+        """ wait until dpkg asks the conffile question on the terminal """
+        deadline = time.time() + self.conffile_prompt_timeout
+        while not self.CONFFILE_PROMPT.search(self._terminal_tail):
+            remaining = deadline - time.time()
+            if remaining <= 0 or not self._read_terminal(remaining):
+                sys.stdout.flush()
+                return False
+        sys.stdout.flush()
+        return True
+
     def conffile(self, current, new):
         logging.warning("got a conffile-prompt from dpkg for file: '%s'" %
                         current)
-        # looks like we have a race here *sometimes*
-        time.sleep(5)
+        # dpkg announces the prompt on the status fd before it asks,
+        # so wait for the question instead of answering too early
+        if not self._wait_for_conffile_prompt():
+            logging.warning("no conffile question from dpkg after %ss, "
+                            "answering anyway" % self.conffile_prompt_timeout)
+        self._terminal_tail = b""
+        take_new = self._take_new_conffile(current)
         try:
-          # don't overwrite
-          os.write(self.master_fd, b"n\n")
-          logging.warning("replied no to the conffile-prompt for file: '%s'" %
-                          current)
+            if take_new:
+                os.write(self.master_fd, b"y\n")
+            else:
+                # don't overwrite
+                os.write(self.master_fd, b"n\n")
+            logging.warning("replied %s to the conffile-prompt for file: '%s'" %
+                            ("yes" if take_new else "no", current))
         except Exception as e:
-          logging.error("error '%s' when trying to write to the conffile"%e)
+            logging.error("error '%s' when trying to write to the conffile"%e)
 
     def start_update(self):
         InstallProgress.start_update(self)
@@ -225,17 +323,8 @@ class NonInteractiveInstallProgress(InstallProgress):
             os.write(self.master_fd,chr(3))
         # read master fd and write to stdout so that terminal output
         # actualy works
-        res = select.select([self.master_fd],[],[],0.1)
-        while len(res[0]) > 0:
-           self.last_activity = time.time()
-           try:
-               s = os.read(self.master_fd, 1)
-               sys.stdout.write("%s" % s.decode(
-                    locale.getpreferredencoding(), errors='ignore'))
-           except OSError:
-               # happens after we are finished because the fd is closed
-               return
-           res = select.select([self.master_fd],[],[],0.1)
+        while self._read_terminal(0.1):
+            pass
         sys.stdout.flush()
     
 
@@ -256,9 +345,10 @@ class DistUpgradeViewNonInteractive(DistUpgradeView):
     def __init__(self, datadir=None, logdir=None):
         DistUpgradeView.__init__(self)
         get_telemetry().set_updater_type('NonInteractive')
-        self.config = DistUpgradeConfig(".")
+        self.config = get_config(datadir or ".")
         self._acquireProgress = NonInteractiveAcquireProgress()
-        self._installProgress = NonInteractiveInstallProgress(logdir)
+        self._installProgress = NonInteractiveInstallProgress(logdir,
+                                                              self.config)
         self._opProgress = apt.progress.base.OpProgress()
         sys.__excepthook__ = self.excepthook
     def excepthook(self, type, value, tb):
@@ -20,11 +20,14 @@ from __future__ import print_function, unicode_literals
 
 import datetime
 import os
+import re
 import subprocess
 import sys
 import time
 import tempfile
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from distutils.spawn import find_executable
 
 from gettext import gettext as _
@@ -104,6 +107,36 @@ class LowLevelCommands(object):
         ret = subprocess.call(["btrfs", "subvolume", "delete", snapshot])
         return ret == 0
 
+    def btrfs_subvolume_list(self, mountpoint):
+        """ the output of "btrfs subvolume list -s" or None """
+        try:
+            return subprocess.check_output(
+                ["btrfs", "subvolume", "list", "-s", mountpoint],
+                universal_newlines=True)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+# ID 257 gen 8 cgen 8 top level 5 otime 2021-10-14 10:29:19 path @foo
+SUBVOLUME_LIST_RE = re.compile(
+    r"\sotime\s+(?:(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)|-)\s+path\s+(.+)$")
+
+
+def parse_subvolume_list(output):
+    """ return a dict path -> creation time (unixtime, or None if the
+        kernel does not know) from "btrfs subvolume list -s" output
+    """
+    result = {}
+    for line in output.splitlines():
+        match = SUBVOLUME_LIST_RE.search(line)
+        if not match:
+            continue
+        (otime, path) = match.groups()
+        if otime is not None:
+            otime = time.mktime(time.strptime(otime, "%Y-%m-%d %H:%M:%S"))
+        result[path] = otime
+    return result
+
 
 class AptBtrfsSnapshot(object):
     """ the high level object that interacts with the snapshot system """
@@ -112,6 +145,8 @@ class AptBtrfsSnapshot(object):
     SNAP_PREFIX = "@apt-snapshot-"
     # backname when changing
     BACKUP_PREFIX = SNAP_PREFIX + "old-root-"
+    # parallel "btrfs subvolume delete" calls
+    DELETE_WORKERS = 4
 
     def __init__(self, fstab="/etc/fstab"):
         self.fstab = Fstab(fstab)
@@ -149,6 +184,7 @@ class AptBtrfsSnapshot(object):
         uuid = self._uuid_for_mountpoint("/")
         mountpoint = tempfile.mkdtemp(prefix="apt-btrfs-snapshot-mp-")
         if not self.commands.mount(uuid, mountpoint):
+            os.rmdir(mountpoint)
             return None
         self._btrfs_root_mountpoint = mountpoint
         return self._btrfs_root_mountpoint
@@ -159,53 +195,79 @@ class AptBtrfsSnapshot(object):
         self._btrfs_root_mountpoint = None
         return res
 
+    @contextmanager
+    def session(self):
+        """ mount the btrfs root volume once for all the operations
+            inside the with block, nested sessions share the mount
+        """
+        if self._btrfs_root_mountpoint is not None:
+            yield self._btrfs_root_mountpoint
+            return
+        mp = self.mount_btrfs_root_volume()
+        if mp is None:
+            raise AptBtrfsSnapshotError("can not mount the btrfs root volume")
+        try:
+            yield mp
+        finally:
+            self.umount_btrfs_root_volume()
+
     def _get_now_str(self):
         return datetime.datetime.now().replace(microsecond=0).isoformat(
             str('_'))
 
     def create_btrfs_root_snapshot(self, additional_prefix=""):
-        mp = self.mount_btrfs_root_volume()
-        snap_id = self._get_now_str()
-        source = os.path.join(mp, "@")
-        target = os.path.join(mp, self.SNAP_PREFIX + additional_prefix +
-                              snap_id)
-
-        if os.path.exists(target):
-            print(_("INFO: snapshot directory '%s' already exists, "
-                    "not creating duplicate") % (target,))
-            return True
-        else:
-            res = self.commands.btrfs_subvolume_snapshot(source, target)
-            self.umount_btrfs_root_volume()
-            return res
+        with self.session() as mp:
+            snap_id = self._get_now_str()
+            source = os.path.join(mp, "@")
+            target = os.path.join(mp, self.SNAP_PREFIX + additional_prefix +
+                                  snap_id)
+
+            if os.path.exists(target):
+                print(_("INFO: snapshot directory '%s' already exists, "
+                        "not creating duplicate") % (target,))
+                return True
+            return self.commands.btrfs_subvolume_snapshot(source, target)
+
+    def _get_snapshot_times(self, mp, check_atime):
+        """ return a dict snapshot -> time, the creation time from
+            "btrfs subvolume list" or the atime of its etc/fstab
+        """
+        output = self.commands.btrfs_subvolume_list(mp)
+        otimes = parse_subvolume_list(output) if output is not None else {}
+        result = {}
+        for e in os.listdir(mp):
+            if not e.startswith(self.SNAP_PREFIX):
+                continue
+            if otimes.get(e) is not None:
+                result[e] = otimes[e]
+                continue
+            if check_atime:
+                entry = self._get_supported_btrfs_root_fstab_entry()
+                if "noatime" in entry.options:
+                    raise AptBtrfsRootWithNoatimeError()
+            # fstab is read when it was booted and when a snapshot is
+            # created (to check if there is support for btrfs)
+            result[e] = os.path.getatime(os.path.join(mp, e, "etc", "fstab"))
+        return result
 
     def get_btrfs_root_snapshots_list(self, older_than=0):
         """ get the list of available snapshot
             If "older_then" is given (in unixtime format) it will only include
             snapshots that are older then the given date)
         """
-        result = []
-        # if older_than is used, ensure that the rootfs does not use
-        # "noatime"
-        if older_than != 0:
+        # if older_than is used and the snapshots have no creation time,
+        # ensure that the rootfs does not use "noatime"
+        check_atime = older_than != 0
+        if check_atime:
             entry = self._get_supported_btrfs_root_fstab_entry()
             if not entry:
                 raise AptBtrfsNotSupportedError()
-            if "noatime" in entry.options:
-                raise AptBtrfsRootWithNoatimeError()
         # if there is no older than, interpret that as "now"
         if older_than == 0:
             older_than = time.time()
-        mp = self.mount_btrfs_root_volume()
-        for e in os.listdir(mp):
-            if e.startswith(self.SNAP_PREFIX):
-                # fstab is read when it was booted and when a snapshot is
-                # created (to check if there is support for btrfs)
-                atime = os.path.getatime(os.path.join(mp, e, "etc", "fstab"))
-                if atime < older_than:
-                    result.append(e)
-        self.umount_btrfs_root_volume()
-        return result
+        with self.session() as mp:
+            times = self._get_snapshot_times(mp, check_atime)
+        return sorted(e for (e, t) in times.items() if t < older_than)
 
     def print_btrfs_root_snapshots(self):
         print("Available snapshots:")
@@ -232,17 +294,16 @@ class AptBtrfsSnapshot(object):
         return True
 
     def clean_btrfs_root_snapshots_older_than(self, timefmt):
-        res = True
         older_than_unixtime = self._parse_older_than_to_unixtime(timefmt)
         try:
-            for snap in self.get_btrfs_root_snapshots_list(
-                    older_than=older_than_unixtime):
-                res &= self.delete_snapshot(snap)
+            with self.session():
+                return self.delete_snapshots(
+                    self.get_btrfs_root_snapshots_list(
+                        older_than=older_than_unixtime))
         except AptBtrfsRootWithNoatimeError:
             sys.stderr.write("Error: fstab option 'noatime' incompatible with "
                              "option")
             return False
-        return res
 
     def command_set_default(self, snapshot_name):
         res = self.set_default(snapshot_name)
@@ -250,27 +311,33 @@ class AptBtrfsSnapshot(object):
 
     def set_default(self, snapshot_name, backup=True):
         """ set new default """
-        mp = self.mount_btrfs_root_volume()
-        new_root = os.path.join(mp, snapshot_name)
-        if (
-                os.path.isdir(new_root) and
-                snapshot_name.startswith("@") and
-                snapshot_name != "@"):
-            default_root = os.path.join(mp, "@")
-            backup = os.path.join(mp, self.BACKUP_PREFIX + self._get_now_str())
-            os.rename(default_root, backup)
-            os.rename(new_root, default_root)
-            print("Default changed to %s, please reboot for changes to take "
-                  "effect." % snapshot_name)
-        else:
-            print("You have selected an invalid snapshot. Please make sure "
-                  "that it exists, and that it is not \"@\".")
-        self.umount_btrfs_root_volume()
+        with self.session() as mp:
+            new_root = os.path.join(mp, snapshot_name)
+            if (
+                    os.path.isdir(new_root) and
+                    snapshot_name.startswith("@") and
+                    snapshot_name != "@"):
+                default_root = os.path.join(mp, "@")
+                backup = os.path.join(mp, self.BACKUP_PREFIX +
+                                      self._get_now_str())
+                os.rename(default_root, backup)
+                os.rename(new_root, default_root)
+                print("Default changed to %s, please reboot for changes to "
+                      "take effect." % snapshot_name)
+            else:
+                print("You have selected an invalid snapshot. Please make "
+                      "sure that it exists, and that it is not \"@\".")
         return True
 
     def delete_snapshot(self, snapshot_name):
-        mp = self.mount_btrfs_root_volume()
-        res = self.commands.btrfs_delete_snapshot(
-            os.path.join(mp, snapshot_name))
-        self.umount_btrfs_root_volume()
-        return res
+        return self.delete_snapshots([snapshot_name])
+
+    def delete_snapshots(self, snapshot_names):
+        """ delete the given snapshots with a single mount, in parallel """
+        if not snapshot_names:
+            return True
+        with self.session() as mp:
+            paths = [os.path.join(mp, name) for name in snapshot_names]
+            with ThreadPoolExecutor(self.DELETE_WORKERS) as pool:
+                return all(list(pool.map(self.commands.btrfs_delete_snapshot,
+                                         paths)))
@@ -24,7 +24,8 @@ import logging
 import json
 import os
 import stat
-import subprocess
+
+from .DistUpgradeSystemFacts import get_system_facts
 
 
 def get():
@@ -42,9 +43,8 @@ class _Telemetry():
         self._metrics = {}
         self._stages_hist = {}
         self._start_time = self._get_current_uptime()
-        self._metrics["From"] = subprocess.Popen(
-            ["lsb_release", "-r", "-s"], stdout=subprocess.PIPE,
-            universal_newlines=True).communicate()[0].strip()
+        self._metrics["From"] = get_system_facts().os_release.get(
+            "VERSION_ID", "")
         self.add_stage('start')
         self._dest_path = '/var/log/upgrade/telemetry'
         try:
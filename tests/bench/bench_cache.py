@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+"""
+Time the cache walking phases of the upgrader on synthetic systems.
+
+Run from the top of the source tree:
+
+  $ python3 tests/bench/bench_cache.py --scale 1000 --scale 10000 \\
+        --output bench.json
+
+Without --scale the 1k, 10k and 60k package systems are used. The
+result is a JSON document with the wall clock time (in seconds) of
+every phase per scale, so that the numbers of two upgrader tarballs
+can be compared. The number of log records and bytes every phase
+writes to main.log is reported as well.
+"""
+
+from __future__ import print_function
+
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.normpath(os.path.join(CURDIR, "..", ".."))
+sys.path.insert(0, TOPDIR)
+
+import apt_pkg
+
+from DistUpgrade import DistUpgradeConfigParser
+from DistUpgrade.DistUpgradeCache import (
+    MyCache, NotEnoughFreeSpaceError)
+from DistUpgrade.DistUpgradeConfigParser import DistUpgradeConfig
+from DistUpgrade.DistUpgradeMain import LOG_FORMAT
+from DistUpgrade.DistUpgradeQuirks import DistUpgradeQuirks
+from DistUpgrade.DistUpgradeVersion import VERSION
+from DistUpgrade.DistUpgradeView import DistUpgradeView
+
+from synthetic import SyntheticSystem
+
+DEFAULT_SCALES = (1000, 10000, 60000)
+
+
+class BenchController(object):
+    """ the bits of the controller that the quirks need """
+
+    def __init__(self, view, config):
+        self._view = view
+        self.config = config
+        self.cache = None
+        # the quirks do not run in partial upgrades
+        self._partialUpgrade = False
+        self.serverMode = False
+        self.fromDist = config.get("Sources", "From")
+        self.toDist = config.get("Sources", "To")
+
+
+class LogVolume(logging.Handler):
+    """ count the records and bytes that would end up in main.log """
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+        self.records = 0
+        self.bytes = 0
+
+    def emit(self, record):
+        self.records += 1
+        self.bytes += len(self.format(record).encode("utf-8")) + 1
+
+
+class Timer(object):
+    """ collect the wall clock time and log volume of the phases """
+
+    def __init__(self, volume):
+        self.results = {}
+        self.log = {}
+        self.volume = volume
+
+    def __call__(self, name, func, *args, **kwargs):
+        records = self.volume.records
+        size = self.volume.bytes
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.results[name] = round(time.perf_counter() - start, 4)
+            self.log[name] = {"records": self.volume.records - records,
+                              "bytes": self.volume.bytes - size}
+
+
+def setup_apt(system):
+    apt_pkg.init_config()
+    for (key, value) in system.apt_config().items():
+        apt_pkg.config.set(key, value)
+    apt_pkg.init_system()
+
+
+def open_cache(system, datadir, view):
+    config = DistUpgradeConfig(datadir)
+    config.set("Files", "LogDir",
+               os.path.join(system.rootdir, "var", "log", "dist-upgrade"))
+    config.add_section("Options")
+    config.set("Options", "withNetwork", "True")
+    config.set("Options", "devRelease", "False")
+    config.set("Options", "foreignPkgs", "False")
+    controller = BenchController(view, config)
+    quirks = DistUpgradeQuirks(controller, config)
+    cache = MyCache(config, view, quirks, lock=False)
+    controller.cache = cache
+    return cache
+
+
+def bench_scale(npkgs, datadir, workdir):
+    """ run all phases on a synthetic system with npkgs packages """
+    system = SyntheticSystem(os.path.join(workdir, str(npkgs)), npkgs)
+    volume = LogVolume()
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    root.addHandler(volume)
+    timer = Timer(volume)
+    timer("generate", system.create)
+    setup_apt(system)
+    view = DistUpgradeView()
+    cache = timer("open_cache", open_cache, system, datadir, view)
+    from_dist = cache.config.get("Sources", "From")
+    to_dist = cache.config.get("Sources", "To")
+    origin = cache.config.get("Sources", "ValidOrigin")
+
+    obsolete = timer("_getObsoletesPkgs", cache._getObsoletesPkgs)
+    foreign = timer("_getForeignPkgs", cache._getForeignPkgs,
+                    origin, from_dist, to_dist)
+    timer("installedTasks", lambda: cache.installedTasks)
+    timer("keep_installed_rule", cache.keep_installed_rule)
+    timer("distUpgrade", cache.distUpgrade, view, False, False)
+    changes = len(cache.get_changes())
+    try:
+        timer("checkFreeSpace", cache.checkFreeSpace)
+    except NotEnoughFreeSpaceError:
+        # the synthetic packages may not fit, the time still counts
+        pass
+
+    # the obsolete removal loop of DistUpgradeController.doPostUpgrade
+    def removal_loop():
+        remove_candidates = set(obsolete)
+        remove_candidates |= set(cache._getUnusedDependencies())
+        forced_obsoletes = cache.config.getlist("Distro", "ForcedObsoletes")
+        for pkgname in remove_candidates:
+            if pkgname not in foreign:
+                cache.tryMarkObsoleteForRemoval(
+                    pkgname, remove_candidates, forced_obsoletes, foreign)
+    cache.clear()
+    timer("doPostUpgrade_removal", removal_loop)
+
+    result = {"packages": len(cache),
+              "installed": npkgs,
+              "obsolete": len(obsolete),
+              "foreign": len(foreign),
+              "changes": changes,
+              "removals": len(cache.get_changes()),
+              "timings": timer.results,
+              "log": timer.log}
+    os.close(cache.logfd)
+    root.removeHandler(volume)
+    return result
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--scale", dest="scales", action="append", type="int",
+                      help="number of installed packages (repeatable)")
+    parser.add_option("--output", dest="output", default=None,
+                      help="write the JSON result to this file")
+    parser.add_option("--datadir", dest="datadir",
+                      default=os.path.join(TOPDIR, "data"),
+                      help="upgrader data dir with DistUpgrade.cfg")
+    parser.add_option("--keep", dest="keep", action="store_true",
+                      default=False,
+                      help="keep the generated systems")
+    (options, args) = parser.parse_args()
+    # only the configuration of the datadir
+    DistUpgradeConfigParser.CONFIG_OVERRIDE_DIR = None
+
+    workdir = tempfile.mkdtemp(prefix="upgrader-bench-")
+    report = {"version": VERSION,
+              "apt": apt_pkg.VERSION,
+              "python": platform.python_version(),
+              "workdir": workdir if options.keep else None,
+              "scales": {}}
+    try:
+        for npkgs in options.scales or DEFAULT_SCALES:
+            report["scales"][str(npkgs)] = bench_scale(
+                npkgs, options.datadir, workdir)
+    finally:
+        if not options.keep:
+            shutil.rmtree(workdir)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == "__main__":
+    main()
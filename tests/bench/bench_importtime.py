@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+"""
+Measure the import time of the upgrader modules with python -X importtime.
+
+Run from the top of the source tree:
+
+  $ python3 tests/bench/bench_importtime.py --output importtime.json
+
+Every module is imported in a fresh interpreter (--repeat times, the
+fastest run counts). The result is a JSON document with the cumulative
+import time of every module (in microseconds), the modules that took
+the longest themselves and whether a GUI toolkit got imported, which
+must not happen on the headless startup path.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import platform
+import subprocess
+import sys
+from optparse import OptionParser
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.normpath(os.path.join(CURDIR, "..", ".."))
+
+# the modules on the path to the first question on a server
+DEFAULT_MODULES = ("DistUpgrade.DistUpgradeMain",
+                   "DistUpgrade.DistUpgradeViewText",
+                   "DistUpgrade.DistUpgradeController")
+
+# imported only by the graphical views
+GUI_MODULES = ("gi", "PyQt5", "PyQt4")
+
+
+def parse_importtime(output):
+    """ return a dict module -> (self, cumulative) in microseconds
+        from the stderr of python -X importtime
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        try:
+            (own, cumulative) = (int(fields[0]), int(fields[1]))
+        except ValueError:
+            # the header line
+            continue
+        times[fields[2].strip()] = (own, cumulative)
+    return times
+
+
+def importtime(module, python=sys.executable):
+    """ import module in a new interpreter and return its import times """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [TOPDIR] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep)
+                    if p])
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", "import %s" % module],
+        cwd=TOPDIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    times = parse_importtime(proc.stderr)
+    if proc.returncode != 0 or module not in times:
+        # the last line of the traceback says what is missing
+        lines = proc.stderr.strip().splitlines()
+        raise ImportError(lines[-1] if lines else "import failed")
+    return times
+
+
+def bench_module(module, repeat, top):
+    best = None
+    for i in range(repeat):
+        times = importtime(module)
+        if best is None or times[module][1] < best[module][1]:
+            best = times
+    slowest = sorted(best.items(), key=lambda item: item[1][0],
+                     reverse=True)[:top]
+    return {"cumulative_us": best[module][1],
+            "modules": len(best),
+            "gui": sorted(m for m in best if m.split(".")[0] in GUI_MODULES),
+            "slowest": [{"module": name, "self_us": own, "cumulative_us": cum}
+                        for (name, (own, cum)) in slowest]}
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--module", dest="modules", action="append",
+                      help="module to import (repeatable)")
+    parser.add_option("--repeat", dest="repeat", type="int", default=5,
+                      help="imports per module, the fastest counts")
+    parser.add_option("--top", dest="top", type="int", default=10,
+                      help="number of slowest modules to report")
+    parser.add_option("--output", dest="output", default=None,
+                      help="write the JSON result to this file")
+    (options, args) = parser.parse_args()
+
+    report = {"python": platform.python_version(),
+              "modules": {}}
+    for module in options.modules or DEFAULT_MODULES:
+        try:
+            report["modules"][module] = bench_module(
+                module, options.repeat, options.top)
+        except ImportError as e:
+            report["modules"][module] = {"error": str(e)}
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == "__main__":
+    main()
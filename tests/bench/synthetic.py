@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+"""
+Generate synthetic systems for the benchmarks.
+
+A synthetic system is a directory with a dpkg status file, a
+sources.list and the Packages/Release files of the "to" release in
+the apt lists directory, so that apt can open it through Dir::State
+and Dir::Etc without any network access. The package set is
+deterministic for a given size and contains a mix of upgrades,
+obsolete packages, packages from a PPA, tasks and kernels so that all
+the cache walking code paths of the upgrader have something to do.
+"""
+
+import apt_pkg
+import os
+import random
+
+ARCHIVE = "http://archive.ubuntu.com/ubuntu"
+PPA = "http://ppa.launchpad.net/bench/ppa/ubuntu"
+ARCH = "amd64"
+
+# share of installed packages (in percent) with special treatment
+OBSOLETE_PERCENT = 2
+FOREIGN_PERCENT = 1
+TASKS = ("server", "standard", "cloud-image")
+
+
+def keep_apt_config(testcase, keys):
+    """ restore the apt configuration keys at the end of the test, the
+        keys that were not set before are cleared again
+    """
+    for key in keys:
+        if apt_pkg.config.exists(key):
+            testcase.addCleanup(apt_pkg.config.set, key,
+                                apt_pkg.config.find(key))
+        else:
+            testcase.addCleanup(apt_pkg.config.clear, key)
+
+
+def use_apt_config(testcase, config):
+    """ set the apt configuration until the end of the test """
+    # the dpkg status location is read when the system is set up
+    testcase.addCleanup(apt_pkg.init_system)
+    keep_apt_config(testcase, config)
+    for (key, value) in config.items():
+        apt_pkg.config.set(key, value)
+    apt_pkg.init_system()
+    # apt keeps the architectures of the process until a cache is built,
+    # the sources of that cache still use the old ones
+    apt_pkg.Cache(None)
+
+
+def _lists_name(uri, dist, path):
+    """ the filename apt uses in the lists dir for uri/dists/dist/path """
+    name = "%s/dists/%s/%s" % (uri.split("://", 1)[1], dist, path)
+    return name.replace("/", "_")
+
+
+def _stanza(name, version, depends=None, section="misc", task=None,
+            priority="optional", size=1024, status=None, arch=ARCH):
+    lines = ["Package: %s" % name]
+    if status:
+        lines.append("Status: %s" % status)
+    lines += ["Priority: %s" % priority,
+              "Section: %s" % section,
+              "Installed-Size: %d" % size,
+              "Maintainer: Ubuntu Developers <ubuntu-devel@lists.ubuntu.com>",
+              "Architecture: %s" % arch,
+              "Version: %s" % version]
+    if arch != ARCH:
+        lines.append("Multi-Arch: same")
+    if depends:
+        lines.append("Depends: %s" % ", ".join(depends))
+    if task:
+        lines.append("Task: %s" % task)
+    if not status:
+        lines += ["Filename: pool/main/b/%s/%s_%s_%s.deb" % (
+                  name, name, version, arch),
+                  "Size: %d" % (size * 512),
+                  "SHA256: %s" % ("0" * 64)]
+    lines.append("Description: synthetic package %s" % name)
+    return "\n".join(lines) + "\n\n"
+
+
+def _release(origin, suite, components):
+    return ("Origin: %s\nLabel: %s\nSuite: %s\nCodename: %s\n"
+            "Date: Thu, 14 Oct 2021 12:00:00 UTC\n"
+            "Architectures: %s\nComponents: %s\n"
+            "Description: synthetic %s\n" % (
+                origin, origin, suite, suite, ARCH,
+                " ".join(components), suite))
+
+
+class SyntheticSystem(object):
+    """ a synthetic apt/dpkg system with npkgs installed packages """
+
+    def __init__(self, rootdir, npkgs, from_dist="hirsute",
+                 to_dist="impish", seed=0, foreign_arch=None):
+        self.rootdir = rootdir
+        self.npkgs = npkgs
+        self.foreign_arch = foreign_arch
+        self.from_dist = from_dist
+        self.to_dist = to_dist
+        self.random = random.Random(seed)
+        self.etc = os.path.join(rootdir, "etc", "apt")
+        self.state = os.path.join(rootdir, "var", "lib", "apt")
+        self.lists = os.path.join(self.state, "lists")
+        self.status = os.path.join(rootdir, "var", "lib", "dpkg", "status")
+        self.cache = os.path.join(rootdir, "var", "cache", "apt")
+        self.obsolete = set()
+        self.foreign = set()
+
+    def _packages(self):
+        """ yield (name, depends, section, task, priority) """
+        # the packages the upgrader looks for explicitly
+        yield ("ubuntu-minimal", ["pkg-%05d" % 0], "metapackages",
+               None, "important")
+        yield ("ubuntu-standard", ["ubuntu-minimal"], "metapackages",
+               "standard", "important")
+        yield ("ubuntu-server", ["ubuntu-minimal"], "metapackages",
+               "server", "optional")
+        yield ("linux-generic", ["linux-image-generic"], "kernel",
+               None, "optional")
+        yield ("linux-image-generic", ["linux-image-5.13.0-19-generic"],
+               "kernel", None, "optional")
+        yield ("linux-image-5.13.0-19-generic", [], "kernel", None,
+               "optional")
+        for i in range(self.npkgs - 6):
+            name = "pkg-%05d" % i
+            depends = []
+            if i > 0:
+                for dep in self.random.sample(range(i), min(i, 3)):
+                    depends.append("pkg-%05d" % dep)
+            task = None
+            if i % 50 == 0:
+                task = TASKS[i % len(TASKS)]
+            section = ("libs", "utils", "net", "admin", "devel")[i % 5]
+            yield (name, depends, section, task, "optional")
+
+    def create(self):
+        for d in (self.etc, os.path.join(self.etc, "sources.list.d"),
+                  os.path.join(self.etc, "preferences.d"),
+                  os.path.join(self.lists, "partial"),
+                  os.path.join(self.cache, "archives", "partial"),
+                  os.path.dirname(self.status)):
+            os.makedirs(d, exist_ok=True)
+        with open(os.path.join(self.etc, "sources.list"), "w") as f:
+            f.write("deb %s %s main\n" % (ARCHIVE, self.to_dist))
+            f.write("deb %s %s main\n" % (PPA, self.to_dist))
+        status = open(self.status, "w")
+        archive = open(os.path.join(self.lists, _lists_name(
+            ARCHIVE, self.to_dist, "main/binary-%s/Packages" % ARCH)), "w")
+        ppa = open(os.path.join(self.lists, _lists_name(
+            PPA, self.to_dist, "main/binary-%s/Packages" % ARCH)), "w")
+        with status, archive, ppa:
+            for (name, depends, section, task, prio) in self._packages():
+                size = self.random.randint(16, 4096)
+                status.write(_stanza(name, "1.0-1", depends, section, task,
+                                     prio, size,
+                                     status="install ok installed"))
+                roll = self.random.randint(0, 99)
+                if name.startswith("pkg-") and roll < OBSOLETE_PERCENT:
+                    # not in the new release anymore
+                    self.obsolete.add(name)
+                    continue
+                if (name.startswith("pkg-") and
+                        roll < OBSOLETE_PERCENT + FOREIGN_PERCENT):
+                    self.foreign.add(name)
+                    ppa.write(_stanza(name, "1.0-1ppa1", depends, section,
+                                      task, prio, size))
+                    continue
+                archive.write(_stanza(name, "1.0-2", depends, section, task,
+                                      prio, size))
+            if self.foreign_arch:
+                self._add_foreign_arch(status, archive)
+        for (uri, origin) in ((ARCHIVE, "Ubuntu"), (PPA, "LP-PPA-bench")):
+            path = os.path.join(
+                self.lists, _lists_name(uri, self.to_dist, "Release"))
+            with open(path, "w") as f:
+                f.write(_release(origin, self.to_dist, ["main"]))
+        return self
+
+    def _add_foreign_arch(self, status, archive):
+        """ libmulti is installed for both architectures but only the
+            native one is still available, libgone is only installed
+            for the foreign architecture and is gone
+        """
+        arch = self.foreign_arch
+        status.write(_stanza("libmulti", "1.0-1", section="libs",
+                             status="install ok installed"))
+        archive.write(_stanza("libmulti", "1.0-2", section="libs"))
+        for name in ("libmulti", "libgone"):
+            status.write(_stanza(name, "1.0-1", section="libs",
+                                 status="install ok installed", arch=arch))
+            self.obsolete.add("%s:%s" % (name, arch))
+
+    def apt_config(self):
+        """ the apt configuration to open this system """
+        return {"Dir::Etc": self.etc,
+                "Dir::Etc::sourcelist": os.path.join(self.etc,
+                                                     "sources.list"),
+                "Dir::Etc::sourceparts": os.path.join(self.etc,
+                                                      "sources.list.d"),
+                "Dir::Etc::preferencesparts": os.path.join(self.etc,
+                                                           "preferences.d"),
+                "Dir::State": self.state,
+                "Dir::State::lists": self.lists,
+                "Dir::State::status": self.status,
+                "Dir::Cache": self.cache,
+                "Dir::Cache::pkgcache": "",
+                "Dir::Cache::srcpkgcache": "",
+                "APT::Architecture": ARCH,
+                "APT::Architectures": ",".join(
+                    a for a in (ARCH, self.foreign_arch) if a),
+                "Acquire::AllowInsecureRepositories": "true"}
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from DistUpgrade.apt_btrfs_snapshot import (
+    AptBtrfsRootWithNoatimeError,
+    AptBtrfsSnapshot,
+    AptBtrfsSnapshotError,
+    parse_subvolume_list,
+)
+
+
+class FakeCommands(object):
+    """ a btrfs root volume in a directory """
+
+    def __init__(self, volume, otimes):
+        self.volume = volume
+        self.otimes = otimes
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _call(self, *args):
+        with self.lock:
+            self.calls.append(args)
+
+    def mount(self, fs_spec, mountpoint):
+        self._call("mount", fs_spec)
+        os.rmdir(mountpoint)
+        os.symlink(self.volume, mountpoint)
+        return True
+
+    def umount(self, mountpoint):
+        self._call("umount")
+        os.unlink(mountpoint)
+        os.mkdir(mountpoint)
+        return True
+
+    def btrfs_subvolume_list(self, mountpoint):
+        self._call("list")
+        if self.otimes is None:
+            return None
+        return "".join(
+            "ID %d gen 1 cgen 1 top level 5 otime %s path %s\n" % (
+                i, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+                if t else "-", name)
+            for (i, (name, t)) in enumerate(sorted(self.otimes.items())))
+
+    def btrfs_delete_snapshot(self, snapshot):
+        self._call("delete", os.path.basename(snapshot))
+        shutil.rmtree(os.path.realpath(snapshot))
+        return True
+
+
+class TestAptBtrfsSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.volume = os.path.join(self.tmpdir, "volume")
+        self.fstab = os.path.join(self.tmpdir, "fstab")
+        self.write_fstab("defaults,subvol=@")
+        now = time.time()
+        self.otimes = {}
+        for i in range(20):
+            name = "@apt-snapshot-release-upgrade-%02d" % i
+            os.makedirs(os.path.join(self.volume, name, "etc"))
+            open(os.path.join(self.volume, name, "etc", "fstab"),
+                 "w").close()
+            # one snapshot a day
+            self.otimes[name] = now - i * 24 * 60 * 60 - 60
+        os.makedirs(os.path.join(self.volume, "@", "etc"))
+
+    def write_fstab(self, options):
+        with open(self.fstab, "w") as f:
+            f.write("UUID=abc / btrfs %s 0 1\n" % options)
+
+    def snapshot(self, otimes):
+        apt_btrfs = AptBtrfsSnapshot(fstab=self.fstab)
+        apt_btrfs.commands = FakeCommands(self.volume, otimes)
+        return apt_btrfs
+
+    def test_parse_subvolume_list(self):
+        self.assertEqual(parse_subvolume_list(
+            "ID 256 gen 9 cgen 9 top level 5 otime - path @\n"
+            "ID 257 gen 8 cgen 8 top level 5 otime 2021-10-14 10:29:19 "
+            "path @apt-snapshot-with space\n"
+            "garbage\n"), {
+                "@": None,
+                "@apt-snapshot-with space": time.mktime(
+                    (2021, 10, 14, 10, 29, 19, 0, 0, -1))})
+
+    def test_clean_in_one_session(self):
+        apt_btrfs = self.snapshot(self.otimes)
+        self.assertTrue(apt_btrfs.clean_btrfs_root_snapshots_older_than("5d"))
+        remaining = sorted(e for e in os.listdir(self.volume)
+                           if e != "@")
+        self.assertEqual(remaining, sorted(self.otimes)[:5])
+        calls = apt_btrfs.commands.calls
+        self.assertEqual(calls[:2], [("mount", "UUID=abc"), ("list",)])
+        self.assertEqual(calls[-1], ("umount",))
+        self.assertEqual(sorted(c[1] for c in calls[2:-1]),
+                         sorted(self.otimes)[5:])
+        self.assertTrue(all(c[0] == "delete" for c in calls[2:-1]))
+        self.assertIsNone(apt_btrfs._btrfs_root_mountpoint)
+
+    def test_atime_fallback(self):
+        # without creation times the atime of etc/fstab is used
+        old = sorted(self.otimes)[-1]
+        atime = time.time() - 30 * 24 * 60 * 60
+        os.utime(os.path.join(self.volume, old, "etc", "fstab"),
+                 (atime, atime))
+        apt_btrfs = self.snapshot(None)
+        self.assertEqual(
+            apt_btrfs.get_btrfs_root_snapshots_list(
+                older_than=time.time() - 10 * 24 * 60 * 60), [old])
+        self.write_fstab("noatime,subvol=@")
+        apt_btrfs = self.snapshot(None)
+        self.assertRaises(AptBtrfsRootWithNoatimeError,
+                          apt_btrfs.get_btrfs_root_snapshots_list,
+                          older_than=time.time())
+        # creation times do not need atime
+        apt_btrfs = self.snapshot(self.otimes)
+        self.assertEqual(len(apt_btrfs.get_btrfs_root_snapshots_list(
+            older_than=time.time())), 20)
+
+    def test_nested_session(self):
+        apt_btrfs = self.snapshot(self.otimes)
+        with apt_btrfs.session() as mp:
+            self.assertTrue(apt_btrfs.delete_snapshot(sorted(self.otimes)[0]))
+            apt_btrfs.get_btrfs_root_snapshots_list()
+            self.assertEqual(apt_btrfs._btrfs_root_mountpoint, mp)
+        self.assertEqual([c[0] for c in apt_btrfs.commands.calls],
+                         ["mount", "delete", "list", "umount"])
+
+    def test_mount_failure(self):
+        apt_btrfs = self.snapshot(self.otimes)
+        apt_btrfs.commands.mount = lambda fs_spec, mountpoint: False
+        with self.assertRaises(AptBtrfsSnapshotError):
+            apt_btrfs.delete_snapshot(sorted(self.otimes)[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from mock import patch
+
+from DistUpgrade import DistUpgradeConfigParser
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(CURDIR, "bench"))
+
+import bench_cache
+from synthetic import keep_apt_config, use_apt_config
+
+
+class TestBenchCache(unittest.TestCase):
+    """ the cache benchmark runs through on a small system """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.addCleanup(setattr, DistUpgradeConfigParser,
+                        "CONFIG_OVERRIDE_DIR",
+                        DistUpgradeConfigParser.CONFIG_OVERRIDE_DIR)
+        DistUpgradeConfigParser.CONFIG_OVERRIDE_DIR = None
+        root = logging.getLogger()
+        self.addCleanup(root.setLevel, root.level)
+
+    def setup_apt(self, system):
+        # instead of resetting the apt configuration of the process
+        use_apt_config(self, system.apt_config())
+        # set by the cache
+        keep_apt_config(self, ["Dir::Log", "Dir::Log::Terminal"])
+
+    def test_bench_scale(self):
+        with patch.object(bench_cache, "setup_apt", self.setup_apt):
+            result = bench_cache.bench_scale(
+                300, os.path.join(bench_cache.TOPDIR, "data"), self.tmpdir)
+        self.assertEqual(result["installed"], 300)
+        self.assertEqual(result["packages"], 300)
+        self.assertTrue(result["obsolete"])
+        self.assertTrue(result["changes"])
+        phases = set(["generate", "open_cache", "_getObsoletesPkgs",
+                      "_getForeignPkgs", "installedTasks",
+                      "keep_installed_rule", "distUpgrade",
+                      "checkFreeSpace", "doPostUpgrade_removal"])
+        self.assertEqual(set(result["timings"]), phases)
+        self.assertEqual(set(result["log"]), phases)
+        for volume in result["log"].values():
+            self.assertEqual(set(volume), set(["records", "bytes"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from DistUpgrade.DistUpgradeConffiles import (
+    ConffileScan,
+    parse_conffiles,
+)
+
+STATUS = """Package: foo
+Status: install ok installed
+Version: 1.0
+Conffiles:
+ /etc/foo/unchanged.conf %(unchanged)s
+ /etc/foo/modified.conf %(unchanged)s
+ /etc/foo/deleted.conf %(unchanged)s
+ /etc/foo/old.conf %(unchanged)s obsolete
+
+Package: bar
+Status: install ok installed
+Version: 1.0
+Conffiles:
+ /etc/bar.conf %(unchanged)s
+
+Package: baz
+Status: install ok installed
+Version: 1.0
+Conffiles:
+ /etc/baz.conf %(unchanged)s
+"""
+
+
+class TestConffileScan(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        content = b"option = 1\n"
+        self.status = os.path.join(self.root, "status")
+        with open(self.status, "w") as f:
+            f.write(STATUS % {"unchanged": hashlib.md5(content).hexdigest()})
+        os.makedirs(os.path.join(self.root, "etc", "foo"))
+        for (name, data) in (("foo/unchanged.conf", content),
+                             ("foo/modified.conf", b"option = 2\n"),
+                             ("foo/old.conf", b"option = 2\n"),
+                             ("bar.conf", content),
+                             ("baz.conf", b"option = 2\n")):
+            with open(os.path.join(self.root, "etc", name), "wb") as f:
+                f.write(data)
+
+    def test_parse_conffiles(self):
+        self.assertEqual(
+            parse_conffiles("\n /etc/a 123\n /etc/b 456 obsolete\n"
+                            " /etc/c newconffile\n"),
+            [("/etc/a", "123")])
+
+    def test_scan(self):
+        # baz is not upgraded
+        scan = ConffileScan(["foo", "bar", "not-installed"],
+                            status_file=self.status, root=self.root)
+        self.assertEqual(scan.start().result(),
+                         {"/etc/foo/modified.conf": "foo"})
+        self.assertTrue(scan.done())
+
+
+if __name__ == "__main__":
+    unittest.main()
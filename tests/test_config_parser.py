@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from DistUpgrade import DistUpgradeConfigParser
+from DistUpgrade.DistUpgradeConfigParser import (
+    DistUpgradeConfig,
+    distro_codename,
+    get_config,
+    read_os_release,
+)
+
+DistUpgradeConfigParser.CONFIG_OVERRIDE_DIR = None
+
+
+class TestConfigParser(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        with open(os.path.join(self.tmpdir, "DistUpgrade.cfg"), "w") as f:
+            f.write("[Distro]\n"
+                    "MetaPkgs=ubuntu-desktop, kubuntu-desktop\n"
+                    "RemovalBlacklistFile=removal_blacklist.cfg\n")
+        with open(os.path.join(self.tmpdir, "removal_blacklist.cfg"),
+                  "w") as f:
+            f.write("# comment\nubuntu-minimal\n\nlinux-.*\n")
+
+    def test_os_release(self):
+        path = os.path.join(self.tmpdir, "os-release")
+        with open(path, "w") as f:
+            f.write('NAME="Ubuntu"\n'
+                    '# a comment\n'
+                    'PRETTY_NAME="Ubuntu 21.04"\n'
+                    'VERSION_CODENAME=hirsute\n'
+                    "UBUNTU_CODENAME='hirsute'\n")
+        result = read_os_release([os.path.join(self.tmpdir, "missing"),
+                                  path])
+        self.assertEqual(result["PRETTY_NAME"], "Ubuntu 21.04")
+        self.assertEqual(result["UBUNTU_CODENAME"], "hirsute")
+        self.assertEqual(distro_codename([path]), "hirsute")
+        # xenial only has UBUNTU_CODENAME
+        with open(path, "w") as f:
+            f.write('NAME="Ubuntu"\nUBUNTU_CODENAME=xenial\n')
+        self.assertEqual(distro_codename([path]), "xenial")
+
+    def test_cached_lists(self):
+        config = DistUpgradeConfig(self.tmpdir)
+        metapkgs = config.getlist("Distro", "MetaPkgs")
+        self.assertEqual(metapkgs, ["ubuntu-desktop", "kubuntu-desktop"])
+        # the caller owns the list it got
+        metapkgs.append("xubuntu-desktop")
+        self.assertEqual(config.getlist("Distro", "MetaPkgs"),
+                         ["ubuntu-desktop", "kubuntu-desktop"])
+        self.assertEqual(
+            config.getListFromFile("Distro", "RemovalBlacklistFile"),
+            ["ubuntu-minimal", "linux-.*"])
+        self.assertEqual(config.getlist("Distro", "Missing"), [])
+        # changes invalidate the cache
+        config.set("Distro", "MetaPkgs", "lubuntu-desktop")
+        self.assertEqual(config.getlist("Distro", "MetaPkgs"),
+                         ["lubuntu-desktop"])
+        config.read_string("[Distro]\nMetaPkgs=ubuntu-desktop\n")
+        self.assertEqual(config.getlist("Distro", "MetaPkgs"),
+                         ["ubuntu-desktop"])
+        config.remove_option("Distro", "MetaPkgs")
+        self.assertEqual(config.getlist("Distro", "MetaPkgs"), [])
+
+    def test_shared_config(self):
+        config = get_config(self.tmpdir)
+        self.assertIs(config, get_config(self.tmpdir + "/"))
+        self.assertIsNot(config, DistUpgradeConfig(self.tmpdir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt
+import apt_pkg
+import os
+import tempfile
+import unittest
+
+import mock
+
+from DistUpgrade.DistUpgradeCache import MyCache, TriggerLog
+
+
+class TestDeferredTriggers(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.log) = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.log)
+        with open(self.log, "w") as f:
+            f.write("2021-10-19 10:00:00 trigproc man-db:amd64 2.9.4 "
+                    "<none>\n")
+
+    def _log(self, *lines):
+        with open(self.log, "a") as f:
+            for line in lines:
+                f.write("2021-10-19 10:00:01 %s\n" % line)
+
+    def test_trigger_log(self):
+        trigger_log = TriggerLog(self.log)
+        self.assertEqual(trigger_log.count(), 0)
+        self._log("status unpacked libc-bin:amd64 2.34-0ubuntu3",
+                  "trigproc libc-bin:amd64 2.34-0ubuntu3 <none>",
+                  "status half-configured libc-bin:amd64 2.34-0ubuntu3",
+                  "trigproc man-db:amd64 2.9.4-2 <none>")
+        self.assertEqual(trigger_log.count(), 2)
+        self.assertEqual(TriggerLog(self.log + ".missing").count(), 0)
+
+    def _commit(self, defer):
+        cache = mock.Mock()
+        cache.lock = False
+        cache.config.getWithDefault.return_value = defer
+        seen = {}
+
+        def commit(cache, fprogress, iprogress):
+            for key in ("DPkg::NoTriggers", "DPkg::ConfigurePending"):
+                seen[key] = apt_pkg.config.find_b(key, False)
+            self._log("trigproc libc-bin:amd64 2.34-0ubuntu3 <none>")
+        with mock.patch.object(apt.Cache, "commit", commit), \
+                mock.patch("DistUpgrade.DistUpgradeCache.DPKG_LOG",
+                           self.log), \
+                self.assertLogs(level="INFO") as logs:
+            MyCache.commit(cache, None, None)
+        # only the trigger run of this commit is counted
+        self.assertIn("cache.commit() ran 1 triggers", "\n".join(logs.output))
+        return (cache, seen)
+
+    def test_commit_deferred(self):
+        apt_pkg.config.set("DPkg::ConfigurePending", "false")
+        self.addCleanup(apt_pkg.config.clear, "DPkg::ConfigurePending")
+        (cache, seen) = self._commit(True)
+        self.assertEqual(seen, {"DPkg::NoTriggers": True,
+                                "DPkg::ConfigurePending": True})
+        cache._run_pending_triggers.assert_called_once_with()
+        # the configuration is back to what it was
+        self.assertEqual(apt_pkg.config.get("DPkg::NoTriggers"), "")
+        self.assertEqual(apt_pkg.config.get("DPkg::ConfigurePending"),
+                         "false")
+
+    def test_commit_not_deferred(self):
+        (cache, seen) = self._commit(False)
+        self.assertFalse(seen["DPkg::NoTriggers"])
+        self.assertFalse(cache._run_pending_triggers.called)
+
+
+if __name__ == "__main__":
+    unittest.main()
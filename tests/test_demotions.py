@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import gzip
+import hashlib
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+
+spec = importlib.util.spec_from_file_location(
+    "demotions", os.path.join(CURDIR, "..", "utils", "demotions.py"))
+demotions = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(demotions)
+
+
+class TestDemotions(unittest.TestCase):
+
+    def setUp(self):
+        self.mirror = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.mirror)
+
+    def make_dist(self, dist, comps):
+        """ comps is {comp: {arch: "Packages content"}} """
+        sha256 = []
+        for (comp, arches) in comps.items():
+            for (arch, content) in arches.items():
+                path = "%s/binary-%s/Packages.gz" % (comp, arch)
+                full = os.path.join(self.mirror, "dists", dist, path)
+                os.makedirs(os.path.dirname(full))
+                with gzip.open(full, "wb") as f:
+                    f.write(content.encode("utf-8"))
+                with open(full, "rb") as f:
+                    data = f.read()
+                sha256.append(" %s %s %s" % (
+                    hashlib.sha256(data).hexdigest(), len(data), path))
+        with open(os.path.join(self.mirror, "dists", dist, "Release"),
+                  "w") as f:
+            f.write("Suite: %s\nSHA256:\n%s\n" % (dist, "\n".join(sha256)))
+
+    @staticmethod
+    def packages(*stanzas):
+        return "\n".join("Package: %s\n" % s for s in stanzas)
+
+    def test_find_demotions(self):
+        empty = {"i386": "", "amd64": ""}
+        self.make_dist("hirsute", {
+            "main": {"i386": self.packages("bash", "gaim", "moved"),
+                     "amd64": self.packages("bash", "gaim", "moved",
+                                            "amd64-only")},
+            "restricted": {"i386": self.packages("firmware"),
+                           "amd64": self.packages("firmware")}})
+        self.make_dist("impish", {
+            "main": {"i386": self.packages("bash",
+                                           "pidgin\nReplaces: gaim (<< 2)"),
+                     "amd64": self.packages("bash")},
+            "restricted": empty,
+            "universe": {"i386": self.packages("gaim", "moved"),
+                         "amd64": self.packages("gaim", "moved",
+                                                "amd64-only")},
+            "multiverse": {"i386": self.packages("firmware"),
+                           "amd64": self.packages("firmware")}})
+        self.assertEqual(
+            demotions.find_demotions("hirsute", "impish",
+                                     "file://%s" % self.mirror,
+                                     ["i386", "amd64"], keyring=""),
+            ["amd64-only", "firmware", "moved"])
+
+    def test_hash_mismatch(self):
+        self.make_dist("impish", {"main": {"amd64": self.packages("bash")}})
+        path = os.path.join(self.mirror, "dists", "impish", "main",
+                            "binary-amd64", "Packages.gz")
+        with gzip.open(path, "wb") as f:
+            f.write(b"Package: evil\n")
+        release = demotions.read_release(self.mirror, "impish", "",
+                                         self.mirror)
+        with self.assertRaises(IOError):
+            demotions.fetch_index(self.mirror, "impish", "main", "amd64",
+                                  release, self.mirror)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt
+import io
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import unittest
+
+from mock import Mock, patch
+
+from DistUpgrade import DistUpgradeFetcherCore as fetcher_core
+from DistUpgrade.DistUpgradeFetcherCore import (
+    BackgroundAcquireProgress,
+    DistUpgradeFetcherCore,
+    verify_signature,
+)
+
+
+class RecordingProgress(apt.progress.base.AcquireProgress):
+
+    def __init__(self):
+        apt.progress.base.AcquireProgress.__init__(self)
+        self.calls = []
+
+    def start(self):
+        self.calls.append("start")
+
+    def pulse(self, owner):
+        self.calls.append(("pulse", self.current_bytes))
+        return True
+
+    def stop(self):
+        self.calls.append("stop")
+
+
+class MockDist(object):
+    name = "impish"
+    upgradeTool = "http://archive.ubuntu.com/ubuntu/impish.tar.gz"
+    upgradeToolSig = "http://archive.ubuntu.com/ubuntu/impish.tar.gz.gpg"
+    releaseNotesURI = None
+
+
+class PipelineFetcher(DistUpgradeFetcherCore):
+    """ a fetcher that "downloads" while the release notes are shown """
+
+    def __init__(self, progress, accept=True):
+        self.new_dist = MockDist()
+        self.current_dist_name = "hirsute"
+        self._progress = progress
+        self.run_options = []
+        self.tmpdir = None
+        self._prefetch = None
+        self._prefetch_result = False
+        self.accept = accept
+        self.notes_shown = threading.Event()
+        self.events = []
+
+    def _fetch(self, progress):
+        self.events.append(("fetch", progress.__class__.__name__))
+        # only finish once the release notes are up
+        self.notes_shown.wait(5)
+        progress.start()
+        progress.current_bytes = 42
+        progress.pulse(None)
+        progress.stop()
+        self.uri = self.new_dist.upgradeTool
+        return True
+
+    def showReleaseNotes(self):
+        self.events.append("notes")
+        self.notes_shown.set()
+        return self.accept
+
+    def authenticate(self):
+        self.events.append("authenticate")
+        return True
+
+    def extractDistUpgrader(self):
+        self.events.append("extract")
+        return True
+
+    def verifyDistUprader(self):
+        self.events.append("verify")
+        return False
+
+    def error(self, summary, message):
+        return False
+
+
+class TestFetcherPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+
+    def test_background_progress_replay(self):
+        progress = RecordingProgress()
+        background = BackgroundAcquireProgress(progress)
+        background.start()
+        background.current_bytes = 10
+        self.assertTrue(background.pulse(None))
+        background.stop()
+        self.assertEqual(progress.calls, [])
+        # a finished download is replayed
+        background.attach()
+        self.assertEqual(progress.calls, ["start", ("pulse", 10), "stop"])
+
+    def test_background_progress_cancel(self):
+        progress = RecordingProgress()
+        background = BackgroundAcquireProgress(progress)
+        background.start()
+        background.cancel()
+        self.assertFalse(background.pulse(None))
+        self.assertFalse(background.media_change("disk", "/dev/sr0"))
+
+    def test_download_during_release_notes(self):
+        progress = RecordingProgress()
+        fetcher = PipelineFetcher(progress)
+        fetcher.run()
+        # the download starts without waiting for the release notes
+        self.assertCountEqual(fetcher.events[:2],
+                              [("fetch", "BackgroundAcquireProgress"),
+                               "notes"])
+        self.assertEqual(fetcher.events[2:],
+                         ["authenticate", "extract", "verify"])
+        self.assertEqual(progress.calls, ["start", ("pulse", 42), "stop"])
+
+    def test_release_notes_declined(self):
+        fetcher = PipelineFetcher(RecordingProgress(), accept=False)
+        fetcher.run()
+        self.assertIsNone(fetcher.tmpdir)
+        self.assertNotIn("authenticate", fetcher.events)
+
+    def test_extract_single_pass(self):
+        fetcher = PipelineFetcher(None)
+        fetcher.tmpdir = self.tmpdir
+        fetcher.uri = "http://example.com/impish.tar.gz"
+        with tarfile.open(os.path.join(self.tmpdir, "impish.tar.gz"),
+                          "w:gz") as tar:
+            for (name, mode) in (("impish", 0o755), ("DistUpgrade.cfg",
+                                                     0o644)):
+                data = ("content of %s\n" % name).encode()
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = mode
+                tar.addfile(info, io.BytesIO(data))
+        self.assertTrue(DistUpgradeFetcherCore.extractDistUpgrader(fetcher))
+        script = os.path.join(self.tmpdir, "impish")
+        self.assertTrue(os.access(script, os.X_OK))
+        with open(os.path.join(self.tmpdir, "DistUpgrade.cfg")) as f:
+            self.assertEqual(f.read(), "content of DistUpgrade.cfg\n")
+        # a broken tarball is reported
+        with open(os.path.join(self.tmpdir, "impish.tar.gz"), "wb") as f:
+            f.write(b"not a tarball")
+        self.assertFalse(DistUpgradeFetcherCore.extractDistUpgrader(fetcher))
+
+    @unittest.skipIf(shutil.which("gpg") is None, "needs gpg")
+    def test_verify_signature(self):
+        home = os.path.join(self.tmpdir, "gnupg")
+        os.mkdir(home, 0o700)
+        gpg = ["gpg", "--homedir", home, "--batch", "--quiet"]
+        subprocess.check_call(
+            gpg + ["--passphrase", "", "--quick-gen-key",
+                   "Test Archive <test@example.com>", "ed25519", "sign"],
+            stderr=subprocess.DEVNULL)
+        keyring = os.path.join(self.tmpdir, "keyring.gpg")
+        subprocess.check_call(gpg + ["--output", keyring, "--export"])
+        tarball = os.path.join(self.tmpdir, "impish.tar.gz")
+        with open(tarball, "w") as f:
+            f.write("upgrader\n")
+        subprocess.check_call(gpg + ["--detach-sign", tarball])
+        signature = tarball + ".sig"
+        self.assertTrue(verify_signature(tarball, signature, keyring))
+        # once more with the cached keyring
+        self.assertTrue(verify_signature(tarball, signature, keyring))
+        with open(tarball, "a") as f:
+            f.write("tampered\n")
+        self.assertFalse(verify_signature(tarball, signature, keyring))
+        # the wrong keyring
+        self.assertFalse(verify_signature(
+            tarball, signature, fetcher_core.DEFAULT_KEYRING))
+
+    def test_gpgme_result_checked(self):
+        """ only signatures that gpgme reports as valid are accepted
+            without gpgv
+        """
+        VALID = 1
+        good = Mock(status=0, summary=VALID)
+        ctx = Mock()
+        tarball = os.path.join(self.tmpdir, "impish.tar.gz")
+        for path in (tarball, tarball + ".gpg"):
+            with open(path, "w") as f:
+                f.write("data\n")
+        for (signatures, expected) in (
+                ([good], True),
+                ([], False),
+                ([good, Mock(status=9, summary=VALID)], False),
+                ([Mock(status=0, summary=0)], False)):
+            ctx.verify.return_value = (b"", Mock(signatures=signatures))
+            with patch.object(fetcher_core, "gpg") as gpg, \
+                    patch.object(fetcher_core, "_gpg_context",
+                                 return_value=ctx), \
+                    patch.object(fetcher_core.subprocess, "call",
+                                 return_value=1) as gpgv:
+                gpg.constants.sigsum.VALID = VALID
+                self.assertEqual(
+                    verify_signature(tarball, tarball + ".gpg", "keyring"),
+                    expected)
+                # everything but a valid signature is left to gpgv
+                self.assertEqual(gpgv.called, not expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
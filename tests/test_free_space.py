@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from mock import Mock, call
+
+from DistUpgrade import DistUpgradeConfigParser
+from DistUpgrade.DistUpgradeCache import NotEnoughFreeSpaceError
+from DistUpgrade.DistUpgradeSystemFacts import Mount
+from DistUpgrade.DistUpgradeView import DistUpgradeView
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(CURDIR, "bench"))
+
+from bench_cache import TOPDIR, open_cache
+from synthetic import SyntheticSystem, keep_apt_config, use_apt_config
+
+
+class TestFreeSpace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.addCleanup(setattr, DistUpgradeConfigParser,
+                        "CONFIG_OVERRIDE_DIR",
+                        DistUpgradeConfigParser.CONFIG_OVERRIDE_DIR)
+        DistUpgradeConfigParser.CONFIG_OVERRIDE_DIR = None
+        system = SyntheticSystem(self.tmpdir, 100).create()
+        use_apt_config(self, system.apt_config())
+        # set by the cache
+        keep_apt_config(self, ["Dir::Log", "Dir::Log::Terminal"])
+        self.cache = open_cache(system, os.path.join(TOPDIR, "data"),
+                                DistUpgradeView())
+        self.addCleanup(os.close, self.cache.logfd)
+
+    def test_mounts_read_again(self):
+        facts = Mock()
+        facts.mounts = [Mount("/dev/sda2", "/", "ext4", ("rw",))]
+        self.cache.facts = facts
+        try:
+            self.cache.checkFreeSpace()
+        except NotEnoughFreeSpaceError:
+            pass
+        # the mount table of an earlier check is not used
+        self.assertEqual(facts.mock_calls[0], call.forget("mounts"))
+
+
+if __name__ == "__main__":
+    unittest.main()
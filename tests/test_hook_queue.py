@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+from DistUpgrade.DistUpgradeHookQueue import (
+    HookQueue,
+    QUEUE_ENV,
+    RESTART_QUEUE_ENV,
+    RestartQueue,
+)
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+IMPORTED = os.path.join(CURDIR, "..", "DistUpgrade", "imported")
+
+
+class TestHookQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.addCleanup(os.environ.pop, QUEUE_ENV, None)
+        # a fake update-initramfs behind the wrapper
+        self.bindir = os.path.join(self.tmpdir, "bin")
+        os.mkdir(self.bindir)
+        self.real_log = os.path.join(self.tmpdir, "real.log")
+        script = os.path.join(self.bindir, "update-initramfs")
+        with open(script, "w") as f:
+            f.write("#!/bin/sh\necho \"$@\" >> %s\n" % self.real_log)
+        os.chmod(script, 0o755)
+        self.queue = HookQueue(os.path.join(self.tmpdir, "hook-queue"))
+
+    def _hook(self, *args):
+        # the queue is passed on like to dpkg and its maintainer scripts
+        env = dict(os.environ)
+        env["PATH"] = "%s:%s:%s" % (os.path.abspath(IMPORTED), self.bindir,
+                                    os.environ["PATH"])
+        return subprocess.call(["update-initramfs"] + list(args), env=env,
+                               stdout=subprocess.DEVNULL)
+
+    def _real_calls(self):
+        if not os.path.exists(self.real_log):
+            return []
+        with open(self.real_log) as f:
+            return f.read().splitlines()
+
+    def test_passthrough(self):
+        self.assertEqual(self._hook("-u"), 0)
+        self.assertEqual(self._real_calls(), ["-u"])
+
+    def test_coalesce(self):
+        self.queue.enable()
+        for args in (("-u",), ("-c", "-k", "5.13.0-19-generic"), ("-u",),
+                     ("-c", "-k", "5.13.0-20-generic")):
+            self.assertEqual(self._hook(*args), 0)
+        self.assertEqual(self._real_calls(), [])
+        self.assertEqual(self.queue.pending(), [
+            (("update-initramfs", "-c", "-k", "5.13.0-19-generic"), 1),
+            (("update-initramfs", "-u"), 2),
+            (("update-initramfs", "-c", "-k", "5.13.0-20-generic"), 1)])
+        call = mock.Mock(return_value=0)
+        self.assertEqual(self.queue.replay(call), [])
+        self.assertEqual(call.call_args_list, [
+            mock.call(["update-initramfs", "-c", "-k", "5.13.0-19-generic"]),
+            mock.call(["update-initramfs", "-u"]),
+            mock.call(["update-initramfs", "-c", "-k", "5.13.0-20-generic"])])
+        self.assertNotIn(QUEUE_ENV, os.environ)
+        self.assertFalse(os.path.exists(self.queue.path))
+
+    def test_replay_failures(self):
+        self.queue.enable()
+        self._hook("-u")
+        self._hook("-c", "-k", "5.13.0-20-generic")
+        call = mock.Mock(side_effect=[1, OSError("not found")])
+        with self.assertLogs(level="ERROR"):
+            failed = self.queue.replay(call)
+        self.assertEqual([argv for (argv, res) in failed],
+                         [("update-initramfs", "-u"),
+                          ("update-initramfs", "-c", "-k",
+                           "5.13.0-20-generic")])
+        self.assertEqual(failed[0][1], 1)
+
+    def test_unrecordable_arguments(self):
+        self.queue.enable()
+        self.assertEqual(self._hook("-b", "a\tb"), 0)
+        self.assertEqual(self._real_calls(), ["-b a\tb"])
+        self.assertEqual(self.queue.pending(), [])
+
+
+class TestRestartQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.addCleanup(os.environ.pop, RESTART_QUEUE_ENV, None)
+        self.queue = RestartQueue(os.path.join(self.tmpdir, "queue"), 2)
+
+    def _queue(self, *lines):
+        # what invoke-rc.d does
+        with open(os.environ[RESTART_QUEUE_ENV], "a") as f:
+            for line in lines:
+                f.write(line + "\n")
+
+    def test_pending(self):
+        self.queue.enable()
+        self._queue("try-restart cron.service",
+                    "restart ssh.service",
+                    "try-restart ssh.service",
+                    "restart cron.service",
+                    "reload apache2.service")
+        self.assertEqual(self.queue.pending(),
+                         [("restart", "cron.service"),
+                          ("restart", "ssh.service")])
+        self.assertEqual(RestartQueue.from_environ().path, self.queue.path)
+        self.queue.disable()
+        self.assertIsNone(RestartQueue.from_environ())
+
+    def test_flush_parallel(self):
+        self.queue.enable()
+        self._queue(*["restart unit%s.service" % i for i in range(6)])
+        lock = threading.Lock()
+        running = []
+        most = []
+        done = []
+
+        def restart(action, unit):
+            with lock:
+                running.append(unit)
+                most.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(unit)
+                done.append((action, unit))
+        start = time.time()
+        self.queue.flush(restart)
+        self.assertLess(time.time() - start, 6 * 0.05)
+        self.assertEqual(len(done), 6)
+        self.assertEqual(max(most), 2)
+        # the queue is empty now
+        done[:] = []
+        self.queue.flush(restart)
+        self.assertEqual(done, [])
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from DistUpgrade.DistUpgradeController import DistUpgradeController
+from DistUpgrade.DistUpgradeHookQueue import (
+    HookQueue, QUEUE_ENV, RESTART_QUEUE_ENV)
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestHookReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.addCleanup(os.environ.pop, QUEUE_ENV, None)
+        self.controller = mock.Mock()
+        self.controller.hook_queue = HookQueue(
+            os.path.join(self.tmpdir, "hook-queue"))
+        self.controller.hook_queue.enable()
+        # what imported/coalesce-hook records
+        with open(self.controller.hook_queue.path, "a") as f:
+            f.write("update-initramfs\t-u\n")
+
+    def test_failures_are_errors(self):
+        with mock.patch("subprocess.call", return_value=1), \
+                self.assertLogs(level="ERROR"):
+            DistUpgradeController.replayHooks(self.controller)
+        self.assertEqual(self.controller._view.error.call_count, 1)
+        # nothing is left for the exit
+        pid = os.getpid()
+        DistUpgradeController._replayHooksAtExit(self.controller, pid)
+        self.assertFalse(self.controller.replayHooks.called)
+
+    def test_replay_at_exit(self):
+        # not in a forked child
+        DistUpgradeController._replayHooksAtExit(self.controller, 1)
+        self.assertFalse(self.controller.replayHooks.called)
+        pid = os.getpid()
+        DistUpgradeController._replayHooksAtExit(self.controller, pid)
+        self.controller.replayHooks.assert_called_once_with(
+            show_errors=False)
+
+
+class TestRestartQueueScope(unittest.TestCase):
+
+    testdir = os.path.join(CURDIR, "data-sources-list-test")
+
+    def test_not_enabled_by_the_controller(self):
+        """ restarts are only queued while the packages are installed """
+        self.addCleanup(os.environ.pop, RESTART_QUEUE_ENV, None)
+        os.environ.pop(RESTART_QUEUE_ENV, None)
+        controller = DistUpgradeController(mock.Mock(), datadir=self.testdir)
+        self.assertNotIn(RESTART_QUEUE_ENV, os.environ)
+        self.assertFalse(os.path.exists(controller.restart_queue.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(CURDIR, "bench"))
+
+from bench_importtime import importtime, parse_importtime
+
+
+class TestImportTime(unittest.TestCase):
+
+    def test_parse(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |   _io\n"
+            "import time:      2000 |       2120 | DistUpgrade.Foo\n"
+            "Traceback (most recent call last):\n")
+        self.assertEqual(parse_importtime(output),
+                         {"_io": (120, 120),
+                          "DistUpgrade.Foo": (2000, 2120)})
+
+    def test_headless_startup_imports(self):
+        times = importtime("DistUpgrade.DistUpgradeMain")
+        self.assertIn("DistUpgrade.DistUpgradeMain", times)
+        # no toolkit and no apt cache before a view was picked
+        for module in ("gi", "PyQt5", "apt", "DistUpgrade.DistUpgradeCache"):
+            self.assertNotIn(module, times)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from DistUpgrade.DistUpgradeMain import setup_log_writer
+
+
+class TestLogWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.fname = os.path.join(self.tmpdir, "main.log")
+        self.root = logging.getLogger()
+        self.addCleanup(self.root.setLevel, self.root.level)
+        self.handler = setup_log_writer(self.fname)
+        self.addCleanup(self.root.removeHandler, self.handler)
+        self.addCleanup(self.handler.close)
+
+    def _read(self):
+        with open(self.fname) as f:
+            return f.read()
+
+    def test_records_written_on_close(self):
+        for i in range(1000):
+            logging.debug("record %i of %s", i, "many")
+        self.handler.close()
+        lines = self._read().splitlines()
+        self.assertEqual(len(lines), 1000)
+        self.assertTrue(lines[0].endswith("DEBUG record 0 of many"))
+        self.assertTrue(lines[-1].endswith("DEBUG record 999 of many"))
+
+    def test_flush_waits_for_queued_records(self):
+        for i in range(1000):
+            logging.debug("record %i", i)
+        self.handler.flush()
+        lines = self._read().splitlines()
+        self.assertEqual(len(lines), 1000)
+        self.assertTrue(lines[-1].endswith("DEBUG record 999"))
+
+    def test_forked_child_logs_directly(self):
+        logging.info("parent")
+        pid = os.fork()
+        if pid == 0:
+            logging.error("child")
+            logging.shutdown()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.handler.close()
+        log = self._read()
+        self.assertIn("INFO parent", log)
+        self.assertIn("ERROR child", log)
+
+
+if __name__ == "__main__":
+    unittest.main()
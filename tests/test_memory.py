@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from mock import Mock
+
+from DistUpgrade import DistUpgradeConfigParser
+from DistUpgrade.DistUpgradeMemory import (
+    MemoryReport, is_low_memory, read_rss, reset_peak_rss)
+from DistUpgrade.DistUpgradeView import DistUpgradeView
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(CURDIR, "bench"))
+
+from bench_cache import TOPDIR, open_cache
+from synthetic import SyntheticSystem, keep_apt_config, use_apt_config
+
+
+MB = 1024 * 1024
+# what opening and walking the cache of a 5k package system may add
+# to the peak rss
+RSS_BUDGET = 64 * MB
+
+
+def status(rss, peak):
+    return ("Name:\tpython3\nVmPeak:\t  900000 kB\nVmHWM:\t%8d kB\n"
+            "VmRSS:\t%8d kB\nThreads:\t1\n" % (peak, rss))
+
+
+class TestMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.status = os.path.join(self.tmpdir, "status")
+
+    def write_status(self, rss, peak):
+        with open(self.status, "w") as f:
+            f.write(status(rss, peak))
+
+    def test_read_rss(self):
+        self.assertEqual(read_rss(self.status), (0, 0))
+        self.write_status(2048, 4096)
+        self.assertEqual(read_rss(self.status), (2 * MB, 4 * MB))
+
+    def test_report(self):
+        report = MemoryReport(self.status)
+        report.phase("PREPARE")
+        self.write_status(1024, 40 * 1024)
+        report.phase("MODIFY_SOURCES")
+        self.write_status(1024, 80 * 1024)
+        report.phase("PREPARE")
+        self.write_status(1024, 20 * 1024)
+        report.done()
+        # the highest peak of a step that runs twice is kept
+        self.assertEqual(report.peaks, {"PREPARE": 40 * MB,
+                                        "MODIFY_SOURCES": 80 * MB})
+        # nothing running, nothing to log
+        report.done()
+        self.assertEqual(len(report.peaks), 2)
+
+    def test_is_low_memory(self):
+        config = Mock()
+        facts = Mock()
+        settings = {}
+        config.getWithDefault.side_effect = \
+            lambda section, key, default: settings.get(key, default)
+        facts.mem_total = 512 * MB
+        self.assertTrue(is_low_memory(config, facts))
+        facts.mem_total = 4096 * MB
+        self.assertFalse(is_low_memory(config, facts))
+        # unknown
+        facts.mem_total = 0
+        self.assertFalse(is_low_memory(config, facts))
+        settings["LowMemory"] = "yes"
+        self.assertTrue(is_low_memory(config, facts))
+        settings["LowMemory"] = "no"
+        facts.mem_total = 512 * MB
+        self.assertFalse(is_low_memory(config, facts))
+        settings["LowMemory"] = "auto"
+        settings["LowMemoryThreshold"] = 256
+        self.assertFalse(is_low_memory(config, facts))
+
+
+class TestCacheMemory(unittest.TestCase):
+    """ walk the cache of a synthetic system """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.addCleanup(setattr, DistUpgradeConfigParser,
+                        "CONFIG_OVERRIDE_DIR",
+                        DistUpgradeConfigParser.CONFIG_OVERRIDE_DIR)
+        DistUpgradeConfigParser.CONFIG_OVERRIDE_DIR = None
+
+    def open_cache(self, system):
+        use_apt_config(self, system.apt_config())
+        # set by the cache
+        keep_apt_config(self, ["Dir::Log", "Dir::Log::Terminal"])
+        cache = open_cache(system, os.path.join(TOPDIR, "data"),
+                           DistUpgradeView())
+        self.addCleanup(os.close, cache.logfd)
+        return cache
+
+    def test_rss_budget(self):
+        system = SyntheticSystem(self.tmpdir, 5000).create()
+        reset_peak_rss()
+        (start, _) = read_rss()
+        cache = self.open_cache(system)
+        self.assertEqual(cache._getObsoletesPkgs(), system.obsolete)
+        cache._getUnusedDependencies()
+        cache.release_memory()
+        (rss, peak) = read_rss()
+        if not peak:
+            self.skipTest("no /proc/self/status")
+        self.assertLess(peak - start, RSS_BUDGET)
+        self.assertLessEqual(rss, peak)
+
+    def test_multiarch_names(self):
+        system = SyntheticSystem(self.tmpdir, 100,
+                                 foreign_arch="i386").create()
+        cache = self.open_cache(system)
+        obsolete = cache._getObsoletesPkgs()
+        self.assertEqual(obsolete, system.obsolete)
+        self.assertIn("libmulti:i386", obsolete)
+        self.assertIn("libgone:i386", obsolete)
+        self.assertNotIn("libmulti", obsolete)
+        # the names point to the foreign packages
+        for name in ("libmulti:i386", "libgone:i386"):
+            self.assertEqual(cache[name].architecture(), "i386")
+        self.assertEqual(cache["libmulti"].architecture(), "amd64")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from DistUpgrade.DistUpgradeMirrorRanking import (
+    MirrorRanking, PROBE_BYTES, mirror_shortlist, probe_mirror)
+
+
+RELEASE = b"Suite: impish\n" + b"x" * (2 * PROBE_BYTES)
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    """ serves dists/impish/Release after server.delay seconds and
+        server.chunk_delay seconds per 4k
+    """
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers["Range"]))
+        time.sleep(self.server.delay)
+        if self.path != "/ubuntu/dists/impish/Release":
+            self.send_error(404)
+            return
+        data = RELEASE[:PROBE_BYTES]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        for i in range(0, len(data), 4096):
+            time.sleep(self.server.chunk_delay)
+            self.wfile.write(data[i:i + 4096])
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMirrorRanking(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.cache = os.path.join(self.tmpdir, "mirrors",
+                                  "mirror-ranking.json")
+
+    def mirror(self, delay=0, chunk_delay=0):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), MirrorHandler)
+        server.delay = delay
+        server.chunk_delay = chunk_delay
+        server.requests = []
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.server = server
+        return "http://127.0.0.1:%s/ubuntu/" % server.server_address[1]
+
+    def dead_mirror(self):
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        s.close()
+        return "http://127.0.0.1:%s/ubuntu" % port
+
+    def test_shortlist(self):
+        mirrors = ["http://archive.ubuntu.com/ubuntu/",
+                   "http://debian.charite.de/ubuntu/",
+                   "ftp://ftp.fu-berlin.de/linux/ubuntu/",
+                   "http://ubuntu-arch.linux.edu.lv/ubuntu/",
+                   "https://ftp.uni-stuttgart.de/ubuntu/"]
+        self.assertEqual(mirror_shortlist(mirrors, "de."),
+                         ["http://de.archive.ubuntu.com/ubuntu",
+                          "http://archive.ubuntu.com/ubuntu",
+                          "http://debian.charite.de/ubuntu",
+                          "https://ftp.uni-stuttgart.de/ubuntu"])
+        self.assertEqual(mirror_shortlist(mirrors, "de.", limit=3),
+                         ["http://de.archive.ubuntu.com/ubuntu",
+                          "http://archive.ubuntu.com/ubuntu",
+                          "http://debian.charite.de/ubuntu"])
+        self.assertEqual(mirror_shortlist(mirrors, ""),
+                         ["http://archive.ubuntu.com/ubuntu"])
+
+    def test_probe(self):
+        mirror = self.mirror()
+        self.assertIsNotNone(probe_mirror(mirror, "impish"))
+        self.assertEqual(self.server.requests,
+                         [("/ubuntu/dists/impish/Release",
+                           "bytes=0-%d" % (PROBE_BYTES - 1))])
+        # the dist is not on the mirror
+        self.assertIsNone(probe_mirror(mirror, "warty"))
+        self.assertIsNone(probe_mirror(self.dead_mirror(), "impish"))
+        self.assertIsNone(probe_mirror("ftp://127.0.0.1/ubuntu", "impish"))
+
+    def test_rank_by_latency(self):
+        slow = self.mirror(delay=0.5)
+        fast = self.mirror()
+        dead = self.dead_mirror()
+        ranking = MirrorRanking("impish", self.cache)
+        start = time.time()
+        self.assertEqual(ranking.rank([slow, dead, fast]),
+                         [fast.rstrip("/"), slow.rstrip("/")])
+        # the mirrors are probed at the same time
+        self.assertLess(time.time() - start, 1.5)
+
+    def test_rank_by_throughput(self):
+        slow = self.mirror(chunk_delay=0.02)
+        fast = self.mirror()
+        ranking = MirrorRanking("impish")
+        self.assertEqual(ranking.best([slow, fast]), fast.rstrip("/"))
+
+    def test_cache(self):
+        fast = self.mirror()
+        ranking = MirrorRanking("impish", self.cache)
+        self.assertEqual(ranking.best([fast]), fast.rstrip("/"))
+        self.assertEqual(len(self.server.requests), 1)
+        with open(self.cache) as f:
+            self.assertIn(fast.rstrip("/"), json.load(f)["mirrors"])
+        # cached, no new probe
+        self.assertEqual(ranking.best([fast]), fast.rstrip("/"))
+        self.assertEqual(len(self.server.requests), 1)
+        # other dists are probed
+        self.assertIsNone(MirrorRanking("warty", self.cache).best([fast]))
+        self.assertEqual(len(self.server.requests), 2)
+        # expired
+        ranking = MirrorRanking("impish", self.cache, ttl=0)
+        self.assertEqual(ranking.best([fast]), fast.rstrip("/"))
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_broken_cache(self):
+        os.makedirs(os.path.dirname(self.cache))
+        with open(self.cache, "w") as f:
+            f.write("{broken")
+        fast = self.mirror()
+        ranking = MirrorRanking("impish", self.cache)
+        self.assertEqual(ranking.best([fast]), fast.rstrip("/"))
+
+
+if __name__ == "__main__":
+    unittest.main()
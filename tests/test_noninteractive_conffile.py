@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt_pkg
+import io
+import os
+import pty
+import sys
+import time
+import unittest
+
+from DistUpgrade import DistUpgradeConfigParser
+from DistUpgrade.DistUpgradeViewNonInteractive import (
+    NonInteractiveInstallProgress)
+
+DistUpgradeConfigParser.CONFIG_OVERRIDE_DIR = None
+
+PROMPT = (b"Configuration file '/etc/foo.conf'\r\n"
+          b" ==> Modified (by you or by a script) since installation.\r\n"
+          b" ==> Package distributor has shipped an updated version.\r\n"
+          b"*** foo.conf (Y/I/N/O/D/Z) [default=N] ? ")
+
+
+class TestNonInteractiveConffile(unittest.TestCase):
+
+    def setUp(self):
+        dpkg_options = apt_pkg.config.value_list("DPkg::Options")
+        self.addCleanup(self._restore_dpkg_options, dpkg_options)
+        self.progress = NonInteractiveInstallProgress(logdir="/tmp")
+        self.progress.conffile_prompt_timeout = 2
+        self.progress.last_activity = time.time()
+        (self.progress.master_fd, self.slave_fd) = pty.openpty()
+        self.addCleanup(os.close, self.progress.master_fd)
+        self.addCleanup(os.close, self.slave_fd)
+        stdout = sys.stdout
+        self.addCleanup(setattr, sys, "stdout", stdout)
+        sys.stdout = io.StringIO()
+
+    def _restore_dpkg_options(self, options):
+        apt_pkg.config.clear("DPkg::Options")
+        for option in options:
+            apt_pkg.config.set("DPkg::Options::", option)
+
+    def _answer(self):
+        return os.read(self.slave_fd, 16).strip()
+
+    def test_answer_when_prompt_seen(self):
+        os.write(self.slave_fd, PROMPT)
+        start = time.time()
+        self.progress.conffile("/etc/foo.conf", "/etc/foo.conf.dpkg-new")
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(self._answer(), b"n")
+        self.assertIn("(Y/I/N/O/D/Z)", sys.stdout.getvalue())
+
+    def test_prompt_already_read(self):
+        # the terminal output was copied before the status fd
+        # announced the prompt
+        os.write(self.slave_fd, PROMPT)
+        self.progress.update_interface()
+        start = time.time()
+        self.progress.conffile("/etc/foo.conf", "/etc/foo.conf.dpkg-new")
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(self._answer(), b"n")
+
+    def test_no_prompt_deadline(self):
+        self.progress.conffile_prompt_timeout = 0.2
+        start = time.time()
+        self.progress.conffile("/etc/foo.conf", "/etc/foo.conf.dpkg-new")
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(self._answer(), b"n")
+
+    def test_decisions(self):
+        self.progress.set_conffile_decisions({"/etc/foo.conf": True})
+        self.assertNotIn("--force-confold",
+                         apt_pkg.config.value_list("DPkg::Options"))
+        os.write(self.slave_fd, PROMPT)
+        self.progress.conffile("/etc/foo.conf", "/etc/foo.conf.dpkg-new")
+        self.assertEqual(self._answer(), b"y")
+
+    def test_keep_all_never_prompts(self):
+        self.progress.set_conffile_decisions({"/etc/foo.conf": False,
+                                              "/etc/bar.conf": False})
+        self.assertEqual(
+            apt_pkg.config.value_list("DPkg::Options").count(
+                "--force-confold"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import unittest
+
+import mock
+
+from DistUpgrade.DistUpgradePackageIndex import (
+    PackageNameIndex,
+    get_name_index,
+)
+
+
+NAMES = ("linux-generic", "linux-headers-5.13.0-19-generic",
+         "linux-image-5.11.0-38-generic", "linux-image-5.13.0-19-generic",
+         "linux-image-generic", "linux-image-unsigned-5.13.0-19-generic",
+         "linux-tools-common", "ros-foxy-rosclean", "rsync", "zsh")
+
+
+def make_pkg(name):
+    pkg = mock.Mock()
+    pkg.name = name
+    return pkg
+
+
+class FakeCache(dict):
+    """ the parts of apt.Cache the index uses """
+
+    def keys(self):
+        return sorted(dict.keys(self))
+
+
+class TestPackageNameIndex(unittest.TestCase):
+
+    def test_prefix(self):
+        index = PackageNameIndex(set(make_pkg(name) for name in NAMES))
+        self.assertEqual([pkg.name for pkg in index.with_prefix("linux-im")],
+                         ["linux-image-5.11.0-38-generic",
+                          "linux-image-5.13.0-19-generic",
+                          "linux-image-generic",
+                          "linux-image-unsigned-5.13.0-19-generic"])
+        self.assertEqual(list(index.names_with_prefix("ros-")),
+                         ["ros-foxy-rosclean"])
+        self.assertEqual(list(index.names_with_prefix("zsh")), ["zsh"])
+        self.assertEqual(list(index.names_with_prefix("zzz")), [])
+        self.assertEqual(len(list(index.names_with_prefix(""))), len(NAMES))
+
+    def test_cache_lookup(self):
+        cache = FakeCache((name, make_pkg(name)) for name in NAMES)
+        cache["libc6:i386"] = make_pkg("libc6")
+        index = PackageNameIndex(cache)
+        pkgs = list(index.with_prefix("libc6"))
+        self.assertEqual(pkgs, [cache["libc6:i386"]])
+
+    def test_get_name_index(self):
+        cache = mock.Mock()
+        cache.name_index = PackageNameIndex([])
+        self.assertIs(get_name_index(cache), cache.name_index)
+        # anything else gets a new index
+        pkgs = [make_pkg("foo")]
+        self.assertEqual(list(get_name_index(pkgs).names_with_prefix("f")),
+                         ["foo"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from DistUpgrade.DistUpgradePatcher import (
+    PatchError,
+    file_md5sum,
+    parse_edpatch,
+    patch,
+)
+
+
+def md5sum(data):
+    return hashlib.md5(data.encode("UTF-8")).hexdigest()
+
+
+class TestPatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.orig = os.path.join(self.tmpdir, "orig")
+        self.edpatch = os.path.join(self.tmpdir, "edpatch")
+        # ~5 MB
+        self.lines = ["line %07d of a rather big configuration file\n" % i
+                      for i in range(100000)]
+        self.write(self.orig, "".join(self.lines))
+
+    def write(self, path, content):
+        with open(path, "w") as f:
+            f.write(content)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_big_file(self):
+        # many appends at the start were quadratic with list.insert()
+        added = ["added %d\n" % i for i in range(50000)]
+        self.write(self.edpatch,
+                   "99999,100000c\nthe end\n.\n"
+                   "50000d\n"
+                   "10a\n" + "".join(added) + ".\n"
+                   "1c\nthe start\n.\n")
+        expected = (["the start\n"] + self.lines[1:10] + added +
+                    self.lines[10:49999] + self.lines[50000:99998] +
+                    ["the end\n"])
+        expected = "".join(expected)
+        self.assertTrue(patch(self.orig, self.edpatch, md5sum(expected)))
+        self.assertEqual(self.read(self.orig), expected)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ["edpatch", "orig"])
+
+    @unittest.skipIf(shutil.which("diff") is None, "needs diff")
+    def test_diff_e(self):
+        new = list(self.lines)
+        for i in range(0, len(new), 1000):
+            new[i] = "changed %d\n" % i
+        del new[5000:5100]
+        new[7000:7000] = ["inserted\n", ".\n", "more\n"]
+        new.append(".\n")
+        new_file = os.path.join(self.tmpdir, "new")
+        self.write(new_file, "".join(new))
+        with open(self.edpatch, "w") as f:
+            subprocess.call(["diff", "-e", self.orig, new_file], stdout=f)
+        patch(self.orig, self.edpatch, file_md5sum(new_file))
+        self.assertEqual(self.read(self.orig), "".join(new))
+
+    def test_wrong_md5sum(self):
+        self.write(self.edpatch, "3a\nadded\n.\n")
+        os.chmod(self.orig, 0o640)
+        self.assertRaises(PatchError, patch, self.orig, self.edpatch,
+                          "deadbeefdeadbeefdeadbeef")
+        # untouched and no temporary file left behind
+        self.assertEqual(self.read(self.orig), "".join(self.lines))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ["edpatch", "orig"])
+        # the mode is kept
+        patch(self.orig, self.edpatch)
+        self.assertEqual(os.stat(self.orig).st_mode & 0o777, 0o640)
+        self.assertEqual(self.read(self.orig).splitlines()[3], "added")
+
+    def test_invalid_scripts(self):
+        for script in ("10d\n20d\n",             # not in diff -e order
+                       "20,30c\nx\n.\n25d\n",    # overlapping
+                       "200000d\n",              # past the end
+                       "5a\nno end marker\n",
+                       "3d\ns/x/y/\n",
+                       "3x\n",
+                       "1,2a\nx\n.\n"):
+            self.write(self.edpatch, script)
+            with self.assertRaises(PatchError, msg=script):
+                patch(self.orig, self.edpatch)
+            self.assertEqual(file_md5sum(self.orig),
+                             md5sum("".join(self.lines)))
+
+    def test_parse(self):
+        self.write(self.edpatch,
+                   "5a\n..\n.\ns/.//\na\nz\n.\n2,3c\nx\n.\n0a\ny\n.\n")
+        self.assertEqual(
+            [tuple(h) for h in parse_edpatch(self.edpatch)],
+            [("a", 0, 0, ["y\n"]),
+             ("c", 1, 3, ["x\n"]),
+             ("a", 5, 5, [".\n", "z\n"])])
+
+    def test_file_md5sum(self):
+        self.assertEqual(file_md5sum(self.orig, blocksize=4096),
+                         md5sum("".join(self.lines)))
+
+
+if __name__ == "__main__":
+    unittest.main()
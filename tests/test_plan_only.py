@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt_pkg
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from mock import Mock, patch
+
+from DistUpgrade.DistUpgradeConfigParser import DistUpgradeConfig
+from DistUpgrade.DistUpgradeController import DistUpgradeController
+from DistUpgrade.DistUpgradePlanOnly import (
+    PrivateAptRoot, REPORT_FORMAT, write_report)
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(CURDIR, "bench"))
+
+from synthetic import (
+    PPA, SyntheticSystem, keep_apt_config, use_apt_config)
+
+
+class TestPlanOnly(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.etc = os.path.join(self.tmpdir, "etc")
+        os.makedirs(os.path.join(self.etc, "sources.list.d"))
+        with open(os.path.join(self.etc, "sources.list"), "w") as f:
+            f.write("deb http://archive.ubuntu.com/ubuntu hirsute main\n")
+        with open(os.path.join(self.etc, "sources.list.d", "ppa.list"),
+                  "w") as f:
+            f.write("deb http://ppa.launchpad.net/a/b/ubuntu hirsute main\n")
+        for (key, value) in (
+                ("Dir::Etc::sourcelist",
+                 os.path.join(self.etc, "sources.list")),
+                ("Dir::Etc::sourceparts",
+                 os.path.join(self.etc, "sources.list.d")),
+                ("Dir::State::lists", os.path.join(self.tmpdir, "lists")),
+                ("Dir::Cache::pkgcache", "pkgcache.bin"),
+                ("Dir::Cache::srcpkgcache", "srcpkgcache.bin")):
+            self.addCleanup(apt_pkg.config.set, key,
+                            apt_pkg.config.find(key))
+            apt_pkg.config.set(key, value)
+
+    def test_private_root(self):
+        apt_root = PrivateAptRoot(os.path.join(self.tmpdir, "root"))
+        apt_root.enable()
+        self.assertEqual(apt_pkg.config.find_file("Dir::Etc::sourcelist"),
+                         apt_root.sourcelist)
+        self.assertEqual(apt_pkg.config.find_dir("Dir::State::lists"),
+                         apt_root.lists + "/")
+        self.assertEqual(apt_pkg.config.find("Dir::Cache::pkgcache"), "")
+        self.assertEqual(os.listdir(apt_root.sourceparts), ["ppa.list"])
+        # changing the private copy leaves the system alone
+        with open(apt_root.sourcelist, "w") as f:
+            f.write("deb http://archive.ubuntu.com/ubuntu impish main\n")
+        with open(os.path.join(self.etc, "sources.list")) as f:
+            self.assertIn("hirsute", f.read())
+        apt_root.cleanup()
+        self.assertEqual(apt_pkg.config.find_file("Dir::Etc::sourcelist"),
+                         os.path.join(self.etc, "sources.list"))
+        self.assertEqual(apt_pkg.config.find("Dir::Cache::pkgcache"),
+                         "pkgcache.bin")
+        self.assertFalse(os.path.exists(apt_root.root))
+
+    def test_write_report(self):
+        path = os.path.join(self.tmpdir, "report.json")
+        write_report({"result": "ok", "changes": []}, path)
+        with open(path) as f:
+            self.assertEqual(json.load(f), {"result": "ok", "changes": [],
+                                            "format": REPORT_FORMAT})
+        self.assertEqual(os.listdir(self.tmpdir).count("report.json"), 1)
+
+    def test_report_on_stdout(self):
+        script = ("import os, sys\n"
+                  "from DistUpgrade.DistUpgradePlanOnly import (\n"
+                  "    redirect_stdout, write_report)\n"
+                  "stdout = redirect_stdout()\n"
+                  "print('progress')\n"
+                  "sys.stdout.flush()\n"
+                  "os.system('echo child')\n"
+                  "write_report({'result': 'ok'}, '-', stdout)\n")
+        proc = subprocess.Popen([sys.executable, "-c", script],
+                                cwd=os.path.join(CURDIR, ".."),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        (out, err) = proc.communicate()
+        self.assertEqual(proc.returncode, 0, err)
+        self.assertEqual(json.loads(out), {"result": "ok",
+                                           "format": REPORT_FORMAT})
+        self.assertEqual(err, "progress\nchild\n")
+
+
+class TestDoPlanOnly(unittest.TestCase):
+    """ plan the upgrade of a synthetic system """
+
+    testdir = os.path.join(CURDIR, "data-sources-list-test")
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        # the indexes of the installed release are on the system
+        self.system = SyntheticSystem(os.path.join(self.tmpdir, "system"),
+                                      50, to_dist="feisty").create()
+        self.sourcelist = os.path.join(self.system.etc, "sources.list")
+        use_apt_config(self, self.system.apt_config())
+        # set by the controller and the cache
+        keep_apt_config(self, ["Dir::Log", "Dir::Log::Terminal",
+                               "DPkg::Options", "APT::Default-Release"])
+
+    def snapshot(self):
+        files = {}
+        for (dirpath, dirs, names) in os.walk(self.system.rootdir):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                with open(path, "rb") as f:
+                    files[path] = f.read()
+        return files
+
+    def controller(self, with_network=False):
+        config = DistUpgradeConfig(self.testdir)
+        config.set("Files", "LogDir", os.path.join(self.tmpdir, "log"))
+        config.set("Distro", "Demotions",
+                   os.path.join(self.tmpdir, "demoted.cfg"))
+        options = Mock(withNetwork=with_network, plan_only="-",
+                       export_plan=None, import_plan=None)
+        return DistUpgradeController(Mock(), options, datadir=self.testdir,
+                                     config=config)
+
+    def test_system_unchanged(self):
+        controller = self.controller()
+        before = self.snapshot()
+        stdout = io.StringIO()
+        controller.doPlanOnly("-", stdout)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report["result"], "ok", report.get("error"))
+        self.assertEqual((report["from"], report["to"]), ("feisty", "gutsy"))
+        self.assertEqual(set(report["obsolete"]), self.system.obsolete)
+        self.assertEqual(
+            report["disabled_sources"],
+            [{"line": "deb %s feisty main" % PPA, "third_party": True}])
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(apt_pkg.config.find_file("Dir::Etc::sourcelist"),
+                         self.sourcelist)
+
+    def test_mirror_ranking_not_cached(self):
+        controller = self.controller(with_network=True)
+        controller.config.set("Network", "RankMirrors", "yes")
+        with patch("DistUpgrade.DistUpgradeController.MirrorRanking") as m:
+            m.return_value.rank.return_value = []
+            self.assertEqual(controller._rankedMirrors(), [])
+        # the measurements are not written to the system
+        self.assertIsNone(m.call_args[0][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+
+from aptsources.sourceslist import SourceEntry
+
+from DistUpgrade.DistUpgradePrefetch import IndexPrefetch, target_entries
+
+
+# writes an index into the Dir::State::lists it is given
+FAKE_APT_GET = """#!/bin/sh
+for arg in "$@"; do
+    case "$arg" in
+        Dir::State::lists=*) lists="${arg#Dir::State::lists=}";;
+    esac
+done
+echo "$@" > "${lists}/args"
+echo "Package: bash" > "${lists}/archive_dists_impish_main_Packages"
+touch "${lists}/lock"
+sleep ${SLEEP:-0}
+"""
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.lists = os.path.join(self.tmpdir, "lists")
+        os.makedirs(self.lists)
+        self.apt_get = os.path.join(self.tmpdir, "apt-get")
+        with open(self.apt_get, "w") as f:
+            f.write(FAKE_APT_GET)
+        os.chmod(self.apt_get, stat.S_IRWXU)
+
+    def test_target_entries(self):
+        sources = [SourceEntry(line) for line in (
+            "deb http://archive.ubuntu.com/ubuntu hirsute main universe",
+            "deb [arch=amd64] http://archive.ubuntu.com/ubuntu "
+            "hirsute-updates main",
+            "deb-src http://archive.ubuntu.com/ubuntu hirsute main",
+            "# deb http://archive.ubuntu.com/ubuntu hirsute-backports main",
+            "deb http://ppa.launchpad.net/foo/bar/ubuntu hirsute main",
+            "deb http://archive.ubuntu.com/ubuntu focal main",
+            "deb http://archive.ubuntu.com/ubuntu hirsute main universe")]
+        self.assertEqual(
+            target_entries(sources, "hirsute", "impish",
+                           ["updates", "security", "backports"],
+                           lambda uri: "archive.ubuntu.com" in uri),
+            ["deb http://archive.ubuntu.com/ubuntu impish main universe",
+             "deb [arch=amd64] http://archive.ubuntu.com/ubuntu "
+             "impish-updates main",
+             "deb-src http://archive.ubuntu.com/ubuntu impish main"])
+
+    def test_install(self):
+        lines = ["deb http://archive.ubuntu.com/ubuntu impish main"]
+        prefetch = IndexPrefetch(self.lists + "/", lines, self.apt_get)
+        self.assertTrue(prefetch.start())
+        self.assertTrue(prefetch.wait())
+        with open(os.path.join(prefetch.shadow, "sources.list")) as f:
+            self.assertEqual(f.read(), lines[0] + "\n")
+        self.assertEqual(prefetch.install(), 2)
+        self.assertEqual(sorted(os.listdir(self.lists)),
+                         ["archive_dists_impish_main_Packages", "args"])
+        # the system lists are not touched by the prefetch
+        with open(os.path.join(self.lists, "args")) as f:
+            self.assertIn("Dir::State::lists=%s/" % prefetch.shadow_lists,
+                          f.read())
+        self.assertFalse(os.path.exists(prefetch.shadow))
+
+    def test_nothing_to_prefetch(self):
+        prefetch = IndexPrefetch(self.lists, [], self.apt_get)
+        self.assertFalse(prefetch.start())
+        self.assertEqual(prefetch.install(), 0)
+
+    def test_cancel(self):
+        os.environ["SLEEP"] = "30"
+        self.addCleanup(os.environ.pop, "SLEEP")
+        prefetch = IndexPrefetch(self.lists, ["deb http://x impish main"],
+                                 self.apt_get)
+        self.assertTrue(prefetch.start())
+        # wait for the download to be underway
+        lock = os.path.join(prefetch.shadow_lists, "lock")
+        while not os.path.exists(lock):
+            time.sleep(0.01)
+        start = time.time()
+        prefetch.cancel()
+        self.assertLess(time.time() - start, 10)
+        self.assertFalse(prefetch.success)
+        self.assertFalse(os.path.exists(prefetch.shadow))
+        self.assertEqual(os.listdir(self.lists), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
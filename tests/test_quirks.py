@@ -172,6 +172,11 @@ def make_mock_pkg(name, is_installed, candidate_rec=""):
     return mock_pkg
 
 
+class MemoCache(list):
+    """ a list of packages that counts its changes like apt.Cache """
+    _changes_count = 1
+
+
 class TestPatches(unittest.TestCase):
 
     orig_chdir = ''
@@ -232,6 +237,27 @@ class TestPatches(unittest.TestCase):
         q._applyPatches(patchdir=patchdir)
         self._verify_result_checksums()
 
+    def test_patch_big_file(self):
+        q = DistUpgradeQuirks(MockController(), MockConfig)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        # the patch names can not encode a "_" in the tmpdir
+        os.chdir(tmpdir)
+        target = "big"
+        content = "".join("line %d\n" % i for i in range(500000))
+        with open(target, "w") as f:
+            f.write(content)
+        result = content.replace("line 250000\n", "")
+        patchdir = os.path.join(tmpdir, "patches")
+        os.mkdir(patchdir)
+        name = "big.%s.%s" % (hashlib.md5(content.encode()).hexdigest(),
+                              hashlib.md5(result.encode()).hexdigest())
+        with open(os.path.join(patchdir, name), "w") as f:
+            f.write("250001d\n")
+        q._applyPatches(patchdir=patchdir)
+        with open(target) as f:
+            self.assertEqual(f.read(), result)
+
     def test_patch_lowlevel(self):
         # test lowlevel too
         from DistUpgrade.DistUpgradePatcher import patch, PatchError
@@ -367,6 +393,39 @@ class TestQuirks(unittest.TestCase):
         pkgname = q._get_linux_metapackage(mock_cache, headers=False)
         self.assertEqual(pkgname, "linux-generic-lts-quantal")
 
+    def test_latest_kernel_memoized(self):
+        q = DistUpgradeQuirks(mock.Mock(), mock.Mock())
+        new = make_mock_pkg(
+            name="linux-image-5.13.0-19-generic",
+            is_installed=False,
+            candidate_rec={"Source": "linux"},
+        )
+        mock_cache = MemoCache([
+            make_mock_pkg(
+                name="linux-image-5.11.0-38-generic",
+                is_installed=True,
+                candidate_rec={"Source": "linux"},
+            ),
+            make_mock_pkg(
+                name="linux-image-5.4.0-89-lowlatency",
+                is_installed=True,
+                candidate_rec={"Source": "linux-hwe-5.4"},
+            ),
+            new,
+        ])
+        self.assertEqual(q._get_latest_kernel(mock_cache),
+                         ("5.11.0-38", "generic", "linux"))
+        self.assertEqual(q._get_linux_metapackage(mock_cache, headers=True),
+                         "linux-headers-generic")
+        # the marks did not change, the cache is not walked again
+        new.marked_install = True
+        self.assertEqual(q._get_latest_kernel(mock_cache),
+                         ("5.11.0-38", "generic", "linux"))
+        mock_cache._changes_count += 1
+        self.assertEqual(q._get_latest_kernel(mock_cache),
+                         ("5.13.0-19", "generic", "linux"))
+        self.assertEqual(q._get_linux_metapackage(set(), headers=False), "")
+
     def test_ros_installed_warning(self):
         ros_packages = (
             "ros-melodic-catkin",
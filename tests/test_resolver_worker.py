@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from mock import Mock, patch
+
+from DistUpgrade import DistUpgradeConfigParser
+from DistUpgrade.DistUpgradeCache import MyCache
+from DistUpgrade.DistUpgradePlan import changes_from_cache
+from DistUpgrade.DistUpgradeResolverWorker import (
+    ResolverWorkerError, resolve_in_worker)
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(CURDIR, "bench"))
+
+from bench_cache import TOPDIR, open_cache
+from synthetic import SyntheticSystem, keep_apt_config, use_apt_config
+
+
+class TestResolverWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.system = SyntheticSystem(self.tmpdir, 300).create()
+        use_apt_config(self, self.system.apt_config())
+        self.cache = apt.Cache()
+        self.view = Mock()
+
+    def test_marks_applied(self):
+        self.cache.upgrade(True)
+        expected = changes_from_cache(self.cache)
+        self.assertTrue(expected)
+        self.cache.clear()
+
+        def resolve(view):
+            self.cache.upgrade(True)
+            view.pulseProgress()
+            view.error("summary", "msg")
+        resolve_in_worker(self.cache, self.view, resolve)
+        self.assertEqual(changes_from_cache(self.cache), expected)
+        self.view.error.assert_called_once_with("summary", "msg", None)
+
+    def test_resolver_error(self):
+        def resolve(view):
+            self.cache.upgrade(True)
+            raise SystemError("broken")
+        with self.assertRaisesRegex(SystemError, "broken"):
+            resolve_in_worker(self.cache, self.view, resolve)
+        self.assertEqual(self.cache.get_changes(), [])
+
+    def test_worker_crash(self):
+        def resolve(view):
+            raise ValueError("crash")
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        with self.assertRaises(ResolverWorkerError):
+            resolve_in_worker(self.cache, self.view, resolve)
+        self.assertFalse(self.view.error.called)
+
+    def test_fallback(self):
+        self.addCleanup(setattr, DistUpgradeConfigParser,
+                        "CONFIG_OVERRIDE_DIR",
+                        DistUpgradeConfigParser.CONFIG_OVERRIDE_DIR)
+        DistUpgradeConfigParser.CONFIG_OVERRIDE_DIR = None
+        # set by the cache
+        keep_apt_config(self, ["Dir::Log", "Dir::Log::Terminal"])
+        cache = open_cache(self.system, os.path.join(TOPDIR, "data"),
+                           self.view)
+        self.addCleanup(os.close, cache.logfd)
+        parent = os.getpid()
+
+        def resolve(view, serverMode):
+            if os.getpid() != parent:
+                raise ValueError("crash")
+            cache.upgrade(True)
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        # the worker crashes, the upgrade is calculated here instead
+        with patch.object(MyCache, "_resolve", side_effect=resolve) as m:
+            cache._resolveInWorker(self.view, False)
+        self.assertEqual(m.call_count, 1)
+        self.assertTrue(cache.get_changes())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -100,6 +100,26 @@ class TestSourcesListUpdate(unittest.TestCase):
 deb http://archive.ubuntu.com/ubuntu gutsy main restricted
 deb http://archive.ubuntu.com/ubuntu gutsy-updates main restricted
 deb http://security.ubuntu.com/ubuntu/ gutsy-security main restricted
+""")
+
+    @mock.patch.dict(os.environ, {"LANG": "de_DE.UTF-8"})
+    def test_sources_list_with_nothing_and_a_locale(self):
+        """
+        test that the default sources.list uses the main archive and
+        not the country mirror of the locale if no mirror was probed
+        """
+        shutil.copy(os.path.join(self.testdir, "sources.list.nothing"),
+                    os.path.join(self.testdir, "sources.list"))
+        apt_pkg.config.set("Dir::Etc::sourcelist", "sources.list")
+        v = DistUpgradeViewNonInteractive()
+        d = DistUpgradeController(v, datadir=self.testdir)
+        d.openCache(lock=False)
+        self.assertEqual(d._rankedMirrors(), [])
+        res = d.updateSourcesList()
+        self.assertTrue(res)
+        self._verifySources("""
+deb http://archive.ubuntu.com/ubuntu gutsy main restricted
+deb http://archive.ubuntu.com/ubuntu gutsy-updates main restricted
 """)
 
     @mock.patch("DistUpgrade.DistUpgradeController.DistUpgradeController._sourcesListEntryDownloadable")
@@ -796,7 +816,8 @@ deb http://ports.ubuntu.com/ubuntu-ports/ gutsy-backports main restricted univer
                     os.path.join(self.testdir, "sources.list"))
         apt_pkg.config.set("Dir::Etc::sourcelist", "sources.list")
         v = DistUpgradeViewNonInteractive()
-        options = mock.Mock()
+        options = mock.Mock(plan_only=None, export_plan=None,
+                            import_plan=None)
         options.devel_release = True
         d = DistUpgradeController(v, options, datadir=self.testdir)
         d.openCache(lock=False)
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import logging
+import mock
+import os
+import tempfile
+import unittest
+
+from DistUpgrade import DistUpgradeMain
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_installed_version(self):
+        with tempfile.NamedTemporaryFile("w") as f:
+            f.write("Package: apt\nStatus: deinstall ok config-files\n"
+                    "Version: 1.0\n\n"
+                    "Package: apt\nStatus: install ok installed\n"
+                    "Architecture: amd64\nVersion: 2.3.9\n\n")
+            f.flush()
+            self.assertEqual(
+                DistUpgradeMain.installed_version("apt", f.name), "2.3.9")
+            self.assertIsNone(
+                DistUpgradeMain.installed_version("dpkg", f.name))
+        self.assertIsNone(DistUpgradeMain.installed_version(
+            "apt", os.path.join(tempfile.gettempdir(), "no-such-status")))
+
+    def test_is_headless(self):
+        self.assertTrue(DistUpgradeMain.is_headless({}))
+        self.assertTrue(DistUpgradeMain.is_headless({"DISPLAY": ""}))
+        self.assertFalse(DistUpgradeMain.is_headless({"DISPLAY": ":0"}))
+        self.assertFalse(
+            DistUpgradeMain.is_headless({"WAYLAND_DISPLAY": "wayland-0"}))
+
+    @mock.patch("importlib.import_module")
+    def test_headless_skips_gui_views(self, import_module):
+        config = mock.Mock()
+        config.getlist.return_value = ["DistUpgradeViewGtk3",
+                                       "DistUpgradeViewKDE",
+                                       "DistUpgradeViewText"]
+        options = mock.Mock(frontend=None, datadir=".")
+        with mock.patch.dict(os.environ, clear=True), \
+                self.assertLogs(level=logging.INFO):
+            DistUpgradeMain.setup_view(options, config, "/tmp")
+        import_module.assert_called_once_with(".DistUpgradeViewText",
+                                              "DistUpgrade")
+        # an explicitly requested frontend is still tried
+        import_module.reset_mock()
+        options.frontend = "DistUpgradeViewKDE"
+        with mock.patch.dict(os.environ, clear=True):
+            DistUpgradeMain.setup_view(options, config, "/tmp")
+        import_module.assert_called_once_with(".DistUpgradeViewKDE",
+                                              "DistUpgrade")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(CURDIR, "bench"))
+
+from synthetic import SyntheticSystem, use_apt_config
+
+
+class TestSyntheticSystem(unittest.TestCase):
+    """ make sure the benchmark systems look like real ones to apt """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_open(self):
+        system = SyntheticSystem(self.tmpdir, 500).create()
+        use_apt_config(self, system.apt_config())
+        cache = apt.Cache()
+        self.assertEqual(len(cache), 500)
+        self.assertTrue(system.obsolete)
+        self.assertTrue(system.foreign)
+        for pkg in cache:
+            self.assertTrue(pkg.is_installed)
+            if pkg.name in system.obsolete:
+                self.assertFalse(pkg.candidate.downloadable)
+            elif pkg.name in system.foreign:
+                self.assertEqual(pkg.candidate.origins[0].origin,
+                                 "LP-PPA-bench")
+            else:
+                self.assertTrue(pkg.is_upgradable)
+                self.assertEqual(pkg.candidate.origins[0].origin, "Ubuntu")
+        self.assertTrue(os.path.exists(system.status))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from DistUpgrade.DistUpgradeSystemFacts import (
+    Mount, SystemFacts, mount_point, writable_filesystems)
+
+
+class TestSystemFacts(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, path, content):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def test_kernel_and_release(self):
+        self.write("proc/sys/kernel/osrelease", "5.13.0-19-generic\n")
+        self.write("usr/lib/os-release",
+                   'NAME="Ubuntu"\nVERSION_ID="21.10"\n'
+                   'VERSION_CODENAME=impish\n')
+        facts = SystemFacts(self.root)
+        self.assertEqual(facts.kernel_release, "5.13.0-19-generic")
+        self.assertEqual(facts.os_release["VERSION_ID"], "21.10")
+        self.assertEqual(facts.codename, "impish")
+
+    def test_cpu(self):
+        self.write("proc/cpuinfo",
+                   "processor\t: 0\nflags\t\t: fpu vme pae sse2\n\n"
+                   "processor\t: 1\nflags\t\t: fpu vme pae sse2\n")
+        self.write("sys/devices/system/cpu/present", "0-7\n")
+        self.write("sys/devices/system/cpu/kernel_max", "3\n")
+        facts = SystemFacts(self.root)
+        self.assertEqual(facts.cpu_flags, {"fpu", "vme", "pae", "sse2"})
+        self.assertTrue(facts.cpu_limit_reached)
+
+    def test_mem_total(self):
+        self.assertEqual(SystemFacts(self.root).mem_total, 0)
+        self.write("proc/meminfo",
+                   "MemTotal:         503612 kB\nMemFree:  1024 kB\n")
+        self.assertEqual(SystemFacts(self.root).mem_total, 503612 * 1024)
+
+    def test_hardware(self):
+        self.write("sys/class/dmi/id/sys_vendor", "LENOVO\n")
+        dev = "sys/bus/pci/devices/0000:00:02.0/"
+        self.write(dev + "class", "0x030000\n")
+        self.write(dev + "vendor", "0x8086\n")
+        self.write(dev + "device", "0x2562\n")
+        os.makedirs(os.path.join(self.root, "sys/firmware/efi"))
+        facts = SystemFacts(self.root)
+        self.assertEqual(facts.dmi_vendor, "LENOVO\n")
+        self.assertEqual(facts.pci_devices, [("00:02.0", "0300", "8086:2562")])
+        self.assertEqual(facts.pci_ids, {"8086:2562"})
+        self.assertTrue(facts.efi)
+
+    def test_mounts(self):
+        self.write("proc/mounts",
+                   "/dev/sda2 / ext4 rw,relatime 0 0\n"
+                   "garbage\n"
+                   "/dev/sda1 /boot/efi vfat ro,relatime 0 0\n"
+                   "/dev/sdb1 /media/my\\040disk ext4 rw 0 0\n")
+        facts = SystemFacts(self.root)
+        self.assertEqual(facts.mounts, [
+            Mount("/dev/sda2", "/", "ext4", ("rw", "relatime")),
+            Mount("/dev/sda1", "/boot/efi", "vfat", ("ro", "relatime")),
+            Mount("/dev/sdb1", "/media/my disk", "ext4", ("rw",))])
+        # cached until forgotten
+        self.write("proc/mounts", "")
+        self.assertEqual(len(facts.mounts), 3)
+        facts.forget("mounts")
+        self.assertEqual(facts.mounts, [])
+
+    def test_mount_helpers(self):
+        mounts = [Mount("/dev/sda2", "/", "btrfs", ("rw",)),
+                  Mount("proc", "/proc", "proc", ("rw",)),
+                  Mount("/dev/sda2", "/home", "btrfs", ("rw",)),
+                  Mount("/dev/sda1", "/boot/efi", "vfat", ("rw",)),
+                  Mount("/dev/loop3", "/snap/core/1", "squashfs", ("ro",))]
+        self.assertEqual(mount_point("/boot", mounts), "/")
+        self.assertEqual(mount_point("/boot/efi/EFI", mounts), "/boot/efi")
+        self.assertEqual(mount_point("/homework", mounts), "/")
+        self.assertEqual(writable_filesystems(mounts), ["/", "/boot/efi"])
+
+    def test_missing(self):
+        facts = SystemFacts(self.root)
+        self.assertEqual(facts.kernel_release, "")
+        self.assertEqual(facts.os_release, {})
+        self.assertEqual(facts.cpu_flags, frozenset())
+        self.assertFalse(facts.cpu_limit_reached)
+        self.assertEqual(facts.dmi_vendor, "")
+        self.assertEqual(facts.pci_ids, frozenset())
+        self.assertFalse(facts.efi)
+        self.assertEqual(facts.mounts, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import functools
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from DistUpgrade.DistUpgradeTarballCache import TarballCache, sha256sum
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.requests.append(dict(self.headers))
+        http.server.SimpleHTTPRequestHandler.do_HEAD(self)
+
+
+class TestTarballCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.srvdir = os.path.join(self.tmpdir, "srv")
+        os.mkdir(self.srvdir)
+        self.cachedir = os.path.join(self.tmpdir, "cache")
+        handler = functools.partial(QuietHandler, directory=self.srvdir)
+        self.server = http.server.HTTPServer(("127.0.0.1", 0), handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(self.server.server_close)
+        QuietHandler.requests = []
+        self.uri = "http://127.0.0.1:%s/impish.tar.gz" % (
+            self.server.server_address[1])
+
+    def publish(self, content, mtime=1634212800):
+        """ put a tarball and signature on the server and return
+            the downloaded copies
+        """
+        paths = []
+        for (name, data) in (("impish.tar.gz", content),
+                             ("impish.tar.gz.gpg", b"sig of " + content)):
+            path = os.path.join(self.srvdir, name)
+            with open(path, "wb") as f:
+                f.write(data)
+            os.utime(path, (mtime, mtime))
+            download = os.path.join(self.tmpdir, name)
+            shutil.copy(path, download)
+            paths.append(download)
+        return paths
+
+    def test_conditional_request(self):
+        cache = TarballCache(self.cachedir)
+        (tarball, sig) = self.publish(b"upgrader 1")
+        (found, validators) = cache.lookup(self.uri)
+        self.assertIsNone(found)
+        self.assertTrue(validators["last_modified"])
+        sha256 = cache.add(self.uri, tarball, sig, validators)
+        self.assertEqual(sha256, sha256sum(tarball))
+        # unchanged on the server
+        (found, validators) = cache.lookup(self.uri)
+        self.assertEqual(found, sha256)
+        self.assertIn("If-Modified-Since", QuietHandler.requests[-1])
+        dest = os.path.join(self.tmpdir, "dest")
+        os.mkdir(dest)
+        cache.copy_to(found, os.path.join(dest, "impish.tar.gz"),
+                      os.path.join(dest, "impish.tar.gz.gpg"))
+        with open(os.path.join(dest, "impish.tar.gz.gpg"), "rb") as f:
+            self.assertEqual(f.read(), b"sig of upgrader 1")
+        # a new upload
+        self.publish(b"upgrader 2", mtime=1634299200)
+        (found, validators) = cache.lookup(self.uri)
+        self.assertIsNone(found)
+
+    def test_lookup_by_hash(self):
+        cache = TarballCache(self.cachedir)
+        (tarball, sig) = self.publish(b"upgrader 1")
+        sha256 = cache.add(self.uri, tarball, sig)
+        self.server.shutdown()
+        QuietHandler.requests = []
+        # no request at all with the hash from meta-release
+        self.assertEqual(cache.lookup(self.uri, sha256), (sha256, {}))
+        self.assertEqual(QuietHandler.requests, [])
+        self.assertEqual(cache.lookup(self.uri, "0" * 64), (None, {}))
+        # a damaged file is not used
+        with open(os.path.join(self.cachedir, sha256 + ".tar.gz"), "a") as f:
+            f.write("garbage")
+        self.assertEqual(cache.lookup(self.uri, sha256), (None, {}))
+
+    def test_eviction(self):
+        cache = TarballCache(self.cachedir, max_size=4500)
+        # a file that lost its index entry and one that is not ours
+        os.makedirs(self.cachedir)
+        for name in ("0" * 64 + ".tar.gz", "other.json"):
+            open(os.path.join(self.cachedir, name), "w").close()
+        hashes = []
+        for i in range(4):
+            (tarball, sig) = self.publish(b"%d" % i * 1000)
+            hashes.append(cache.add("%s?%d" % (self.uri, i), tarball, sig))
+        # a tarball and its signature take ~2000 bytes, two fit
+        remaining = set(n.split(".")[0] for n in os.listdir(self.cachedir)
+                        if n not in ("index.json", "other.json"))
+        self.assertEqual(remaining, set(hashes[2:]))
+        self.assertTrue(
+            os.path.exists(os.path.join(self.cachedir, "other.json")))
+
+    def test_unwritable_cache(self):
+        (tarball, sig) = self.publish(b"upgrader 1")
+        not_a_dir = os.path.join(self.tmpdir, "file")
+        open(not_a_dir, "w").close()
+        cache = TarballCache(os.path.join(not_a_dir, "cache"))
+        self.assertIsNone(cache.add(self.uri, tarball, sig))
+        self.assertIsNone(cache.lookup(self.uri)[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
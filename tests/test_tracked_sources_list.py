@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt_pkg
+import os
+import shutil
+import tempfile
+import unittest
+
+from DistUpgrade.DistUpgradeSourcesList import TrackedSourcesList
+
+
+class TestTrackedSourcesList(unittest.TestCase):
+
+    def setUp(self):
+        self.etcdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.etcdir)
+        self.partsdir = os.path.join(self.etcdir, "sources.list.d")
+        os.mkdir(self.partsdir)
+        for key in ("Dir::Etc", "Dir::Etc::sourcelist",
+                    "Dir::Etc::sourceparts"):
+            self.addCleanup(apt_pkg.config.set, key,
+                            apt_pkg.config.find(key))
+        apt_pkg.config.set("Dir::Etc", self.etcdir)
+        apt_pkg.config.set("Dir::Etc::sourcelist", "sources.list")
+        apt_pkg.config.set("Dir::Etc::sourceparts", self.partsdir)
+        with open(os.path.join(self.etcdir, "sources.list"), "w") as f:
+            f.write("deb http://archive.ubuntu.com/ubuntu hirsute main\n")
+        # 1000 entries in 100 snippets, written the way people do
+        for i in range(100):
+            with open(self.part(i), "w") as f:
+                f.write("# snippet %d\n" % i)
+                for j in range(9):
+                    f.write("deb  http://ppa.example.com/%d/ubuntu "
+                            "hirsute   main # %d\n" % (i, j))
+            os.chmod(self.part(i), 0o640)
+
+    def part(self, i):
+        return os.path.join(self.partsdir, "ppa-%03d.list" % i)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_only_changed_files_are_written(self):
+        sources = TrackedSourcesList(withMatcher=False)
+        self.assertEqual(len(sources.list), 1001)
+        self.assertEqual(sources.backup(".distUpgrade"), ".distUpgrade")
+        self.assertEqual(sources.changed_files(), [])
+        originals = dict((i, self.read(self.part(i))) for i in range(100))
+        inodes = dict((i, os.stat(self.part(i)).st_ino) for i in range(100))
+        for entry in sources.list:
+            if entry.uri in ("http://ppa.example.com/7/ubuntu",
+                             "http://ppa.example.com/42/ubuntu"):
+                entry.disabled = True
+        self.assertEqual(sorted(sources.changed_files()),
+                         [self.part(7), self.part(42)])
+        sources.save()
+        for i in range(100):
+            backup = self.part(i) + ".distUpgrade"
+            if i in (7, 42):
+                self.assertNotEqual(self.read(self.part(i)), originals[i])
+                self.assertIn("# deb http://ppa.example.com/%d/ubuntu "
+                              "hirsute main # 0\n" % i,
+                              self.read(self.part(i)))
+                self.assertEqual(self.read(backup), originals[i])
+                # replaced, not written in place
+                self.assertNotEqual(os.stat(self.part(i)).st_ino, inodes[i])
+                self.assertEqual(os.stat(self.part(i)).st_mode & 0o777, 0o640)
+            else:
+                self.assertEqual(self.read(self.part(i)), originals[i])
+                self.assertEqual(os.stat(self.part(i)).st_ino, inodes[i])
+                self.assertFalse(os.path.exists(backup))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.etcdir, "sources.list.distUpgrade")))
+        self.assertEqual(sorted(os.listdir(self.partsdir)),
+                         sorted(["ppa-%03d.list" % i for i in range(100)] +
+                                ["ppa-007.list.distUpgrade",
+                                 "ppa-042.list.distUpgrade"]))
+        # nothing left to write
+        self.assertEqual(sources.changed_files(), [])
+
+    def test_add_and_restore(self):
+        # a stale backup of an earlier upgrade is not restored
+        with open(self.part(3) + ".distUpgrade", "w") as f:
+            f.write("stale\n")
+        sources = TrackedSourcesList(withMatcher=False)
+        sources.backup(".distUpgrade")
+        sources.add("deb", "http://archive.ubuntu.com/ubuntu",
+                    "impish", ["main", "universe"])
+        sources.add("deb", "http://archive.ubuntu.com/ubuntu",
+                    "impish-updates", ["main"],
+                    file=os.path.join(self.partsdir, "new.list"))
+        self.assertEqual(sources.changed_files(), [
+            os.path.join(self.etcdir, "sources.list"),
+            os.path.join(self.partsdir, "new.list")])
+        sources.save()
+        self.assertEqual(
+            self.read(os.path.join(self.partsdir, "new.list")),
+            "deb http://archive.ubuntu.com/ubuntu impish-updates main\n")
+        sources.restore_backup(".distUpgrade")
+        self.assertEqual(
+            self.read(os.path.join(self.etcdir, "sources.list")),
+            "deb http://archive.ubuntu.com/ubuntu hirsute main\n")
+        self.assertNotEqual(self.read(self.part(3)), "stale\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt_pkg
+import os
+import tempfile
+import unittest
+from DistUpgrade.DistUpgradeController import (
+    DistUpgradeController,
+    syncfs,
+)
+from DistUpgrade.DistUpgradeSystemFacts import Mount
+
+import mock
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestUnsafeIo(unittest.TestCase):
+
+    testdir = os.path.abspath(CURDIR + "/data-sources-list-test/")
+
+    def setUp(self):
+        options = apt_pkg.config.value_list("DPkg::Options")
+        self.addCleanup(self._restore, options)
+        self.controller = DistUpgradeController(mock.Mock(),
+                                                datadir=self.testdir)
+        self.controller.facts = mock.Mock()
+        self.controller.facts.mounts = [
+            Mount("/dev/sda2", "/", "btrfs", ("rw",)),
+            Mount("tmpfs", "/run", "tmpfs", ("rw",)),
+            Mount("/dev/sda1", "/boot/efi", "vfat", ("rw",))]
+
+    def _restore(self, options):
+        apt_pkg.config.clear("DPkg::Options")
+        for option in options:
+            apt_pkg.config.set("DPkg::Options::", option)
+
+    @mock.patch("DistUpgrade.DistUpgradeController.syncfs")
+    def test_enable_disable(self, mock_syncfs):
+        apt_pkg.config.set("DPkg::Options::", "--force-confold")
+        self.assertTrue(self.controller._enableUnsafeIo())
+        self.assertIn("--force-unsafe-io",
+                      apt_pkg.config.value_list("DPkg::Options"))
+        self.assertFalse(mock_syncfs.called)
+        self.controller._disableUnsafeIo()
+        options = apt_pkg.config.value_list("DPkg::Options")
+        self.assertNotIn("--force-unsafe-io", options)
+        self.assertIn("--force-confold", options)
+        # every filesystem dpkg may have written to
+        self.assertEqual(mock_syncfs.call_args_list,
+                         [mock.call("/"), mock.call("/boot/efi")])
+
+    def test_separate_boot(self):
+        self.controller.facts.mounts.append(
+            Mount("/dev/sda3", "/boot", "ext4", ("rw",)))
+        self.assertFalse(self.controller._enableUnsafeIo())
+        self.assertNotIn("--force-unsafe-io",
+                         apt_pkg.config.value_list("DPkg::Options"))
+
+    def test_config_override(self):
+        self.controller.config.set("Distro", "UnsafeIoWithSnapshot", "no")
+        self.assertFalse(self.controller._enableUnsafeIo())
+        self.assertNotIn("--force-unsafe-io",
+                         apt_pkg.config.value_list("DPkg::Options"))
+
+    @mock.patch("DistUpgrade.DistUpgradeController.DistUpgradeController."
+                "_is_apt_btrfs_snapshot_supported")
+    def test_no_snapshot(self, mock_supported):
+        mock_supported.return_value = False
+        self.assertFalse(self.controller._maybe_create_apt_btrfs_snapshot())
+
+    def test_syncfs(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b"data")
+            syncfs(f.name)
+        with mock.patch("ctypes.CDLL") as mock_cdll, \
+                mock.patch("os.sync") as mock_sync:
+            mock_cdll.return_value.syncfs.return_value = -1
+            syncfs("/")
+            self.assertTrue(mock_sync.called)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt_pkg
+import os
+import shutil
+import tempfile
+import unittest
+
+from aptsources.sourceslist import SourceEntry, SourceEntryMatcher
+from DistUpgrade.DistUpgradeDistro import (
+    CountryTable,
+    ISO_3166_FILE,
+    UpgradeDistribution,
+    get_distro,
+)
+from DistUpgrade.DistUpgradeSourcesList import (
+    IndexedSourceEntryMatcher,
+    TrackedSourcesList,
+)
+from DistUpgrade.distro import UbuntuDistribution
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+DATADIR = os.path.join(CURDIR, "data-sources-list-test")
+
+
+class TestCountryTable(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.fname = os.path.join(self.tmpdir, "iso_3166.xml")
+        with open(self.fname, "w") as f:
+            f.write("""<?xml version="1.0" encoding="UTF-8" ?>
+<iso_3166_entries>
+  <iso_3166_entry alpha_2_code="DE" alpha_3_code="DEU" name="Germany"/>
+  <iso_3166_entry alpha_2_code="TW" name="Taiwan, Province of China"
+                  common_name="Taiwan"/>
+  <iso_3166_entry alpha_3_code="XKX" name="Kosovo"/>
+</iso_3166_entries>
+""")
+
+    def test_on_demand(self):
+        countries = CountryTable(self.fname)
+        self.assertEqual(countries["de"], "Germany")
+        # only read as far as needed
+        self.assertEqual(list(countries._names), ["de"])
+        self.assertNotIn("fr", countries)
+        self.assertEqual(countries["tw"], "Taiwan")
+        self.assertEqual(countries["xkx"], "Kosovo")
+        self.assertEqual(len(countries), 3)
+
+    def test_missing_file(self):
+        countries = CountryTable(os.path.join(self.tmpdir, "missing.xml"))
+        self.assertNotIn("de", countries)
+        self.assertEqual(len(countries), 0)
+
+    @unittest.skipUnless(os.path.exists(ISO_3166_FILE), "needs iso-codes")
+    def test_system_table(self):
+        countries = CountryTable()
+        self.assertIn("de", countries)
+        self.assertGreater(len(countries), 200)
+
+
+class TestIndexedMatching(unittest.TestCase):
+
+    def test_same_templates(self):
+        matcher = SourceEntryMatcher(DATADIR)
+        indexed = IndexedSourceEntryMatcher(matcher.templates)
+        lines = []
+        for dist in ("hardy", "gutsy", "gutsy-updates", "gutsy-security",
+                     "feisty-proposed", "hardy-backports", "sid", "stable"):
+            for uri in ("http://archive.ubuntu.com/ubuntu",
+                        "http://de.archive.ubuntu.com/ubuntu/",
+                        "http://security.ubuntu.com/ubuntu",
+                        "http://ports.ubuntu.com/ubuntu-ports/",
+                        "http://archive.canonical.com/ubuntu",
+                        "cdrom:[Ubuntu 8.04 _Hardy Heron_]/",
+                        "http://ppa.launchpad.net/x/y/ubuntu"):
+                for t in ("deb", "deb-src"):
+                    lines.append("%s %s %s main\n" % (t, uri, dist))
+        matched = 0
+        for line in lines:
+            (a, b) = (SourceEntry(line), SourceEntry(line))
+            self.assertEqual(matcher.match(a), indexed.match(b), line)
+            self.assertIs(a.template, b.template, line)
+            matched += a.template is not None
+        self.assertGreater(matched, 0)
+        self.assertEqual(
+            indexed.templates_named("gutsy"),
+            [t for t in matcher.templates if t.name == "gutsy"])
+
+
+class TestUpgradeDistribution(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        for key in ("Dir::Etc", "Dir::Etc::sourcelist",
+                    "Dir::Etc::sourceparts", "APT::Architecture"):
+            self.addCleanup(apt_pkg.config.set, key,
+                            apt_pkg.config.find(key))
+        # the ports templates match other architectures
+        apt_pkg.config.set("APT::Architecture", "amd64")
+        apt_pkg.config.set("Dir::Etc", self.tmpdir)
+        apt_pkg.config.set("Dir::Etc::sourcelist", "sources.list")
+        apt_pkg.config.set("Dir::Etc::sourceparts",
+                           os.path.join(self.tmpdir, "sources.list.d"))
+        shutil.copy(os.path.join(DATADIR, "sources.list.in"),
+                    os.path.join(self.tmpdir, "sources.list"))
+
+    def test_get_distro(self):
+        distro = get_distro("Ubuntu", "feisty", "Ubuntu Feisty Fawn", "7.04")
+        self.assertIsInstance(distro, UpgradeDistribution)
+        self.assertNotIsInstance(
+            get_distro("Debian", "sid", "Debian sid", "unstable"),
+            UpgradeDistribution)
+
+    def test_same_sources(self):
+        sources = TrackedSourcesList(matcherPath=DATADIR)
+        args = ("Ubuntu", "feisty", "Ubuntu Feisty Fawn", "7.04")
+        plain = UbuntuDistribution(*args)
+        plain.get_sources(sources)
+        upgrade = UpgradeDistribution(*args)
+        upgrade.get_sources(sources)
+        self.assertIs(upgrade.sourceslist, sources)
+        self.assertIs(upgrade.source_template, plain.source_template)
+        for attr in ("main_sources", "child_sources", "disabled_sources",
+                     "source_code_sources", "enabled_comps",
+                     "used_servers", "default_server", "main_server",
+                     "nearest_server"):
+            self.assertEqual(getattr(upgrade, attr), getattr(plain, attr),
+                             attr)
+        self.assertTrue(upgrade.main_sources)
+        # adding a component still works on the real list
+        upgrade.enable_component("universe")
+        self.assertIn("universe", upgrade.main_sources[0].comps)
+
+
+if __name__ == "__main__":
+    unittest.main()
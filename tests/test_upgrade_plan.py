@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# -*- Mode: Python; indent-tabs-mode: nil; tab-width: 4; coding: utf-8 -*-
+
+import apt_pkg
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from configparser import ConfigParser
+
+from DistUpgrade.DistUpgradePlan import (
+    UpgradePlan,
+    UpgradePlanStore,
+    system_fingerprint,
+)
+
+
+class TestUpgradePlan(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        os.makedirs(os.path.join(self.tmpdir, "sources.list.d"))
+        os.makedirs(os.path.join(self.tmpdir, "lists"))
+        self.status = os.path.join(self.tmpdir, "status")
+        with open(self.status, "w") as f:
+            f.write("Package: bash\nStatus: install ok installed\n")
+        with open(os.path.join(self.tmpdir, "sources.list"), "w") as f:
+            f.write("deb http://archive.ubuntu.com/ubuntu impish main\n")
+        for (key, value) in (
+                ("Dir::State::status", self.status),
+                ("Dir::State::extended_states",
+                 os.path.join(self.tmpdir, "extended_states")),
+                ("Dir::Etc::sourcelist",
+                 os.path.join(self.tmpdir, "sources.list")),
+                ("Dir::Etc::sourceparts",
+                 os.path.join(self.tmpdir, "sources.list.d")),
+                ("Dir::State::lists", os.path.join(self.tmpdir, "lists"))):
+            old = apt_pkg.config.find(key)
+            self.addCleanup(apt_pkg.config.set, key, old)
+            apt_pkg.config.set(key, value)
+        self.config = ConfigParser()
+        self.config.read_string("[Sources]\nFrom=hirsute\nTo=impish\n")
+        self.facts = {"kernel": "5.11.0-generic", "serverMode": False}
+
+    def test_fingerprint_inputs(self):
+        fp = system_fingerprint("DistUpgrade", self.config, self.facts)
+        self.assertEqual(
+            fp, system_fingerprint("DistUpgrade", self.config, self.facts))
+        # every stage has its own fingerprint
+        self.assertNotEqual(
+            fp, system_fingerprint("Cleanup", self.config, self.facts))
+        # the plan location is not part of the inputs
+        self.config.add_section("Plan")
+        self.config.set("Plan", "ExportDir", self.tmpdir)
+        self.assertEqual(
+            fp, system_fingerprint("DistUpgrade", self.config, self.facts))
+        # quirk facts
+        facts = dict(self.facts, kernel="5.13.0-generic")
+        self.assertNotEqual(
+            fp, system_fingerprint("DistUpgrade", self.config, facts))
+        # config
+        self.config.set("Sources", "To", "jammy")
+        self.assertNotEqual(
+            fp, system_fingerprint("DistUpgrade", self.config, self.facts))
+        self.config.set("Sources", "To", "impish")
+        # dpkg status
+        with open(self.status, "a") as f:
+            f.write("\nPackage: zsh\nStatus: install ok installed\n")
+        self.assertNotEqual(
+            fp, system_fingerprint("DistUpgrade", self.config, self.facts))
+
+    def test_export_import(self):
+        plandir = os.path.join(self.tmpdir, "plans")
+        fp = system_fingerprint("DistUpgrade", self.config, self.facts)
+        changes = [{"name": "bash", "action": "upgrade",
+                    "version": "5.1-3ubuntu2", "auto": False}]
+        path = UpgradePlanStore(export_dir=plandir).save(
+            UpgradePlan("DistUpgrade", fp, {"changes": changes}))
+        self.assertTrue(os.path.exists(path))
+        for location in (plandir, path, "file://" + plandir):
+            plan = UpgradePlanStore(import_location=location).lookup(
+                "DistUpgrade", fp)
+            self.assertEqual(plan.data["changes"], changes)
+            self.assertFalse(plan.applied)
+
+    def test_mismatch_falls_back(self):
+        plandir = os.path.join(self.tmpdir, "plans")
+        fp = system_fingerprint("DistUpgrade", self.config, self.facts)
+        path = UpgradePlanStore(export_dir=plandir).save(
+            UpgradePlan("DistUpgrade", fp, {"changes": []}))
+        store = UpgradePlanStore(import_location=path)
+        self.assertIsNone(store.lookup("DistUpgrade", "0" * 64))
+        self.assertIsNone(store.lookup("Cleanup", fp))
+        # a plan that claims a fingerprint it was not stored under
+        with open(path) as f:
+            content = json.load(f)
+        content["fingerprint"] = "0" * 64
+        with open(path, "w") as f:
+            json.dump(content, f)
+        self.assertIsNone(
+            UpgradePlanStore(import_location=plandir).lookup(
+                "DistUpgrade", fp))
+        # remote locations are not supported
+        store = UpgradePlanStore(import_location="http://example.com/")
+        self.assertFalse(store.enabled)
+
+
+if __name__ == "__main__":
+    unittest.main()
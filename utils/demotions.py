@@ -1,141 +1,190 @@
 #! /usr/bin/env python3
 #
-# FIXME: strip "TryExec" from the extracted menu files (and noDisplay)
+# Find the packages that were demoted from main/restricted to
+# universe/multiverse between two releases, for DistUpgrade/demoted.cfg.
 #
-# TODO:
-# - emacs21 ships it's icon in emacs-data, deal with this
-# - some stuff needs to be blacklisted (e.g. gnome-about)
-# - lots of packages have their desktop file in "-data", "-comon" (e.g. anjuta)
-# - lots of packages have multiple desktop files for the same application
-#   abiword, abiword-gnome, abiword-gtk
+# The Packages indexes of all components and architectures are streamed
+# through apt_pkg.TagFile in parallel, without an apt cache. The mirror
+# can be a local directory (or file:// URL) with the usual dists/ layout,
+# e.g. to run it offline.
+#
+# Usage: demotions.py [--mirror URL] [--arch ARCH]... OLD NEW
 
 from __future__ import print_function
 
-import apt
 import apt_pkg
+import argparse
+import hashlib
 import os
-import sys
-import warnings
-warnings.filterwarnings("ignore", "apt API not stable yet", FutureWarning)
-#import xdg.Menu
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from urllib.request import url2pathname, urlopen
 
 ARCHES = ["i386", "amd64"]
-#ARCHES = ["i386"]
-
-
-# pkgs in main for the given dist
-class Dist(object):
-    def __init__(self, name):
-        self.name = name
-        self.pkgs_in_comp = {}
-
-
-def get_replace(cache, pkgname):
-    replaces = set()
-    if pkgname not in cache:
-        #print("can not find '%s'" % pkgname)
-        return replaces
-    pkg = cache[pkgname]
-    ver = cache._depcache.get_candidate_ver(pkg._pkg)
-    if not ver:
-        return replaces
-    depends = ver.depends_list
-    for t in ["Replaces"]:
-        if t not in depends:
-            continue
-        for depVerList in depends[t]:
-            for depOr in depVerList:
-                replaces.add(depOr.target_pkg.name)
-    return replaces
-
-
-def in_universe(pkg, new):
-    # check what moved to universe and what was removed (or renamed)
-    if pkg in new.pkgs_in_comp["universe"] or \
-            pkg in new.pkgs_in_comp["multiverse"]:
-        return True
-    return False
+MIRROR = "http://archive.ubuntu.com/ubuntu"
+KEYRING = "/usr/share/keyrings/ubuntu-archive-keyring.gpg"
+# in order of preference
+COMPRESSIONS = (".xz", ".gz", "")
 
 
-if __name__ == "__main__":
+def _open(mirror, path):
+    """ open path below the mirror, a URL or a local directory """
+    if "://" not in mirror or mirror.startswith("file:"):
+        if mirror.startswith("file:"):
+            mirror = url2pathname(urlsplit(mirror).path)
+        return open(os.path.join(mirror, path), "rb")
+    return urlopen("%s/%s" % (mirror.rstrip("/"), path))
+
+
+def _strip_signature(text):
+    """ the content of a clearsigned InRelease file """
+    if not text.startswith("-----BEGIN PGP SIGNED MESSAGE-----"):
+        return text
+    text = text.split("\n\n", 1)[1]
+    return text.split("\n-----BEGIN PGP SIGNATURE-----", 1)[0] + "\n"
+
 
-    # init
-    apt_pkg.config.set("Dir::state", "./apt/")
-    apt_pkg.config.set("Dir::Etc", "./apt")
-    apt_pkg.config.set("Dir::State::status", "./apt/status")
-    apt_pkg.config.clear("APT::Update")
+def read_release(mirror, dist, keyring, workdir):
+    """ return {path: (sha256, size)} of the files of the dist """
     try:
-        os.makedirs("apt/lists/partial")
-    except OSError:
-        pass
-
-    old = Dist(sys.argv[1])  # Dist("gutsy")
-    new = Dist(sys.argv[2])  # Dist("hardy")
-
-    # go over the dists to find main pkgs
-    for dist in [old, new]:
-
-        for comp in ["main", "restricted", "universe", "multiverse"]:
-            line = "deb http://archive.ubuntu.com/ubuntu %s %s\n" % \
-                   (dist.name, comp)
-            with open("apt/sources.list", "w") as sources_list:
-                sources_list.write(line)
-            dist.pkgs_in_comp[comp] = set()
-
-            # and the archs
-            for arch in ARCHES:
-                apt_pkg.config.set("APT::Architecture", arch)
-                apt_pkg.config.set("APT::Architectures", arch)
-                cache = apt.Cache(apt.progress.base.OpProgress())
-                prog = apt.progress.base.AcquireProgress()
-                keyring = "/usr/share/keyrings/ubuntu-archive-keyring.gpg"
-                apt_pkg.config.set("Dir::Etc::Trusted", keyring)
-                cache.update(prog)
-                cache.open(apt.progress.base.OpProgress())
-                for pkg in cache:
-                    if ":" in pkg.name:
-                        continue
-                    dist.pkgs_in_comp[comp].add(pkg.name)
+        with _open(mirror, "dists/%s/InRelease" % dist) as f:
+            data = f.read()
+    except (IOError, OSError):
+        if keyring:
+            raise
+        # an unsigned local mirror
+        with _open(mirror, "dists/%s/Release" % dist) as f:
+            data = f.read()
+    if keyring:
+        path = os.path.join(workdir, "%s_InRelease" % dist)
+        with open(path, "wb") as f:
+            f.write(data)
+        subprocess.check_call(["gpgv", "--keyring", keyring, path],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    section = apt_pkg.TagSection(_strip_signature(data.decode("utf-8")))
+    files = {}
+    for line in section.get("SHA256", "").splitlines():
+        fields = line.split()
+        if len(fields) == 3:
+            files[fields[2]] = (fields[0], int(fields[1]))
+    return files
+
+
+def fetch_index(mirror, dist, comp, arch, release, workdir):
+    """ download the Packages index and check it against the Release
+        file, returns the local path
+    """
+    base = "%s/binary-%s/Packages" % (comp, arch)
+    for ext in COMPRESSIONS:
+        if base + ext in release:
+            break
+    else:
+        raise IOError("no %s in the Release file of %s" % (base, dist))
+    (sha256, size) = release[base + ext]
+    path = os.path.join(workdir,
+                        "%s_%s_%s_Packages%s" % (dist, comp, arch, ext))
+    h = hashlib.sha256()
+    with _open(mirror, "dists/%s/%s" % (dist, base + ext)) as src, \
+            open(path, "wb") as dst:
+        for block in iter(lambda: src.read(64 * 1024), b""):
+            h.update(block)
+            dst.write(block)
+    if h.hexdigest() != sha256 or os.path.getsize(path) != size:
+        raise IOError("hash sum mismatch for %s %s" % (dist, base + ext))
+    return path
+
+
+def scan_index(path, with_replaces=False):
+    """ return the package names and {name: replaced names} """
+    names = set()
+    replaces = {}
+    for section in apt_pkg.TagFile(path):
+        name = section["Package"]
+        names.add(name)
+        if with_replaces and "Replaces" in section:
+            replaced = replaces.setdefault(name, set())
+            for or_group in apt_pkg.parse_depends(section["Replaces"]):
+                replaced.update(dep[0] for dep in or_group)
+    return (names, replaces)
+
+
+def find_demotions(old, new, mirror=MIRROR, arches=ARCHES, keyring=KEYRING,
+                   jobs=None):
+    """ the sorted list of packages demoted between old and new """
+    # what is needed of which dist
+    wanted = [(old, "main"), (old, "restricted"),
+              (new, "main"), (new, "restricted"),
+              (new, "universe"), (new, "multiverse")]
+    workdir = tempfile.mkdtemp(prefix="demotions-")
+    try:
+        releases = dict((dist, read_release(mirror, dist, keyring, workdir))
+                        for dist in (old, new))
+
+        def scan(job):
+            (dist, comp, arch) = job
+            path = fetch_index(mirror, dist, comp, arch, releases[dist],
+                               workdir)
+            try:
+                return scan_index(path, (dist, comp) == (new, "main"))
+            finally:
+                os.unlink(path)
+
+        work = [(dist, comp, arch) for (dist, comp) in wanted
+                for arch in arches]
+        with ThreadPoolExecutor(max_workers=jobs or len(work)) as executor:
+            results = list(executor.map(scan, work))
+    finally:
+        shutil.rmtree(workdir)
+
+    pkgs_in_comp = dict(((dist, comp), set()) for (dist, comp) in wanted)
+    replaces = {}
+    for ((dist, comp, arch), (names, index_replaces)) in zip(work, results):
+        pkgs_in_comp[(dist, comp)] |= names
+        for (name, replaced) in index_replaces.items():
+            replaces.setdefault(name, set()).update(replaced)
 
     # check what is no longer in main
-    no_longer_main = old.pkgs_in_comp["main"] - new.pkgs_in_comp["main"]
-    no_longer_main |= (old.pkgs_in_comp["restricted"] -
-                       new.pkgs_in_comp["restricted"])
-
-    # this stuff was demoted and is in universe
-    #print([pkg for pkg in no_longer_main if not in_universe(pkg, new)])
-    demoted = [pkg for pkg in no_longer_main if in_universe(pkg, new)]
-    demoted.sort()
-
-    # remove items that are now in universe, but are replaced by something
-    # in main (pidgin, gaim) etc
-    #print("Looking for replaces")
-    line = "deb http://archive.ubuntu.com/ubuntu %s %s\n" % (new.name, "main")
-    with open("apt/sources.list", "w") as sources_list:
-        sources_list.write(line)
-    dist.pkgs_in_comp[comp] = set()
-    for arch in ARCHES:
-        apt_pkg.config.set("APT::Architecture", arch)
-        apt_pkg.config.set("APT::Architectures", arch)
-        cache = apt.Cache(apt.progress.base.OpProgress())
-        prog = apt.progress.base.AcquireProgress()
-        cache.update(prog)
-        cache.open(apt.progress.base.OpProgress())
-        # go over the packages in "main" and check if they replaces something
-        # that we think is a demotion
-        for pkgname in new.pkgs_in_comp["main"]:
-            replaces = get_replace(cache, pkgname)
-            for r in replaces:
-                if r in demoted:
-                    #print("found '%s' that is demoted but replaced by '%s'" %
-                    #(r, pkgname))
-                    demoted.remove(r)
-
-    #outfile = "demoted.cfg"
-    #print("writing the demotion info to '%s'" % outfile)
-    # write it out
-    #out = open(outfile,"w")
-    #out.write("# demoted packages\n")
-    #out.write("\n".join(demoted))
-    print("# demoted packages from %s to %s" % (sys.argv[1], sys.argv[2]))
+    no_longer_main = (pkgs_in_comp[(old, "main")] -
+                      pkgs_in_comp[(new, "main")])
+    no_longer_main |= (pkgs_in_comp[(old, "restricted")] -
+                       pkgs_in_comp[(new, "restricted")])
+    # this stuff was demoted and is in universe (the rest was removed
+    # or renamed)
+    universe = (pkgs_in_comp[(new, "universe")] |
+                pkgs_in_comp[(new, "multiverse")])
+    demoted = no_longer_main & universe
+    # remove items that are now in universe, but are replaced by
+    # something in main (pidgin, gaim) etc
+    for replaced in replaces.values():
+        demoted -= replaced
+    return sorted(demoted)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="list the packages demoted between two releases")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--mirror", default=MIRROR,
+                        help="archive URL or local directory "
+                             "(default: %(default)s)")
+    parser.add_argument("--arch", action="append", dest="arches",
+                        help="architecture, can be given more than once "
+                             "(default: %s)" % " ".join(ARCHES))
+    parser.add_argument("--keyring", default=KEYRING,
+                        help="keyring to verify the InRelease files with, "
+                             "empty to skip the check (default: "
+                             "%(default)s)")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="indexes to fetch in parallel")
+    args = parser.parse_args()
+
+    apt_pkg.init_config()
+    demoted = find_demotions(args.old, args.new, args.mirror,
+                             args.arches or ARCHES, args.keyring, args.jobs)
+    print("# demoted packages from %s to %s" % (args.old, args.new))
     print("\n".join(demoted))